@@ -0,0 +1,398 @@
+import bisect
+import heapq
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+from sheet_cache import TAIL_OVERLAP_ROWS
+
+NO_PLAYER = -1
+DAY = 86400  # 按天汇总用 (时间按表格里的本地时间换算，所以一天从本地 0 点开始)
+SCORE_MISSING = np.iinfo(np.int32).min  # 分数为空 / 无法解析
+
+# Games/pt A 列可能出现的时间格式
+DATE_FORMATS = [
+    "%m/%d/%Y %H:%M",     # 01/05/2026 14:30
+    "%m/%d/%Y %H:%M:%S",  # 01/05/2026 14:30:00
+    "%Y-%m-%d %H:%M",     # 2026-01-05 14:30
+    "%Y-%m-%d %H:%M:%S",  # 2026-01-05 14:30:00 (/record_game 写入的格式)
+    "%Y/%m/%d %H:%M",     # 2026/01/05 14:30
+]
+
+
+def canonical_name(name):
+    """玩家名字的统一写法 (小写 + 去空格)"""
+    return str(name).lower().strip()
+
+
+def parse_game_time(raw):
+    """Games/pt 的时间字符串 -> datetime (不带时区)；无法解析返回 None"""
+    # 把中文冒号换成英文冒号，多个空格缩成一个
+    clean = str(raw).strip().replace("：", ":").replace("  ", " ")
+    if not clean:
+        return None
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(clean, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def to_epoch(dt):
+    """不带时区的 datetime -> 秒数 (按表格里的本地时间原样换算，不做时区转换)"""
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _parse_int(value):
+    try:
+        return int(float(str(value).strip()))
+    except (ValueError, TypeError, OverflowError):
+        return SCORE_MISSING
+
+
+def _parse_float(value):
+    try:
+        return float(str(value).strip())
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def compute_placements(scores):
+    """
+    (N, 4) 分数 -> (N, 4) 顺位，一次算完所有对局。
+    顺位 = 比自己分高的人数 + 1，同分同顺位 (例如 1, 1, 3, 4)；自己分数为空记 0 (未知)
+    """
+    scores = np.asarray(scores)
+    higher = (scores[:, None, :] > scores[:, :, None]).sum(axis=2)
+    placements = (higher + 1).astype(np.int8)
+    placements[scores == SCORE_MISSING] = 0
+    return placements
+
+
+def f32_to_float(value):
+    """float32 -> Python float，保留表格里的写法 (1523.4 而不是 1523.4000244)"""
+    return float(str(value))
+
+
+# --- 1. 一张对局表的列式存储 + 玩家倒排索引 ---
+class _GameBlock:
+    """
+    数组第 i 行对应 snapshot.rows[i] (第 0 行是表头，不用)。
+    快照只在末尾追加时增量解析；generation 变了 (完整重读过) 就重建。
+    末尾几行的公式可能还没算完，每次同步都重新解析这几行。
+    """
+
+    name_cols = (0, 1, 2, 3)
+    # (属性名, 每行形状, dtype, 空值)
+    columns = []
+
+    def __init__(self, table):
+        self.table = table
+        self._reset(None)
+
+    def _all_columns(self):
+        return [("ids", (4,), np.int32, NO_PLAYER), ("filled", (), bool, False)] + self.columns
+
+    def _reset(self, generation):
+        self.generation = generation
+        self.n = 1  # 已解析的行数 (含表头)
+        self.capacity = 0
+        for attr, shape, dtype, fill in self._all_columns():
+            setattr(self, attr, np.full((0,) + shape, fill, dtype=dtype))
+        self.by_player = {}  # 玩家 ID -> [行号, ...] (升序)
+        self.filled_rows = []  # 第一个名字列不为空的行号
+        self._synced = None
+        self._grow(64)
+
+    def _grow(self, capacity):
+        for attr, shape, dtype, fill in self._all_columns():
+            old = getattr(self, attr)
+            new = np.full((capacity,) + shape, fill, dtype=dtype)
+            new[:len(old)] = old
+            setattr(self, attr, new)
+        self.capacity = capacity
+
+    @property
+    def rows(self):
+        """
+        当前数组对应的快照原始数据 (显示用：表格原文、去重指纹)。
+        就是 SheetCache 快照里的同一个列表，不复制；下次同步换成新快照后旧的随即释放
+        """
+        return self._synced.rows if self._synced is not None else []
+
+    def sync(self, snapshot, reindex_tail=TAIL_OVERLAP_ROWS):
+        if snapshot is self._synced:
+            return
+        if self._synced is not None and (
+            snapshot.generation < self.generation
+            or (snapshot.generation == self.generation and len(snapshot.rows) < self.n)
+        ):
+            return  # 别的线程已经同步过更新的快照
+        if self.generation != snapshot.generation:
+            self._reset(snapshot.generation)
+        rows = snapshot.rows
+        start = max(1, min(self.n, len(rows) - reindex_tail))
+        self._drop_from(start)
+        if len(rows) > self.capacity:
+            self._grow(max(len(rows), self.capacity * 2))
+        for pos in range(start, len(rows)):
+            self._parse_row(pos, rows[pos])
+        self._after_parse(start, len(rows))
+        self.n = max(len(rows), 1)
+        self._synced = snapshot
+
+    def _after_parse(self, start, end):
+        """start..end 行解析完之后的整块计算 (子类覆盖)"""
+
+    def _drop_from(self, start):
+        """撤销 start 行及之后的数据和索引 (这些行号一定在各列表末尾)"""
+        for pos in range(self.n - 1, start - 1, -1):
+            for pid in set(self.ids[pos].tolist()):
+                positions = self.by_player.get(pid)
+                if positions and positions[-1] == pos:
+                    positions.pop()
+        while self.filled_rows and self.filled_rows[-1] >= start:
+            self.filled_rows.pop()
+        for attr, shape, dtype, fill in self._all_columns():
+            getattr(self, attr)[start:self.n] = fill
+
+    def _parse_row(self, pos, row):
+        seen = []
+        for seat, col in enumerate(self.name_cols):
+            key = canonical_name(row[col]) if col < len(row) else ""
+            if not key:
+                continue
+            pid = self.table.intern(key, row[col].strip())
+            self.ids[pos, seat] = pid
+            if pid not in seen:
+                seen.append(pid)
+                self.by_player.setdefault(pid, []).append(pos)
+        first = self.name_cols[0]
+        if first < len(row) and row[first].strip():
+            self.filled[pos] = True
+            self.filled_rows.append(pos)
+
+    # --- 查询 ---
+    def window_start(self, limit, max_rows):
+        """行号 < max_rows 的有效行里，倒数第 limit 行的行号 (不足 limit 行则从第 1 行开始)"""
+        end = bisect.bisect_left(self.filled_rows, max_rows)
+        if end <= limit:
+            return 1
+        return self.filled_rows[end - limit]
+
+    def rows_for(self, ids):
+        """这些玩家参与过的所有行号 (升序、去重)"""
+        lists = [list(self.by_player.get(pid, ())) for pid in ids]
+        if len(lists) == 1:
+            return lists[0]
+        merged = []
+        for pos in heapq.merge(*lists):
+            if not merged or merged[-1] != pos:
+                merged.append(pos)
+        return merged
+
+    def shared_rows(self, id_a, id_b):
+        """两名玩家同桌的行号 (两个有序列表求交集)"""
+        a = self.by_player.get(id_a, ())
+        b = self.by_player.get(id_b, ())
+        i = j = 0
+        result = []
+        while i < len(a) and j < len(b):
+            if a[i] == b[j]:
+                result.append(a[i])
+                i += 1
+                j += 1
+            elif a[i] < b[j]:
+                i += 1
+            else:
+                j += 1
+        return result
+
+    def seat_of(self, pos, ids):
+        """这一行里第一个属于 ids 的座位 (0-3)，没有返回 -1"""
+        for seat, pid in enumerate(self.ids[pos].tolist()):
+            if pid in ids:
+                return seat
+        return -1
+
+
+class RiichiBlock(_GameBlock):
+    """Games Riichi: A-D 名字, E-H 分数, I-L MMR 变动, M-P MMR 绝对值"""
+
+    name_cols = (0, 1, 2, 3)
+    columns = [
+        ("scores", (4,), np.int32, SCORE_MISSING),
+        ("mmr_delta", (4,), np.float32, np.nan),
+        ("mmr", (4,), np.float32, np.nan),
+        ("placements", (4,), np.int8, 0),  # 顺位矩阵 (0 = 分数为空)
+    ]
+
+    def _parse_row(self, pos, row):
+        super()._parse_row(pos, row)
+        for seat in range(4):
+            self.scores[pos, seat] = _parse_int(row[4 + seat]) if len(row) > 4 + seat and row[4 + seat] else SCORE_MISSING
+            self.mmr_delta[pos, seat] = _parse_float(row[8 + seat]) if len(row) > 8 + seat else np.nan
+            self.mmr[pos, seat] = _parse_float(row[12 + seat]) if len(row) > 12 + seat else np.nan
+
+    def _after_parse(self, start, end):
+        if end > start:
+            self.placements[start:end] = compute_placements(self.scores[start:end])
+
+
+class PtBlock(_GameBlock):
+    """
+    Games/pt: A 时间, B/E/H/K 名字, D/G/J/M PT
+    时间只在解析时转换一次；另外维护按时间排序的 (epoch, 行号) 索引，区间查询二分找到上下界。
+    有名字但时间无法解析的行记在 bad_dates 里 (这些对局不会出现在任何时间区间)
+    """
+
+    name_cols = (1, 4, 7, 10)
+    columns = [
+        ("pt", (4,), np.float32, np.nan),
+        ("timestamps", (), np.float64, np.nan),  # epoch 秒，无法解析为 NaN
+    ]
+
+    def _reset(self, generation):
+        super()._reset(generation)
+        self.time_sorted = np.empty(0, dtype=np.float64)  # 升序的 epoch
+        self.time_rows = np.empty(0, dtype=np.int32)  # 对应的行号 (同一时间按行号升序)
+        self.bad_dates = []  # [(行号, 原始文字), ...] 升序
+        self.daily = {}  # 天 (epoch // DAY) -> {玩家 ID: [场数, PT]}
+        self.days = []  # 有对局的天 (升序)
+        self._dirty_days = set()  # 本次同步里行有变动、需要重算的天
+
+    def _parse_row(self, pos, row):
+        super()._parse_row(pos, row)
+        for seat in range(4):
+            col = 3 + seat * 3
+            # 空白按 0 算，非数字为 NaN
+            self.pt[pos, seat] = (_parse_float(row[col]) if row[col] else 0.0) if len(row) > col else np.nan
+        dt = parse_game_time(row[0]) if row else None
+        self.timestamps[pos] = to_epoch(dt) if dt else np.nan
+        if dt is None and (self.filled[pos] or (row and row[0].strip())):
+            self.bad_dates.append((pos, row[0] if row else ""))
+
+    def _after_parse(self, start, end):
+        # 新行按时间插入排序索引 (新对局基本都在末尾，插入位置靠后)
+        positions = np.arange(start, end, dtype=np.int32)
+        times = self.timestamps[start:end]
+        valid = ~np.isnan(times)
+        positions, times = positions[valid], times[valid]
+        if len(times):
+            order = np.argsort(times, kind="stable")
+            positions, times = positions[order], times[order]
+            at = np.searchsorted(self.time_sorted, times, side="right")
+            self.time_sorted = np.insert(self.time_sorted, at, times)
+            self.time_rows = np.insert(self.time_rows, at, positions)
+            self._dirty_days.update((times // DAY).astype(np.int64).tolist())
+        # 只重算这次有行进出的那几天
+        for day in self._dirty_days:
+            self._rebuild_day(day)
+        self._dirty_days = set()
+
+    def _drop_from(self, start):
+        keep = self.time_rows < start
+        if not keep.all():
+            self._dirty_days.update((self.time_sorted[~keep] // DAY).astype(np.int64).tolist())
+            self.time_sorted = self.time_sorted[keep]
+            self.time_rows = self.time_rows[keep]
+        while self.bad_dates and self.bad_dates[-1][0] >= start:
+            self.bad_dates.pop()
+        super()._drop_from(start)
+
+    # --- 按天汇总 (玩家, 天) -> 场数, PT ---
+    def _rebuild_day(self, day):
+        totals = self._accumulate(self.rows_between(day * DAY, (day + 1) * DAY))
+        i = bisect.bisect_left(self.days, day)
+        present = i < len(self.days) and self.days[i] == day
+        if totals:
+            self.daily[day] = totals
+            if not present:
+                self.days.insert(i, day)
+        elif present:
+            del self.daily[day]
+            del self.days[i]
+
+    def _accumulate(self, positions, totals=None):
+        """把这些行的每个座位加进 {玩家 ID: [场数, PT]}"""
+        totals = {} if totals is None else totals
+        seat_ids = self.ids[positions].ravel().tolist()
+        seat_pts = np.nan_to_num(self.pt[positions]).ravel().tolist()  # PT 不是数字按 0 算
+        for pid, pt in zip(seat_ids, seat_pts):
+            if pid < 0:
+                continue  # 空座位
+            entry = totals.setdefault(pid, [0, 0.0])
+            entry[0] += 1
+            entry[1] += pt
+        return totals
+
+    def period_totals(self, start, end):
+        """
+        [start, end) 之间每个玩家的 {玩家 ID: [场数, PT]}，start / end 是 epoch 秒。
+        区间里的整天直接加每天的汇总，首尾不满一天的部分用时间索引取行
+        """
+        first_day = int(np.ceil(start / DAY))
+        last_day = int(end // DAY)
+        if first_day >= last_day:
+            return self._accumulate(self.rows_between(start, end))
+        totals = self._accumulate(self.rows_between(start, first_day * DAY))
+        self._accumulate(self.rows_between(last_day * DAY, end), totals)
+        lo = bisect.bisect_left(self.days, first_day)
+        hi = bisect.bisect_left(self.days, last_day)
+        for day in self.days[lo:hi]:
+            for pid, (games, pt) in self.daily[day].items():
+                entry = totals.setdefault(pid, [0, 0.0])
+                entry[0] += games
+                entry[1] += pt
+        return totals
+
+    def rows_between(self, start, end):
+        """时间在 [start, end) 之间的行号 (升序)，start / end 是 epoch 秒"""
+        lo = np.searchsorted(self.time_sorted, start, side="left")
+        hi = np.searchsorted(self.time_sorted, end, side="left")
+        return np.sort(self.time_rows[lo:hi])
+
+
+# --- 2. 共享的对局表 ---
+class GameTable:
+    """
+    Games Riichi + Games/pt 的列式存储，第一次读取时解析，之后只解析新增的行，所有查询函数共用。
+    玩家名字在解析时就通过 PlayerRegistry 转成 int32 ID (别名、大小写不同的写法都是同一个 ID)，
+    之后的查找、求交集都只比较整数。
+    """
+
+    def __init__(self, registry):
+        self.registry = registry  # PlayerRegistry，几张 GameTable 可以共用同一份 ID
+        self.lock = threading.RLock()  # 查询时持有，防止读到一半被同步改掉
+        self.riichi = RiichiBlock(self)
+        self.pt = PtBlock(self)
+
+    @property
+    def player_ids(self):
+        return self.registry.ids  # canonical name -> ID
+
+    @property
+    def player_keys(self):
+        return self.registry.keys  # ID -> canonical name
+
+    @property
+    def player_names(self):
+        return self.registry.names  # ID -> 显示用的写法
+
+    def intern(self, key, display=None):
+        return self.registry.intern(key, display)
+
+    def sync(self, riichi_snapshot=None, pt_snapshot=None):
+        """把列式数据追上最新的快照"""
+        with self.lock:
+            if riichi_snapshot is not None:
+                self.riichi.sync(riichi_snapshot)
+            if pt_snapshot is not None:
+                self.pt.sync(pt_snapshot)
+
+    def resolve(self, name):
+        """名字 / 别名 -> 玩家 ID 集合 (只认完整的名字，不认识返回空集合)"""
+        pid = self.registry.resolve(name)
+        return {pid} if pid is not None else set()
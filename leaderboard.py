@@ -0,0 +1,118 @@
+import threading
+
+from game_store import canonical_name
+
+# 榜单 (/ranking 的 category) -> (快照的 key, 名字列下标, 分数列下标)；列下标和整张表一致 (投影读取时左边补了空列)
+BOARDS = {
+    "total_mmr": ("Ranking!A:B", 0, 1),
+    "total_pt": ("Ranking!D:E", 3, 4),
+    "total_games": ("Ranking!G:H", 6, 7),
+    "quarter_mmr": ("Ranking Quarter!A:B", 0, 1),
+    "quarter_pt": ("Ranking Quarter!D:E", 3, 4),
+    "quarter_games": ("Ranking Quarter!G:H", 6, 7),
+}
+
+
+# --- 1. 单个榜单 ---
+class Leaderboard:
+    """
+    按分数从高到低排好的 [(名字, 分数), ...]，外加 名字(小写) -> 名次 的字典。
+    名次和原来 sorted(..., reverse=True) + enumerate 的结果一致 (同分按表格顺序)
+    """
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda e: e[1], reverse=True)
+        self._rank = {}
+        for rank, (name, _) in enumerate(self.entries, 1):
+            self._rank.setdefault(canonical_name(name), rank)
+
+    @classmethod
+    def from_rows(cls, rows, name_idx, score_idx):
+        """从表格行 (第 1 行是表头) 建榜，名字或分数为空 / 分数不是数字的行跳过"""
+        entries = []
+        for row in rows[1:]:
+            if len(row) <= score_idx:
+                continue
+            name = row[name_idx].strip()
+            score_str = row[score_idx].strip()
+            if not name or not score_str:
+                continue
+            try:
+                entries.append((name, float(score_str)))
+            except ValueError:
+                continue
+        return cls(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def top(self, n):
+        return self.entries[:n]
+
+    def lookup(self, name):
+        """返回 (名次, 分数)；不在榜上返回 None"""
+        rank = self._rank.get(canonical_name(name))
+        if rank is None:
+            return None
+        return rank, self.entries[rank - 1][1]
+
+
+# --- 2. 跟着快照更新的榜单 ---
+class LeaderboardCache:
+    """
+    /ranking、/report、/record_game 共用的榜单：每个榜单对应一份列投影快照，
+    快照换了 (表格有改动) 才重新排序建索引，否则直接复用，查任意几个人只要字典查找
+    """
+
+    def __init__(self, sheet_cache):
+        self.sheet_cache = sheet_cache
+        self._boards = {}  # 榜单 -> (建榜时的 rows, Leaderboard)
+        self._lock = threading.Lock()
+
+    def get(self, board):
+        return self.get_many([board])[board]
+
+    def _versions(self, keys):
+        """{快照 key: 版本}，版本相同 (==) 说明数据没变；这里版本就是快照对象本身"""
+        snaps = self.sheet_cache.get_snapshots(keys)
+        return {key: snaps[key] if key in snaps else self.sheet_cache.get_snapshot(key) for key in keys}
+
+    def _rows(self, key, version):
+        return version.rows
+
+    def get_many(self, boards):
+        """一次批量读取这几个榜单用到的快照 (过期的才下载)，返回 {榜单: Leaderboard}"""
+        keys = {board: BOARDS[board][0] for board in boards}
+        versions = self._versions(sorted(set(keys.values())))
+        result = {}
+        for board, key in keys.items():
+            version = versions[key]
+            with self._lock:
+                cached = self._boards.get(board)
+                if cached is not None and cached[0] == version:
+                    result[board] = cached[1]
+                    continue
+            _, name_idx, score_idx = BOARDS[board]
+            leaderboard = Leaderboard.from_rows(self._rows(key, version), name_idx, score_idx)
+            with self._lock:
+                self._boards[board] = (version, leaderboard)
+            result[board] = leaderboard
+        return result
+
+
+class MirrorLeaderboardCache(LeaderboardCache):
+    """
+    QUERY_BACKEND=sqlite 时 /report 用的榜单：从本地镜像里的排行榜快照建，
+    不请求 Google；镜像同步过 (synced_at 变了) 才重建
+    """
+
+    def __init__(self, mirror):
+        super().__init__(None)
+        self.mirror = mirror
+
+    def _versions(self, keys):
+        return {key: self.mirror.synced_at(key) for key in keys}
+
+    def _rows(self, key, version):
+        snap = self.mirror.load_snapshot(key)
+        return snap.rows if snap is not None else [[]]
@@ -1,22 +1,36 @@
 import discord
-import gspread
 import re
 import os
 import json
 import urllib.parse
 import asyncio
+import threading
+import time
 import datetime
 import pandas as pd
 from datetime import datetime,timedelta,timezone
 from collections import Counter
 from dotenv import load_dotenv
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import timedelta 
 from discord.ext import commands
 from discord import app_commands
 from typing import List
 from discord.ext import tasks
 from mahjong_ui import SeatSelectView
+from sheet_client import SheetClient
+from sheet_scheduler import LANE_BACKGROUND, LANE_WRITE, SheetQuotaError
+from gspread.exceptions import WorksheetNotFound
+from sheet_cache import SheetCache, WorksheetSnapshot
+from sheet_mirror import SheetMirror
+from leaderboard import BOARDS, LeaderboardCache, MirrorLeaderboardCache
+from player_registry import PlayerRegistry, load_aliases
+from name_index import NameIndex
+from prefetch import SpeculativePrefetcher
+from write_outbox import WriteOutbox, GroupCommitter, entry_game, match_game_rows, plan_appends
+from sheet_repo import SheetRepository, SheetTimeoutError
+from rating_engine import RATING_PARAMS_FILE, RatingEngine, load_initial_ratings, load_rating_params, verify_against_sheet
+import numpy as np
+from game_store import GameTable, canonical_name, f32_to_float, to_epoch
 from discord.ui import View, Button, Select, Modal, TextInput
 # --- 1. 配置区域 ---
 # ⚠️ 请确保您的 .env 文件名正确，如果是 .env 只需要 load_dotenv()
@@ -28,21 +42,46 @@ JSON_KEYFILE = 'credentials.json'
 GUILD_ID = discord.Object(id=1278056421224747162) 
 DATA_FILE = 'mahjong_records.csv'
 data_lock = asyncio.Lock()
+# 录入成绩后等待表格公式算完的上限 (秒)，以及轮询间隔的起止值
+SETTLE_TIMEOUT = float(os.getenv('SHEET_SETTLE_TIMEOUT', '90'))
+SETTLE_POLL_START = 1.0
+SETTLE_POLL_MAX = 8.0
+# 拿不到新行行号、没法轮询时的固定等待 (秒)，不超过原来的 60 秒
+SETTLE_FALLBACK_WAIT = min(SETTLE_TIMEOUT, 60.0)
+# 查询 (/recent_match /personal_data /versus /ranking /report) 的数据来源:
+# "memory" = 内存列式数据 (按需从表格同步)；"sqlite" = 本地 SQLite 镜像 (由后台预热同步，不等 Google)
+QUERY_BACKEND = os.getenv("QUERY_BACKEND", "memory")
 
 # --- 2. 连接 Google Cloud ---
 print("正在连接 Google Cloud...")
 scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+# 授权、打开表格、解析工作表都只做一次，之后一直复用
+sheets = SheetClient(JSON_KEYFILE, scope, SHEET_ID)
 try:
-    creds = ServiceAccountCredentials.from_json_keyfile_name(JSON_KEYFILE, scope)
-    gc = gspread.authorize(creds)
-    # 测试连接
-    spreadsheet = gc.open_by_key(SHEET_ID)
-
-    print("✅ Google Sheet 连接成功")
+    sheets.connect()
 except Exception as e:
-    print(f"❌ 连接失败: {e}")
-    # 如果连不上Google，程序继续运行也没意义，直接退出
-    exit()
+    # 连不上也继续运行：读取用本地镜像里的快照，写入先存进本地队列，之后自动重连
+    print(f"❌ 连接失败: {e}，以离线模式启动")
+
+# 玩家名字 / 别名 -> 整数 ID (Ratings 里的注册名 + PLAYER_ALIASES_FILE 里的别名)，所有查询共用
+player_registry = PlayerRegistry(load_aliases())
+# 表格的本地 SQLite 镜像 (后台预热时同步)
+mirror = SheetMirror(canonical=player_registry.canonical)
+# 共享的工作表快照，读取经过调度器限速；表格修改时间没变就一直用快照 (查不到修改时间时按 SHEET_CACHE_TTL 过期)
+# 读取失败时退回旧快照 / 本地镜像 (离线模式)
+# revision_source 要包一层 lambda：直接取 sheets.api.get_lastUpdateTime 会在这里就连接表格，离线时启动失败
+sheet_cache = SheetCache(
+    sheets.api, revision_source=lambda: sheets.api.get_lastUpdateTime(), fallback=mirror.load_snapshot
+)
+# 录入一局之后，这些表的公式结果都会变
+GAME_DEPENDENT_SHEETS = (
+    "Games/pt", "Games Riichi", "Ranking", "Ranking Quarter",
+    "Personal Data", "Personal Data 2026 Winter",
+)
+# /record_game /register 的写入先存在本地，再按顺序成批写进表格 (见 7.5)
+outbox = WriteOutbox()
+# 所有 Google Sheets 调用都通过 repo.run() 放到线程池执行，不阻塞事件循环
+repo = SheetRepository(scheduler=sheets.scheduler)
 
 if BOT_TOKEN is None:
     print("❌ 错误：未找到 Token")
@@ -50,21 +89,60 @@ if BOT_TOKEN is None:
 
 # --- 3. 名字缓存与工具函数 ---
 PLAYER_NAME_CACHE = []
+# 自动补全用的索引，后台线程里建好后整个替换 (自动补全只读，不会等表格)
+NAME_INDEX = NameIndex([])
+# 自动补全里最近 NAME_ACTIVITY_DAYS 天对局多的玩家排前面
+NAME_ACTIVITY_DAYS = 30
 
 def update_player_cache():
     global PLAYER_NAME_CACHE
     try:
-        sh = gc.open_by_key(SHEET_ID)
-        ws = sh.worksheet("Ratings")
-        all_names = ws.col_values(1)
+        ratings = sheet_cache.get_values("Ratings")
+        player_registry.load_ratings(ratings)
+        all_names = [row[0] for row in ratings if row]
+        old_count = len(PLAYER_NAME_CACHE)
         if len(all_names) > 1:
-            PLAYER_NAME_CACHE = [name for name in all_names[1:] if name.strip()]
+            names = [name for name in all_names[1:] if name.strip()]
         else:
-            PLAYER_NAME_CACHE = []
-        print(f"✅ 已缓存 {len(PLAYER_NAME_CACHE)} 个玩家名字")
+            names = []
+        # 还在本地队列里等待写入的注册也算已占用
+        for entry in outbox.pending():
+            if entry.kind == "register" and entry.payload["player_name"] not in names:
+                names.append(entry.payload["player_name"])
+        PLAYER_NAME_CACHE = names
+        rebuild_name_index(names)
+        # 后台预热会反复调用，人数变了才打印
+        if len(PLAYER_NAME_CACHE) != old_count or not old_count:
+            print(f"✅ 已缓存 {len(PLAYER_NAME_CACHE)} 个玩家名字")
     except Exception as e:
         print(f"❌ 读取名字列表失败: {e}")
 
+def player_activity(days=NAME_ACTIVITY_DAYS):
+    """最近 days 天每个玩家的对局数 {canonical 名字: 场数} (只用已经解析好的对局表，不触发读取)"""
+    now = datetime.now(timezone.utc) - timedelta(hours=8)  # 表格里是 UTC-8 的本地时间
+    now = to_epoch(now.replace(tzinfo=None))
+    with game_table.lock:
+        totals = game_table.pt.period_totals(now - days * 86400, now + 86400)
+        return {game_table.player_keys[pid]: games for pid, (games, _) in totals.items()}
+
+def rebuild_name_index(names):
+    global NAME_INDEX
+    NAME_INDEX = NameIndex(names, player_activity())
+
+NAME_REFRESH = {"task": None}
+
+def schedule_name_refresh():
+    """在后台重新加载名单并重建自动补全索引 (已经在加载就不重复)"""
+    task = NAME_REFRESH["task"]
+    if task is None or task.done():
+        NAME_REFRESH["task"] = asyncio.create_task(refresh_player_names())
+
+async def refresh_player_names():
+    try:
+        await repo.run(update_player_cache, lane=LANE_BACKGROUND)
+    except Exception as e:
+        print(f"⚠️ 后台加载名单失败: {e}")
+
 
 # --- 4. 机器人核心类定义 ---
 intents = discord.Intents.default()
@@ -81,50 +159,134 @@ class MyBot(commands.Bot):
         print("✅ 指令树已同步！")
 
 client = MyBot()
-def get_player_recent_stats(player_name, search_limit=500):
-    try:
-        sh = gc.open_by_key(SHEET_ID)
-        
-        # 1. 同时读取两个表格的所有数据
-        ws_riichi = sh.worksheet("Games Riichi")
-        ws_dates = sh.worksheet("Games/pt") 
-        
-        raw_riichi = ws_riichi.get_all_values()
-        raw_dates = ws_dates.get_all_values()
+
+@client.tree.error
+async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
+    # 指令里没接住的 Google Sheets 超时，统一在这里告诉用户
+    original = getattr(error, "original", error)
+    if isinstance(original, (SheetTimeoutError, SheetQuotaError)):
+        msg = f"⏱️ {original}，请稍后再试。"
+    else:
+        print(f"❌ 指令出错: {error}")
+        msg = f"❌ 发生了未知错误: {original}"
+    if interaction.response.is_done():
+        await interaction.followup.send(msg)
+    else:
+        await interaction.response.send_message(msg, ephemeral=True)
+
+def mark_if_stale(embed):
+    """离线模式下在 footer 注明数据来自本地快照"""
+    if sheet_cache.degraded_since is None:
+        return embed
+    minutes = (time.monotonic() - sheet_cache.degraded_since) / 60
+    note = f"⚠️ Google Sheets 已离线 {minutes:.0f} 分钟，数据来自本地快照，可能不是最新"
+    text = embed.footer.text if embed.footer and embed.footer.text else None
+    embed.set_footer(text=f"{text}\n{note}" if text else note)
+    return embed
+
+# --- 5. 对局表 (列式存储 + 玩家 -> 行号索引) ---
+# Games Riichi / Games/pt 只解析一次，查询函数在 game_table.lock 内取出需要的行，锁外再计算
+game_table = GameTable(player_registry)
+
+GAME_SHEETS = ["Games Riichi", "Games/pt"]
+
+def snapshot_rows(snaps, name):
+    """从 get_snapshots() 的结果里取数据；批量读取时失败的表单独再读一次 (出错就抛给调用方)"""
+    return snaps[name].rows if name in snaps else sheet_cache.get_values(name)
+
+def sync_game_table(snaps=None):
+    """读取两张对局表的快照 (走缓存，过期的合并成一次请求)，把列式数据追上"""
+    if snaps is None or any(name not in snaps for name in GAME_SHEETS):
+        snaps = sheet_cache.get_snapshots(GAME_SHEETS)
+        missing = [name for name in GAME_SHEETS if name not in snaps]
+        if missing:
+            raise RuntimeError(f"读取 {', '.join(missing)} 失败")
+    game_table.sync(snaps["Games Riichi"], snaps["Games/pt"])
+
+def recent_game_table(search_limit):
+    """
+    对局表已经加载过 -> 同步并返回共享的 game_table；
+    冷启动时不下载整张表，只读两张表最后 search_limit 行，建一个临时的 GameTable
+    """
+    if all(sheet_cache.has_snapshot(name) for name in GAME_SHEETS):
+        sync_game_table()
+        return game_table
+    windows = sheet_cache.read_window(GAME_SHEETS, search_limit)
+    table = GameTable(player_registry)
+    table.sync(*(WorksheetSnapshot(name, windows[name]) for name in GAME_SHEETS))
+    return table
+
+def sql_recent_candidates(player_name, search_limit):
+    """
+    本地 SQLite 镜像版的候选行：最后 search_limit 行里该玩家 (名字或别名) 参与过的行
+    返回值和内存版相同 (行用 {行号: 行} 代替列表)
+    """
+    max_rows = min(mirror.row_count("Games Riichi"), mirror.row_count("Games/pt"))
+    if max_rows < 2:
+        return None
+    # 镜像里的名字写入时已经统一成注册名
+    ids = {player_registry.canonical(player_name)}
+    candidates = [pos for pos in mirror.player_rows(ids, min_row=max(1, max_rows - search_limit)) if pos < max_rows]
+    raw_riichi = mirror.rows("Games Riichi", candidates)
+    raw_dates = mirror.rows("Games/pt", candidates)
+    candidate_rows = [
+        pos for pos in candidates
+        if pos in raw_dates and raw_riichi.get(pos) and raw_riichi[pos][0].strip()
+    ]
+    seat_ids, _, seat_places, seat_deltas = mirror.riichi_seats(candidate_rows)
+    return raw_riichi, raw_dates, ids, candidate_rows, seat_ids, seat_places, seat_deltas
+
+def memory_recent_candidates(player_name, search_limit):
+    """内存列式数据版的候选行 (同 sql_recent_candidates)"""
+    # 同时读取两个表格的数据 (走缓存；冷启动只读最后 search_limit 行)，并同步列式数据
+    table = recent_game_table(search_limit)
+    with table.lock:
+        riichi = table.riichi
+        raw_riichi = riichi.rows
+        raw_dates = table.pt.rows
         
         if not raw_riichi or len(raw_riichi) < 2:
-            return None, "表格看起来是空的。"
+            return None
 
-        # 2. 合并数据
-        combined_data = []
+        # 两张表按行号对齐，只看最后 search_limit 局
         max_rows = min(len(raw_riichi), len(raw_dates))
+        window_start = riichi.window_start(search_limit, max_rows)
         
-        for i in range(1, max_rows):
-            r_row = raw_riichi[i] 
-            d_row = raw_dates[i] 
-            
-            if r_row and len(r_row) > 0 and r_row[0].strip() != "":
-                date_str = d_row[0] if len(d_row) > 0 else "Unknown Date"
-                combined_data.append({
-                    "data": r_row, 
-                    "date": date_str 
-                })
+        # 通过索引直接拿到该玩家参与过的行 (名字或别名完全一致才算，"Al" 不会匹配到 "Alice")
+        ids = table.resolve(player_name)
+        candidate_rows = [
+            pos for pos in riichi.rows_for(ids)
+            if window_start <= pos < max_rows and riichi.filled[pos]
+        ]
+        seat_ids = riichi.ids[candidate_rows]
+        seat_places = riichi.placements[candidate_rows]
+        seat_deltas = riichi.mmr_delta[candidate_rows]
+    return raw_riichi, raw_dates, ids, candidate_rows, seat_ids, seat_places, seat_deltas
 
-        # 3. 截取最后 search_limit 条
-        search_data = combined_data[-search_limit:]
+def get_player_recent_stats(player_name, search_limit=500):
+    try:
+        # 1-3. 找出该玩家最近 search_limit 局里参与过的行 (本地 SQLite 镜像或内存列式数据)
+        if QUERY_BACKEND == "sqlite":
+            found = sql_recent_candidates(player_name, search_limit)
+        else:
+            found = memory_recent_candidates(player_name, search_limit)
+        if found is None:
+            return None, "表格看起来是空的。"
+        raw_riichi, raw_dates, ids, candidate_rows, seat_ids, seat_places, seat_deltas = found
         
         matches = []
         current_mmr = "N/A"
         last_delta = "N/A"
         total_delta_sum = 0.0
-        target_name = player_name.lower().strip()
         
         seen_games = set()
 
         # 4. 倒序查找
-        for item in reversed(search_data):
-            row = item["data"]
-            date = item["date"]
+        for k in range(len(candidate_rows) - 1, -1, -1):
+            pos = candidate_rows[k]
+            row = raw_riichi[pos]
+            d_row = raw_dates[pos]
+            date = d_row[0] if len(d_row) > 0 else "Unknown Date"
             
             if len(row) < 4: continue
             
@@ -134,33 +296,17 @@ def get_player_recent_stats(player_name, search_limit=500):
                 continue
             seen_games.add(game_fingerprint)
             
-            # --- 匹配名字 ---
-            row_names = [str(n).lower().strip() for n in row[0:4]]
-            
-            found = False
-            idx = -1 # 目标玩家在当前局的座位索引 (0-3)
-            for i, name in enumerate(row_names):
-                if target_name in name:
-                    found = True
-                    idx = i
-                    break
+            # --- 目标玩家在当前局的座位索引 (0-3) ---
+            idx = next((i for i, pid in enumerate(seat_ids[k].tolist()) if pid in ids), -1)
             
-            if found:
-                # 提取目标玩家分数和变动
+            if idx >= 0:
+                # 提取目标玩家分数和变动 (显示用表格里的原文)
                 score = row[4 + idx] if len(row) > 4+idx else "0"
                 this_game_delta = row[8 + idx] if len(row) > 8+idx else "0"
-                # 计算排名 (原有逻辑)
-                try:
-                    all_scores = []
-                    for i in range(4):
-                        s_val = float(row[4+i]) if len(row) > 4+i and row[4+i] else -99999
-                        all_scores.append(s_val)
-                        d_val = float(str(this_game_delta).strip())
-                    total_delta_sum += d_val
-                    my_score = all_scores[idx]
-                    rank = sum(1 for s in all_scores if s > my_score) + 1
-                except:
-                    rank = "?"
+                if not np.isnan(seat_deltas[k, idx]):
+                    total_delta_sum += f32_to_float(seat_deltas[k, idx])
+                # 排名直接读顺位矩阵 (0 表示分数为空)
+                rank = int(seat_places[k, idx]) or "?"
 
                 # 记录 MMR (原有逻辑)
                 if current_mmr == "N/A":
@@ -207,137 +353,126 @@ def get_player_recent_stats(player_name, search_limit=500):
         print(f"查表报错: {e}")
         return None, str(e)
 # --- 1.1 新增：获取详细个人数据的函数 ---
-def get_personal_detailed_data(player_name):
+def find_named_row(rows, target_name, skip):
+    """第一列是 target_name 的行 (跳过前 skip 行表头)，没有返回 None"""
+    return next((row for row in rows[skip:] if row and row[0].strip().lower() == target_name), None)
+
+def memory_profile_data(player_name, target_name):
+    """
+    内存版：Personal Data 两张表里该玩家的行，和对局表列式数据里最近的 PT / MMR / 顺位
+    返回 (总表的行, 本学期表的行, 当前 MMR 原文, PT 列表, [(MMR 变动, MMR 绝对值, 顺位)])，都是新到旧；不是数字的为 None
+    """
+    # 需要的 4 张表过期的部分合并成一次批量请求
+    snaps = sheet_cache.get_snapshots(
+        ["Personal Data", "Personal Data 2026 Winter"] + GAME_SHEETS
+    )
+    # 假设第一行是表头，从第二行开始
+    personal_row = find_named_row(snapshot_rows(snaps, "Personal Data"), target_name, 1)
+    if personal_row is None:
+        return None, None, "N/A", [], []
+    winter_row = None
     try:
-        sh = gc.open_by_key(SHEET_ID)
-        target_name = player_name.lower().strip()
+        winter_row = find_named_row(snapshot_rows(snaps, "Personal Data 2026 Winter"), target_name, 2)
+    except Exception as e:
+        print(f"Winter sheet error: {e}")
+
+    # Games/pt + Games Riichi (列式数据，只取该玩家最近的行)
+    sync_game_table(snaps)
+    with game_table.lock:
+        ids = game_table.resolve(player_name)
+        pt_block = game_table.pt
+        riichi = game_table.riichi
         
-        # --- A. 读取 Personal Data 表 (基础数据) ---
-        ws_personal = sh.worksheet("Personal Data")
-        # 假设第一行是表头，从第二行开始
-        data_personal = ws_personal.get_all_values()
+        pt_changes = []
+        # 倒序遍历索引里该玩家参与过的行；名字(B,E,H,K) 对应 PT(D,G,J,M)
+        for pos in reversed(pt_block.rows_for(ids)):
+            seat = pt_block.seat_of(pos, ids)
+            if seat < 0: continue
+            val = pt_block.pt[pos, seat]
+            if np.isnan(val): continue  # PT 不是数字，跳过
+            pt_changes.append(f32_to_float(val))
+            if len(pt_changes) >= 10: break
+        
+        recent = []
+        current_mmr = "N/A"
+        for pos in reversed(riichi.rows_for(ids)):
+            seat = riichi.seat_of(pos, ids)
+            if seat < 0: continue
+            if current_mmr == "N/A":
+                # 绝对值在 M-P 列 (索引 12-15)，显示表格原文
+                row = riichi.rows[pos]
+                current_mmr = row[12 + seat] if len(row) > 12 + seat else "0"
+            delta, mmr = riichi.mmr_delta[pos, seat], riichi.mmr[pos, seat]
+            recent.append((
+                None if np.isnan(delta) else f32_to_float(delta),
+                None if np.isnan(mmr) else f32_to_float(mmr),
+                int(riichi.placements[pos, seat]),
+            ))
+            if len(recent) >= 10: break
+    return personal_row, winter_row, current_mmr, pt_changes, recent
+
+def sql_profile_data(target_name):
+    """本地 SQLite 镜像版 (不请求 Google)，返回值同 memory_profile_data"""
+    personal_row = mirror.find_row("Personal Data", target_name)
+    if personal_row is None:
+        return None, None, "N/A", [], []
+    winter_row = mirror.find_row("Personal Data 2026 Winter", target_name, skip=2)
+    pt_changes = mirror.recent_pt(target_name, 10)
+    seats = mirror.recent_riichi(target_name, 10)
+    current_mmr = "N/A"
+    if seats:
+        pos, seat = seats[0][:2]
+        row = mirror.rows("Games Riichi", [pos]).get(pos, [])
+        current_mmr = row[12 + seat] if len(row) > 12 + seat else "0"
+    recent = [(delta, mmr, place) for _, _, delta, mmr, place in seats]
+    return personal_row, winter_row, current_mmr, pt_changes, recent
+
+def get_personal_detailed_data(player_name):
+    try:
+        target_name = player_registry.canonical(player_name)  # 别名换成注册名
         
-        personal_info = None
-        # 遍历查找玩家
-        for row in data_personal[1:]:
-            if row and row[0].strip().lower() == target_name:
-                # 找到玩家，提取数据
-                # A(0):Name ... C(2):AvgPlace ... F(5):AvgPoint ... 
-                # K(10):1st ... N(13):4th ... O(14):TotalGames
-                personal_info = {
-                    "avg_place": row[2],
-                    "avg_point": row[5],
-                    "count_1st": row[10],
-                    "count_2nd": row[11],
-                    "count_3rd": row[12],
-                    "count_4th": row[13],
-                    "total_games": row[14]
-                }
-                break
+        # Personal Data 两张表 + 最近的对局 (本地 SQLite 镜像或内存列式数据)
+        if QUERY_BACKEND == "sqlite":
+            found = sql_profile_data(target_name)
+        else:
+            found = memory_profile_data(player_name, target_name)
+        row, winter_row, current_mmr, pt_changes, recent = found
         
-        if not personal_info:
+        # --- A. Personal Data 表 (基础数据) ---
+        if not row:
             return None, "In 'Personal Data' sheet, player not found."
-        quarter_pt="N/A"
-        try:
-            ws_winter = sh.worksheet("Personal Data 2026 Winter")
-            data_winter = ws_winter.get_all_values()
-            for row in data_winter[2:]:
-                if row and row[0].strip().lower() == target_name:
-                    quarter_pt = row[2] 
-                    break
-        except Exception as e:
-            print(f"Winter sheet error: {e}")
-            quarter_pt = "N/A"
+        # A(0):Name ... C(2):AvgPlace ... F(5):AvgPoint ... 
+        # K(10):1st ... N(13):4th ... O(14):TotalGames
+        personal_info = {
+            "avg_place": row[2],
+            "avg_point": row[5],
+            "count_1st": row[10],
+            "count_2nd": row[11],
+            "count_3rd": row[12],
+            "count_4th": row[13],
+            "total_games": row[14]
+        }
+        quarter_pt = "N/A"
+        if winter_row:
+            try:
+                quarter_pt = winter_row[2]
+            except Exception as e:
+                print(f"Winter sheet error: {e}")
 
-        ws_pt = sh.worksheet("Games/pt")
-        raw_pt = ws_pt.get_all_values()
-        pt_changes = []
-        for row in reversed(raw_pt[1:]):
-            if len(row) < 13: continue 
-            
-            found_pt = False
-            delta_pt = 0
-            
-            # 位置映射: 名字索引(B,E,H,K) -> PT索引(D,G,J,M)
-            check_indices = {1: 3, 4: 6, 7: 9, 10: 12}
-            
-            for name_idx, score_idx in check_indices.items():
-                if len(row) > name_idx and target_name in row[name_idx].lower().strip():
-                    try:
-                        val = row[score_idx]
-                        delta_pt = float(val) if val else 0
-                        found_pt = True
-                    except:
-                        delta_pt = 0
-                    break
-            
-            if found_pt:
-                pt_changes.append(delta_pt)
-                if len(pt_changes) >= 10: break
-        # --- C. 读取 Games Riichi 表 (统计 MMR 变化、绝对值 和 顺位历史) ---
-        ws_riichi = sh.worksheet("Games Riichi")
-        raw_riichi = ws_riichi.get_all_values()
-        
+        # --- C. Games Riichi (统计 MMR 变化、绝对值 和 顺位历史) ---
         mmr_changes = []        # 存变动值 (比如 +15)
         recent_ranks = []       # 存顺位 (比如 1, 2)
         mmr_absolute_history = [] # 存绝对值 (比如 1500) 用于画图
-        current_mmr = "N/A"
         
-        # 倒序查找
-        for row in reversed(raw_riichi[1:]):
-            if len(row) < 4: continue
-            
-            row_names = [str(n).lower().strip() for n in row[0:4]]
-            
-            # === 🔴 缺失的就是这一段查找逻辑 ===
-            found_mmr = False
-            idx = -1
+        for delta, abs_val, place in recent:
+            # 1. MMR 变动 (I-L列)，不是数字按 0 算
+            mmr_changes.append(0 if delta is None else delta)
             
-            # 遍历这一行的4个玩家名字，看有没有目标玩家
-            for i, name in enumerate(row_names):
-                if target_name in name:
-                    idx = i
-                    found_mmr = True
-                    break
+            # 2. MMR 绝对值 (M-P列) -> 🟢 画图用这个，为空或者是 "-" 用 0 代替
+            mmr_absolute_history.append(0 if abs_val is None else abs_val)
             
-            if found_mmr:
-                if current_mmr == "N/A":
-                    try:
-                        # 绝对值在 M-P 列 (索引 12-15)
-                        abs_val_str = row[12 + idx] if len(row) > 12+idx else "0"
-                        current_mmr = abs_val_str # 存下来
-                    except:
-                        current_mmr = "Error"
-                # 1. 获取 MMR 变动 (I-L列, 索引 8-11)
-                try:
-                    delta = row[8 + idx] if len(row) > 8+idx else "0"
-                    mmr_val = float(delta)
-                except:
-                    mmr_val = 0
-                mmr_changes.append(mmr_val)
-                
-                # 2. 获取 MMR 绝对值 (M-P列, 索引 12-15) -> 🟢 画图用这个
-                try:
-                    abs_val_str = row[12 + idx] if len(row) > 12+idx else "0"
-                    # 如果为空或者是 "-"，用0代替
-                    abs_val = float(abs_val_str) if abs_val_str.strip() else 0
-                except:
-                    abs_val = 0
-                mmr_absolute_history.append(abs_val)
-                
-                # 3. 计算顺位
-                try:
-                    all_scores = []
-                    for i in range(4):
-                        s = float(row[4+i]) if len(row) > 4+i and row[4+i] else -99999
-                        all_scores.append(s)
-                    my_s = all_scores[idx]
-                    rank = sum(1 for s in all_scores if s > my_s) + 1
-                    recent_ranks.append(str(rank))
-                except:
-                    recent_ranks.append("?")
-                
-                if len(mmr_changes) >= 10: break
+            # 3. 顺位
+            recent_ranks.append(str(place) if place else "?")
 
         # 🟢 别忘了翻转绝对值列表，因为我们是倒序读的
         mmr_absolute_history.reverse()
@@ -408,29 +543,143 @@ async def player_name_autocomplete(
     interaction: discord.Interaction,
     current: str,
 ) -> List[app_commands.Choice[str]]:
-    if not PLAYER_NAME_CACHE:
-        update_player_cache()
+    index = NAME_INDEX
+    if not len(index):
+        # 名单还没加载好：交给后台加载，这次先不给候选 (自动补全只有 3 秒，不能等表格)
+        schedule_name_refresh()
+        return []
     
-    choices = [
-        app_commands.Choice(name=name, value=name)
-        for name in PLAYER_NAME_CACHE
-        if current.lower() in name.lower()
-    ]
-    return choices[:25]
+    # 前缀匹配 > 包含 > 拼写相近，同一档里最近常打的玩家在前
+    names = index.search(current)
+    
+    # 查询类指令：已经能确定是谁 (完全一致或只剩一个候选) 就在后台先把他的数据预热好
+    command = interaction.command.name if interaction.command else None
+    if command in PREFETCH_COMMANDS and names:
+        if len(names) == 1 or canonical_name(names[0]) == canonical_name(current):
+            profile_prefetcher.request((command, names[0]))
+    
+    return [app_commands.Choice(name=name, value=name) for name in names]
+
+# --- 6.1 根据自动补全推测预热 ---
+# 令牌桶里至少还剩这么多才预热 (留给真正的指令)
+PREFETCH_MIN_TOKENS = float(os.getenv("PREFETCH_MIN_TOKENS", "3"))
+PROFILE_SHEETS = ["Personal Data", "Personal Data 2026 Winter"] + GAME_SHEETS
+
+# 每个玩家的查询结果 (/personal_data /recent_match)，依赖的数据没变就直接用：
+# (查询函数名, canonical 名字) -> (算的时候的数据版本, 结果)
+PROFILE_CACHE = {}
+PROFILE_CACHE_SIZE = 64
+profile_cache_lock = threading.Lock()
+
+def peek_version(names):
+    """这几份快照在内存里都还有效 -> 快照对象组成的版本；有一份没有 / 过期返回 None (这次不走缓存)，不下载"""
+    snaps = sheet_cache.peek_snapshots(names)
+    if len(snaps) < len(names):
+        return None
+    return tuple(snaps[name] for name in names)
+
+def recent_stats_version():
+    """/recent_match 只读对局表：sqlite 后端看镜像的同步时间 (不碰 Google)，内存后端看两张对局表的快照"""
+    if QUERY_BACKEND == "sqlite":
+        return tuple(mirror.synced_at(name) for name in GAME_SHEETS)
+    return peek_version(GAME_SHEETS)
+
+def personal_data_version():
+    """/personal_data 读 Personal Data 两张表和对局表 (sqlite 后端同样看镜像的同步时间)"""
+    if QUERY_BACKEND == "sqlite":
+        return tuple(mirror.synced_at(name) for name in PROFILE_SHEETS)
+    return peek_version(PROFILE_SHEETS)
+
+# 可以缓存的查询 -> 取数据版本的函数
+PROFILE_QUERIES = {
+    get_player_recent_stats: recent_stats_version,
+    get_personal_detailed_data: personal_data_version,
+}
+# 这几个指令提交时要算的查询，在用户选名字的时候就先算好 (/versus 只预热对局表)
+PREFETCH_COMMANDS = {
+    "personal_data": (get_personal_detailed_data,),
+    "recent_match": (get_player_recent_stats,),
+    "versus": (),
+}
+
+def cached_profile(query, player_name):
+    """query(player_name)，同一个玩家、依赖的数据没变时直接返回上次 (或预热时) 算好的结果"""
+    key = (query.__name__, player_registry.canonical(player_name))
+    version = PROFILE_QUERIES[query]()  # 先取版本再计算：结果至少和版本一样新
+    if version is not None:
+        with profile_cache_lock:
+            cached = PROFILE_CACHE.get(key)
+        if cached is not None and cached[0] == version:  # 快照对象按 is 比较
+            return cached[1]
+    result = query(player_name)
+    if version is not None and result[0] is not None:  # 出错的结果不缓存
+        with profile_cache_lock:
+            PROFILE_CACHE.pop(key, None)
+            PROFILE_CACHE[key] = (version, result)
+            while len(PROFILE_CACHE) > PROFILE_CACHE_SIZE:
+                PROFILE_CACHE.pop(next(iter(PROFILE_CACHE)))
+    return result
+
+def warm_player_profile(command, player_name):
+    """提前算好这个指令要用的查询结果 (顺便读好需要的表)，指令提交时直接从 PROFILE_CACHE 返回"""
+    queries = PREFETCH_COMMANDS[command]
+    if not queries and QUERY_BACKEND != "sqlite":
+        sync_game_table()
+    for query in queries:
+        cached_profile(query, player_name)
+
+async def prefetch_player_profile(key):
+    command, player_name = key
+    await repo.run(warm_player_profile, command, player_name, lane=LANE_BACKGROUND)
+
+def prefetch_allowed():
+    """离线、配额紧张或者有指令 / 写入在排队时不预热"""
+    if sheet_cache.is_offline():
+        return False
+    metrics = sheets.scheduler.metrics()
+    busy = any(lane["queued"] for name, lane in metrics["lanes"].items() if name != "background")
+    return not busy and metrics["tokens"] >= PREFETCH_MIN_TOKENS
+
+profile_prefetcher = SpeculativePrefetcher(prefetch_player_profile, can_start=prefetch_allowed)
 # --- 1.2 获取两人对决数据的函数 (显示真实名字版) ---
 # --- 1.2 获取两人对决数据的函数 (含大胜/踩头统计) ---
+def memory_shared_games(p1, p2):
+    """
+    两人同桌的行号，以及这些行的座位 ID / 分数 / 顺位
+    返回 (id_1, id_2, 行号列表, 原始行, ids, scores, placements)
+    """
+    sync_game_table()
+    with game_table.lock:
+        riichi = game_table.riichi
+        id_1 = player_registry.resolve(p1)
+        id_2 = player_registry.resolve(p2)
+        shared = riichi.shared_rows(id_1, id_2) if id_1 is not None and id_2 is not None else []
+        return id_1, id_2, shared, riichi.rows, riichi.ids[shared], riichi.scores[shared], riichi.placements[shared]
+
+def sql_shared_games(p1, p2):
+    """本地 SQLite 镜像版 (玩家索引上 JOIN)；玩家直接用名字区分，原始行用 {行号: 行}"""
+    shared = mirror.shared_rows(p1, p2)
+    players, scores, places, _ = mirror.riichi_seats(shared)
+    # 去重时要和上一行比较，上一行也一起取出
+    rows = mirror.rows("Games Riichi", set(shared) | {pos - 1 for pos in shared})
+    return p1, p2, shared, rows, players, scores, places
+
 def get_versus_data(player_a, player_b):
     try:
-        sh = gc.open_by_key(SHEET_ID)
-        ws = sh.worksheet("Games Riichi")
-        rows = ws.get_all_values()
-        
-        p1 = player_a.lower().strip()
-        p2 = player_b.lower().strip()
+        # 别名换成注册名 (大小写、空格不同也是同一个人)
+        p1 = player_registry.canonical(player_a)
+        p2 = player_registry.canonical(player_b)
         
         if p1 == p2:
             return None, "请输入两个不同的名字。"
 
+        # 索引求交集：只取两人同桌的行 (本地 SQLite 镜像或内存列式数据)
+        if QUERY_BACKEND == "sqlite":
+            found = sql_shared_games(p1, p2)
+        else:
+            found = memory_shared_games(p1, p2)
+        id_1, id_2, shared, rows, shared_ids, shared_scores, shared_places = found
+
         stats = {
             "total_matches": 0,
             "p1_stats": {"wins": 0, "big_wins": 0, "stomps": 0, "weighted_score": 0},
@@ -439,48 +688,37 @@ def get_versus_data(player_a, player_b):
             "recent_record": [] 
         }
 
-        last_game_signature = ""
+        def game_signature(row):
+            return "".join([str(x).strip().lower() for x in row[0:8]])
 
-        for row in rows[1:]:
+        for k, pos in enumerate(shared):
+            row = rows[pos]
             if len(row) < 8: continue 
             
-            # --- 去重 ---
-            current_signature = "".join([str(x).strip().lower() for x in row[0:8]])
-            if current_signature == last_game_signature:
+            # --- 去重 (和上一行完全相同视为重复录入) ---
+            prev = rows[pos - 1] if pos > 1 else []
+            if len(prev) >= 8 and game_signature(prev) == game_signature(row):
                 continue
-            last_game_signature = current_signature
             
-            # 获取玩家列表
-            current_players = [n.lower().strip() for n in row[0:4]]
+            # 找到 A 和 B 在本局的座位
+            current_ids = shared_ids[k].tolist()
+            idx_1 = current_ids.index(id_1)
+            idx_2 = current_ids.index(id_2)
             
-            if p1 in current_players and p2 in current_players:
+            if idx_1 != idx_2:
                 stats["total_matches"] += 1
                 
-                # 1. 获取本局 4 个人的分数，算出排名
-                # 注意：这里用 Raw Score (4-7列) 来算绝对排名最稳妥
-                scores_for_rank = []
-                for i in range(4):
-                    try:
-                        s = float(row[4+i])
-                    except: s = -999999
-                    scores_for_rank.append(s)
-                
-                # 找到 A 和 B 在本局的得分
-                idx_1 = current_players.index(p1)
-                idx_2 = current_players.index(p2)
-                score_val_1 = scores_for_rank[idx_1]
-                score_val_2 = scores_for_rank[idx_2]
+                # 1. 本局 A 和 B 的分数 (E-H 列)
+                score_val_1 = shared_scores[k, idx_1]
+                score_val_2 = shared_scores[k, idx_2]
                 
-                # 2. 计算排名 (1-4)
-                # 逻辑：比我分高的人数 + 1 = 我的排名
-                rank_1 = sum(1 for s in scores_for_rank if s > score_val_1) + 1
-                rank_2 = sum(1 for s in scores_for_rank if s > score_val_2) + 1
+                # 2. 排名 (1-4) 读顺位矩阵；分数为空 (0) 视为第 4 名
+                rank_1 = int(shared_places[k, idx_1]) or 4
+                rank_2 = int(shared_places[k, idx_2]) or 4
                 
-                # 3. 计算 PT 差 (用于直击点差) - 抓取 8-11 列
-                try: pt_1 = float(row[4 + idx_1])
-                except: pt_1 = 0
-                try: pt_2 = float(row[4 + idx_2])
-                except: pt_2 = 0
+                # 3. 计算分差 (用于直击点差)，分数为空按 0 算
+                pt_1 = int(score_val_1) if shared_places[k, idx_1] else 0
+                pt_2 = int(score_val_2) if shared_places[k, idx_2] else 0
                 stats["p1_pt_diff"] += (pt_1 - pt_2)
 
                 # 4. 判定胜负类型
@@ -600,61 +838,38 @@ def get_local_player_stats(player_name):
         print(f"❌ 读取本地数据失败: {e}")
         return None
 # --- 1.3 获取排行榜数据的函数 ---
+# 排好序的榜单跟着快照更新，/ranking、/report、/record_game 共用
+leaderboards = LeaderboardCache(sheet_cache)
+# QUERY_BACKEND=sqlite 时 /ranking、/report 的榜单从本地镜像读
+mirror_leaderboards = MirrorLeaderboardCache(mirror)
+
 def get_ranking_data(category):
     try:
-        sh = gc.open_by_key(SHEET_ID)
-        
         # 1. 根据类别选择工作表 (Sheet)
         if "quarter" in category:
             sheet_name = "Ranking Quarter"
         else:
             sheet_name = "Ranking"
             
-        ws = sh.worksheet(sheet_name)
-        rows = ws.get_all_values()
-        
-        # 2. 根据类别选择列索引 (Column Index)
-        # 索引从0开始: A=0, B=1, ... D=3, E=4 ... G=6, H=7
+        # 2. 根据类别选择榜单
         if "mmr" in category:
-            name_idx, score_idx = 0, 1 # A, B列
             label = "MMR"
         elif "pt" in category:
-            name_idx, score_idx = 3, 4 # D, E列
             label = "PT"
         elif "games" in category:
-            name_idx, score_idx = 6, 7 # G, H列
             label = "Games"
         else:
             return None, "未知榜单类型"
+        if category not in BOARDS:
+            return None, "未知榜单类型"
 
-        data_list = []
-        
-        # 3. 遍历并提取数据 (从第2行开始，跳过标题)
-        for row in rows[1:]:
-            # 确保这一行够长，防止越界
-            if len(row) <= score_idx: continue
-            
-            name = row[name_idx].strip()
-            score_str = row[score_idx].strip()
-            
-            # 如果名字或分数是空的，跳过
-            if not name or not score_str: continue
-            
-            try:
-                # 尝试转成数字排序
-                score = float(score_str)
-                data_list.append({"name": name, "score": score})
-            except:
-                continue # 如果分数不是数字（比如表头混进来了），跳过
-
-        # 4. 排序 (从大到小)
-        # key=lambda x: x["score"] 表示按分数排
-        sorted_data = sorted(data_list, key=lambda x: x["score"], reverse=True)
+        # 3. 已经排好序的榜单 (表格没改动时不重新排序；sqlite 后端从本地镜像读)
+        board = (mirror_leaderboards if QUERY_BACKEND == "sqlite" else leaderboards).get(category)
         
         # 只取前 15 名，防止刷屏
         return {
             "title": f"{label} Ranking ({sheet_name})",
-            "data": sorted_data[:15], 
+            "data": [{"name": name, "score": score} for name, score in board.top(15)],
             "label": label
         }, None
 
@@ -662,97 +877,200 @@ def get_ranking_data(category):
         print(f"Ranking Error: {e}")
         return None, str(e)
 # --- 1.4 获取指定玩家的实时排名和分数 (用于战报对比) ---
-def get_players_status(player_names):
+def get_players_status(player_names, boards_source=None):
     """
     输入: ['Frank', 'John', ...]
     输出: 字典 {'Frank': {'mmr': 1500, 'mmr_rank': 1, 'pt': 200, 'pt_rank': 3}, ...}
-    说明: 同时读取 'Ranking' (总分) 和 'Ranking Quarter' (季分)
+    说明: 总榜 MMR ('Ranking') 和季度 PT ('Ranking Quarter')，每个人查一次名次索引
+    boards_source 默认是 leaderboards (表格快照)，也可以传 mirror_leaderboards (本地镜像)
     """
     # 1. 初始化: 给所有玩家填默认值，防止报错
     status = {name: {"mmr": 0, "mmr_rank": "Unranked", "pt": 0, "pt_rank": "Unranked"} for name in player_names}
     
     try:
-        sh = gc.open_by_key(SHEET_ID)
-        
-        # ==========================================
-        # 🟢 A 部分: 读取总榜 MMR (Ranking)
-        # ==========================================
+        # 两张榜单各只读两列，合并成一次批量请求
+        boards = (boards_source or leaderboards).get_many(["total_mmr", "quarter_pt"])
+    except Exception as e:
+        print(f"❌ Get Status Critical Error: {e}")
+        return status
+
+    for target in player_names:
+        for board, value_key, rank_key in (("total_mmr", "mmr", "mmr_rank"), ("quarter_pt", "pt", "pt_rank")):
+            hit = boards[board].lookup(player_registry.canonical(target))
+            if hit is not None:
+                status[target][rank_key], status[target][value_key] = hit
+    return status
+
+def find_game_rows(games, lookback=50):
+    """
+    在两张对局表末尾找这几局 (一次读取)，games 是 [(time_str, players_ordered, scores_ordered), ...]，
+    返回对应的 Games Riichi 行号列表 (找不到的是 None)。
+    离线时只有旧快照，抛 StaleSnapshotError (ConnectionError，写入队列稍后重试)，不会当成没写过再写一次
+    """
+    snaps = sheet_cache.read_through(GAME_SHEETS)
+    return match_game_rows(snaps["Games Riichi"].rows, snaps["Games/pt"].rows, games, lookback)
+
+def registered_names():
+    rows = sheet_cache.read_through(["Ratings"])["Ratings"].rows
+    return {row[0].strip().lower() for row in rows[1:] if row}
+
+def commit_writes(entries):
+    """
+    把队列里的一组写入 (对局 / 注册) 合并成一次 batchUpdate：
+    Ratings、Games/pt、Games Riichi 各自按顺序追加，要么全部写进去要么都没写。
+    之前发送过的条目 (attempts > 0，可能其实已经写进去了) 先按幂等键查重。
+    返回 {id: 结果}，对局的结果是 Games Riichi 里的行号
+    """
+    retried_games = [e for e in entries if e.kind == "game" and e.attempts]
+    done_rows = {}
+    if retried_games:
+        rows = find_game_rows([entry_game(e) for e in retried_games])
+        done_rows = {e.id: row for e, row in zip(retried_games, rows) if row is not None}
+    known = registered_names() if any(e.kind == "register" and e.attempts for e in entries) else set()
+
+    appends, games, results = plan_appends(entries, done_rows, known)
+    if not appends:
+        return results
+
+    sheets.batch_append(appends)
+    if "Ratings" in appends:
+        sheet_cache.append_rows("Ratings", appends["Ratings"])
+    if games:
+        # 新行的 MMR/PT/排名都由表格公式计算，标记过期 (对局表下次只同步末尾)
+        sheet_cache.expire(*GAME_DEPENDENT_SHEETS)
+        # appendCells 的回复里没有写入的位置，按幂等键在表格末尾找新行 (这次读取顺便把对局表同步到最新)
+        # 已经写进去了，这里读失败不能当成写入失败 (否则会再写一次)，拿不到行号时调用方退回固定等待
         try:
-            ws_rank = sh.worksheet("Ranking")
-            rows_rank = ws_rank.get_all_values()
-            
-            mmr_list = []
-            # 假设 Ranking 表: A列=名字(0), B列=MMR(1)
-            for row in rows_rank[1:]:
-                if len(row) < 2 or not row[0]: continue
-                try: 
-                    mmr_list.append({"name": row[0].strip().lower(), "val": float(row[1])})
-                except: continue
-            
-            # 排序 & 匹配
-            mmr_list.sort(key=lambda x: x["val"], reverse=True)
-            for rank, item in enumerate(mmr_list, 1):
-                for target in player_names:
-                    if item["name"] == target.lower():
-                        status[target]["mmr"] = item["val"]
-                        status[target]["mmr_rank"] = rank
+            rows = find_game_rows([entry_game(e) for e in games])
         except Exception as e:
-            print(f"⚠️ 读取 Ranking 失败: {e}")
+            print(f"⚠️ 已写入，但读取新行行号失败: {e}")
+            rows = [None] * len(games)
+        results.update({entry.id: row for entry, row in zip(games, rows)})
+    return results
+
+def read_settle_probe(riichi_row):
+    """
+    只读新行的 I-P (MMR 变动 + 绝对 MMR) 这 8 个格子，不再每次读整列排行榜：
+    这一局的 MMR 算完且连续两次不变，就认为表格算完了
+    """
+    resp = sheets.api.values_batch_get([f"'Games Riichi'!I{riichi_row}:P{riichi_row}"])
+    value_ranges = [vr.get("values", []) for vr in resp.get("valueRanges", [])]
+    rows = value_ranges[0] if value_ranges else []
+    return tuple(((rows[0] if rows else []) + [""] * 8)[:8])
 
-        # ==========================================
-        # 🔵 B 部分: 读取季度榜 PT (Ranking Quarter)
-        # ==========================================
+async def wait_for_sheet_settle(riichi_row, timeout=SETTLE_TIMEOUT):
+    """
+    轮询 (间隔逐渐变长) 直到新行的 MMR 都是数字，且连续两次读取结果不变。
+    算完返回 True；超过 timeout 仍未稳定返回 False
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = SETTLE_POLL_START
+    last_probe = None
+    
+    while True:
+        await asyncio.sleep(delay)
         try:
-            ws_quarter = sh.worksheet("Ranking Quarter")
-            rows_quarter = ws_quarter.get_all_values()
-            
-            pt_list = []
-            # ⚠️ 注意：您代码里写的是 index 3 (D列) 和 index 4 (E列)
-            # 如果您的表格其实是 A列(0) 和 B列(1)，请修改下面的数字！
-            NAME_COL = 3  # D列
-            PT_COL = 4    # E列
-            
-            for row in rows_quarter[1:]:
-                # 检查列数够不够，防止越界
-                if len(row) <= PT_COL or not row[NAME_COL]: continue
-                try: 
-                    p_name = row[NAME_COL].strip().lower()
-                    p_pt = float(row[PT_COL])
-                    pt_list.append({"name": p_name, "val": p_pt})
-                except: continue
-            
-            # 排序 & 匹配
-            pt_list.sort(key=lambda x: x["val"], reverse=True)
-            for rank, item in enumerate(pt_list, 1):
-                for target in player_names:
-                    if item["name"] == target.lower():
-                        status[target]["pt"] = item["val"]
-                        status[target]["pt_rank"] = rank
+            probe = await repo.run(read_settle_probe, riichi_row)
         except Exception as e:
-            print(f"⚠️ 读取 Ranking Quarter 失败: {e}")
-
-        return status
+            print(f"⚠️ 轮询表格失败: {e}")
+            probe = None
+        
+        if probe is not None:
+            try:
+                [float(c) for c in probe[4:]]  # M-P 的绝对 MMR
+                computed = True
+            except ValueError:
+                computed = False  # 还是空的 / Loading... / #N/A
+            if computed and probe == last_probe:
+                return True
+            last_probe = probe
+        
+        if loop.time() + delay > deadline:
+            return False
+        delay = min(delay * 1.5, SETTLE_POLL_MAX)
 
+async def settle_new_game(riichi_row):
+    """
+    等新录入的一局公式算完，然后把依赖它的表标记过期：
+    等待期间读到的快照 (指令、后台预热) 可能是没算完的结果，而且已经记上了新的修改时间，不标记就一直用它
+    """
+    settled = False
+    if riichi_row:
+        settled = await wait_for_sheet_settle(riichi_row)
+    else:
+        # 拿不到新行行号时退回到固定等待
+        await asyncio.sleep(SETTLE_FALLBACK_WAIT)
+    sheet_cache.expire(*GAME_DEPENDENT_SHEETS)
+    return settled
+
+async def settle_and_refresh(riichi_row):
+    """没有指令在等的对局写入后：等公式算完再预热 (同步镜像)"""
+    await settle_new_game(riichi_row)
+    await refresh_after_write()
+
+# --- 1.5 本地 MMR/PT 计算 (和表格公式对照) ---
+# 参数来自 RATING_PARAMS_FILE (和表格公式一致)；没有参数文件就不对照、不预览
+rating_params = load_rating_params()
+rating_engine = RatingEngine(rating_params)
+RATING_ENGINE_STATE = {"verified": False, "generation": None, "verified_generation": None}
+rating_engine_lock = threading.Lock()  # 引擎在线程池里被多个指令共用
+
+def verify_rating_engine():
+    """
+    用本地引擎回放全部对局，和表格 I-P 列 / PT 列对比；全部一致才允许用本地结果预览。
+    同一份 Games Riichi 快照 (generation) 只对比一次，断线重连再次触发 on_ready 时不重复回放
+    """
+    if rating_params is None:
+        print(f"ℹ️ 没有 MMR 参数文件 ({RATING_PARAMS_FILE})，不启用本地预估")
+        return None
+    try:
+        riichi_snap = sheet_cache.get_snapshot("Games Riichi")
+        if RATING_ENGINE_STATE["verified_generation"] == riichi_snap.generation:
+            return None
+        initial = load_initial_ratings(sheet_cache.get_values("Ratings"))
+        riichi = riichi_snap.rows
+        pt_rows = sheet_cache.get_values("Games/pt")
+        report = verify_against_sheet(riichi, pt_rows, rating_engine.params, initial)
+        with rating_engine_lock:
+            RATING_ENGINE_STATE["verified_generation"] = riichi_snap.generation
+            rating_engine.initial_ratings = initial
+            RATING_ENGINE_STATE["verified"] = report["checked"] > 0 and report["mismatches"] == 0
+            RATING_ENGINE_STATE["generation"] = None  # 下次预览时重新回放
+        print(f"🧮 本地 MMR 引擎对比 {report['checked']} 格，不一致 {report['mismatches']} 格 (最大误差 {report['max_error']:.3f})")
+        for line in report["examples"]:
+            print(f"   ❌ {line}")
+        return report
     except Exception as e:
-        print(f"❌ Get Status Critical Error: {e}")
-        return status
+        print(f"❌ 本地 MMR 引擎验证失败: {e}")
+        return None
+
+def preview_rating_changes(players_ordered, scores_ordered):
+    """用本地引擎预估这一局的 MMR / PT 变动 (不写表格)"""
+    snap = sheet_cache.get_snapshot("Games Riichi")
+    with rating_engine_lock:
+        if RATING_ENGINE_STATE["generation"] != snap.generation:
+            # 表格被完整重读过 (可能改过旧数据)，从头回放
+            rating_engine.reset()
+            RATING_ENGINE_STATE["generation"] = snap.generation
+        rating_engine.replay(snap.rows[1:])
+        return rating_engine.compute_game(players_ordered, scores_ordered)
 
 def update_config(key, value):
     """更新 Config 表 (通用函数保持不变)"""
-    sh = gc.open_by_key(SHEET_ID)
-    try: ws = sh.worksheet("Config")
-    except: ws = sh.add_worksheet("Config", rows=100, cols=2)
+    try: sheets.worksheet("Config")
+    except WorksheetNotFound: sheets.add_worksheet("Config", rows=100, cols=2)
     
-    cell = ws.find(key)
-    if cell: ws.update_cell(cell.row, 2, value)
-    else: ws.append_row([key, value])
+    cell = sheets.call("Config", "find", key)
+    if cell: sheets.call("Config", "update_cell", cell.row, 2, value)
+    else: sheets.call("Config", "append_row", [key, value])
+    # 同步修改快照，后续读取无需重新下载
+    sheet_cache.set_config_value(key, value)
 
 def get_quarter_config():
     """读取 Quarter 起止时间"""
     try:
-        sh = gc.open_by_key(SHEET_ID)
-        ws = sh.worksheet("Config")
-        data = ws.get_all_values()
+        data = sheet_cache.get_values("Config")
         
         # 🟢 改为查找 quarter_start 和 quarter_end
         config = {"start": None, "end": None}
@@ -762,9 +1080,9 @@ def get_quarter_config():
         e_str = config_dict.get("quarter_end")
         
         if s_str:
-            config["start"] = datetime.datetime.strptime(s_str, "%Y-%m-%d")
+            config["start"] = datetime.strptime(s_str, "%Y-%m-%d")
         if e_str:
-            config["end"] = datetime.datetime.strptime(e_str, "%Y-%m-%d") + datetime.timedelta(days=1)
+            config["end"] = datetime.strptime(e_str, "%Y-%m-%d") + timedelta(days=1)
             
         return config
     except Exception as e:
@@ -775,65 +1093,27 @@ def get_accumulated_stats(start_date, end_date=None):
     统计 start_date 到 end_date 之间的所有数据
     包含：自动清洗中文符号、适配多种日期格式
     """
-    sh = gc.open_by_key(SHEET_ID)
-    ws = sh.worksheet("Games/pt")
-    rows = ws.get_all_values()
-    
     if not end_date:
-        end_date = datetime.datetime.now()
-
-    stats = {} 
-    
-    for row in rows[1:]:
-        if not row[0]: continue
-        
-        # 1. 获取原始字符串
-        raw_date_str = row[0].strip()
-        
-        # 🧹 2. 数据清洗 (关键步骤！)
-        # 把中文冒号 '：' 替换成英文冒号 ':'
-        # 把多个空格缩减为一个，防止 '1/5/2026  14:30' 这种情况
-        clean_date_str = raw_date_str.replace("：", ":").replace("  ", " ")
-        
-        game_date = None
-        
-        # 3. 定义可能遇到的格式
-        date_formats = [
-            "%m/%d/%Y %H:%M",     # 您的目标格式: 01/05/2026 14:30
-            "%m/%d/%Y %H:%M:%S",  # 带秒: 01/05/2026 14:30:00
-            "%Y-%m-%d %H:%M",     # 备用: 2026-01-05 14:30
-            "%Y-%m-%d %H:%M:%S",  # 备用: 2026-01-05 14:30:00
-            "%Y/%m/%d %H:%M",     # 备用: 2026/01/05 14:30 (年月倒过来)
-        ]
-        
-        for fmt in date_formats:
-            try:
-                game_date = datetime.datetime.strptime(clean_date_str, fmt)
-                break 
-            except ValueError:
-                continue 
-        
-        # 如果还是读不出来，打印错误方便调试
-        if game_date is None:
-            # print(f"⚠️ 跳过无法解析的日期: {raw_date_str}")
-            continue
-        
-        # 4. 统计逻辑 (保持不变)
-        if start_date <= game_date < end_date:
-            for i in range(4):
-                name_idx = 1 + i*3
-                pt_idx = 3 + i*3
-                if len(row) <= pt_idx: continue
-                name = row[name_idx].strip().lower()
-                if not name: continue
-                try: pt = float(row[pt_idx])
-                except: pt = 0
-                
-                if name not in stats: stats[name] = {'games': 0, 'pt': 0.0}
-                stats[name]['games'] += 1
-                stats[name]['pt'] += pt
-                
-    return stats
+        end_date = datetime.now()
+
+    if QUERY_BACKEND == "sqlite":
+        # 本地 SQLite 镜像：时间索引上取范围，按玩家 GROUP BY
+        return mirror.period_totals(to_epoch(start_date), to_epoch(end_date))
+
+    # 每局在解析 Games/pt 时已经按 (玩家, 天) 汇总好，整天直接加汇总，只有首尾不满一天的部分看具体对局
+    sync_game_table()
+    with game_table.lock:
+        totals = game_table.pt.period_totals(to_epoch(start_date), to_epoch(end_date))
+        player_keys = game_table.player_keys
+        return {player_keys[pid]: {'games': games, 'pt': pt} for pid, (games, pt) in totals.items()}
+
+def unparsed_game_dates():
+    """Games/pt 里有对局但时间无法解析的行 [(行号, 原始文字), ...]，这些对局不计入任何周期"""
+    if QUERY_BACKEND == "sqlite":
+        return mirror.unparsed_dates()
+    sync_game_table()
+    with game_table.lock:
+        return [(pos + 1, raw) for pos, raw in game_table.pt.bad_dates]
 # --- 7. Slash Command 指令 ---
 @client.tree.command(name="recent_match", description="查询最近 5 场对局记录及同桌分数")
 @app_commands.describe(player_name="输入玩家名字")
@@ -841,10 +1121,11 @@ def get_accumulated_stats(start_date, end_date=None):
 async def recent_match(interaction: discord.Interaction, player_name: str):
     # 1. 告诉 Discord 我们在处理 (防止超时)
     await interaction.response.defer()
+    profile_prefetcher.cancel()  # 指令已经提交，还在等待的预热不用再跑
 
     # 2. 调用我们在上一轮修改好的函数
     # 注意：确保 get_player_recent_stats 已经是最新版 (包含了 details 字段逻辑)
-    matches, stats = get_player_recent_stats(player_name)
+    matches, stats = await repo.run(cached_profile, get_player_recent_stats, player_name)
 
     # 3. 错误处理
     if not matches:
@@ -894,11 +1175,11 @@ async def recent_match(interaction: discord.Interaction, player_name: str):
         )
 
     # 6. 发送结果
-    await interaction.followup.send(embed=embed)
+    await interaction.followup.send(embed=mark_if_stale(embed))
     # ✅ 正确：defer 之后必须用 followup
     #await interaction.followup.send(f"🔍 Searching data for **{player_name}** ...")
     
-    match_history, stats = get_player_recent_stats(player_name)
+    match_history, stats = await repo.run(cached_profile, get_player_recent_stats, player_name)
     
     if match_history is None:
         await interaction.edit_original_response(content=f"Error: {stats}")
@@ -954,16 +1235,17 @@ async def recent_match(interaction: discord.Interaction, player_name: str):
 async def personal_data(interaction: discord.Interaction, player_name: str):
     # 使用 defer 来等待
     await interaction.response.defer(ephemeral=False)
+    profile_prefetcher.cancel()  # 指令已经提交，还在等待的预热不用再跑
     
     # --- 1. 获取 Google Sheets / 数据库 里的总体数据 (你原本的逻辑) ---
-    data, error = get_personal_detailed_data(player_name)
+    data, error = await repo.run(cached_profile, get_personal_detailed_data, player_name)
     
     if data is None:
         await interaction.followup.send(content=f"❌ Error: {error}")
         return
 
     # --- 2. 获取 本地 CSV 里的详细对局数据 (新增逻辑) ---
-    local_stats = get_local_player_stats(player_name)
+    local_stats = await asyncio.to_thread(get_local_player_stats, player_name)
 
     # --- 3. 解包原有数据 ---
     info = data["info"]
@@ -1051,14 +1333,15 @@ async def personal_data(interaction: discord.Interaction, player_name: str):
     else:
         embed.set_footer(text="Not enough data to generate MMR chart.")
 
-    await interaction.followup.send(embed=embed)
+    await interaction.followup.send(embed=mark_if_stale(embed))
 @client.tree.command(name="versus", description="Query the match history between the two players.")
 @app_commands.describe(player_a="选手 A", player_b="选手 B")
 @app_commands.autocomplete(player_a=player_name_autocomplete, player_b=player_name_autocomplete)
 async def versus(interaction: discord.Interaction, player_a: str, player_b: str):
     await interaction.response.defer()
+    profile_prefetcher.cancel()  # 指令已经提交，还在等待的预热不用再跑
     
-    data, error = get_versus_data(player_a, player_b)
+    data, error = await repo.run(get_versus_data, player_a, player_b)
     if data is None:
         await interaction.followup.send(f"❌ {error}")
         return
@@ -1153,7 +1436,7 @@ async def versus(interaction: discord.Interaction, player_a: str, player_b: str)
     recent_str = " -> ".join(data["recent_record"])
     embed.set_footer(text=f"最近5场胜者: {recent_str}")
 
-    await interaction.followup.send(embed=embed)
+    await interaction.followup.send(embed=mark_if_stale(embed))
 from discord import app_commands # 确保引用了这个
 
 @client.tree.command(name="ranking", description="查看服务器排行榜 (MMR / PT / 场次)")
@@ -1170,7 +1453,7 @@ async def ranking(interaction: discord.Interaction, category: app_commands.Choic
     await interaction.response.defer()
     
     # category.value 就是上面 value=... 里的字符串
-    lb_data, error = get_ranking_data(category.value)
+    lb_data, error = await repo.run(get_ranking_data, category.value)
     
     if lb_data is None:
         await interaction.followup.send(f"❌ 获取榜单失败: {error}")
@@ -1216,7 +1499,7 @@ async def ranking(interaction: discord.Interaction, category: app_commands.Choic
     # 加个脚标显得专业
     embed.set_footer(text="Data updated from Google Sheets")
     
-    await interaction.followup.send(embed=embed)
+    await interaction.followup.send(embed=mark_if_stale(embed))
 @client.tree.command(name="record_game", description="录入成绩并显示变动 (自动等待Sheet计算)")
 @app_commands.describe(
     rank1_name="第1名名字", rank1_score="第1名分数",
@@ -1269,32 +1552,56 @@ async def record_game(
 
         # --- 📸 阶段一：获取“变动前”状态 ---
         status_msg = await interaction.followup.send("⏳ 正在读取当前排名...", wait=True)
-        pre_status = get_players_status(players_ordered)
+        pre_status = await repo.run(get_players_status, players_ordered)
+        preview = None
+        if RATING_ENGINE_STATE["verified"]:
+            preview = await repo.run(preview_rating_changes, players_ordered, scores_ordered)
         
         # --- 📝 阶段二：写入数据 ---
-        await status_msg.edit(content="📝 正在写入表格 (优先记录时间)...")
-        
-        sh = gc.open_by_key(SHEET_ID)
-        
-        # 👉 动作 A: 先写入 Games/pt (时间表)
-        ws_pt = sh.worksheet("Games/pt")
-        ws_pt.append_row([final_time_str]) 
-        
-        # 👉 动作 B: 再写入 Games Riichi (分数表)
-        ws_riichi = sh.worksheet("Games Riichi")
-        ws_riichi.append_row(players_ordered + scores_ordered)
-        
-        # --- ⏳ 阶段三：让子弹飞一会儿 ---
-        # 等待 Google Sheet 公式计算
-        await status_msg.edit(content=f"🔄 数据已写入 (时间: {final_time_str})，等待 Google Sheet 计算 (约1分钟)...")
-        await asyncio.sleep(60) 
+        # 先存进本地写入队列 (重启也不会丢)，和其他桌同时结束的对局合并成一次请求写进表格
+        await status_msg.edit(content=f"📮 已收到 (时间: {final_time_str})，正在写入表格...")
+        
+        riichi_row, committed = await submit_write(status_msg, "game", {
+            "time_str": final_time_str,
+            "players_ordered": players_ordered,
+            "scores_ordered": scores_ordered,
+        })
+        if not committed:
+            await status_msg.edit(
+                content=f"📮 Google Sheets 暂时无法写入，本局 (时间: {final_time_str}) 已存入本地队列 (前面还有 {len(outbox) - 1} 条)，"
+                        f"恢复连接后会按顺序自动写入，并更新这条消息。"
+            )
+            return
+        
+        # --- ⏳ 阶段三：等待 Google Sheet 公式计算 ---
+        # 轮询新行的 MMR 和排行榜，数值稳定就继续，最多等 SETTLE_TIMEOUT 秒
+        if preview:
+            # 本地引擎已和表格核对过，先给出预估结果
+            preview_embed = discord.Embed(title="🧮 预估结算 (Preview)", color=0xAAAAAA)
+            for i, name in enumerate(players_ordered):
+                delta = preview["mmr_delta"][i]
+                pt = preview["pt"][i]
+                preview_embed.add_field(
+                    name=f"{name} ({scores_ordered[i]})",
+                    value=f" **MMR**: `{preview['mmr_after'][i]:.1f} ({'+' if delta >= 0 else ''}{delta:.1f})`\n"
+                          f" **PT**: `{'+' if pt >= 0 else ''}{pt:.1f}`",
+                    inline=False
+                )
+            await status_msg.edit(content=f"🔄 数据已写入 (时间: {final_time_str})，等待 Google Sheet 确认...", embed=preview_embed)
+        else:
+            await status_msg.edit(content=f"🔄 数据已写入 (时间: {final_time_str})，等待 Google Sheet 计算...")
+        # 等待期间别的指令可能缓存了公式未算完的数据，算完后会再标记过期一次
+        settled = await settle_new_game(riichi_row)
         
         # --- 📸 阶段四：获取“变动后”状态 ---
-        post_status = get_players_status(players_ordered)
+        post_status = await repo.run(get_players_status, players_ordered)
+        asyncio.create_task(refresh_after_write())
         
         # --- 📊 阶段五：生成精美战报 ---
         embed = discord.Embed(title="✅ 结算完成 (Game Summary)", color=0x00FF00)
         embed.description = f"**Time Recorded:** {final_time_str}"
+        if riichi_row and not settled:
+            embed.description += "\n⚠️ 表格公式可能仍在计算，数值仅供参考。"
         
         rank_emojis = ["🐶", "🥈", "🥉", "🪦"]
         
@@ -1414,33 +1721,40 @@ async def record(interaction: discord.Interaction, player_name: str):
     )
 
 @client.tree.command(name="report", description="生成战报 (周/月/Quarter)")
-@app_commands.describe(period="选择统计周期")
+@app_commands.describe(
+    period="选择统计周期",
+    start_date="自定义: 开始日期 (2026-01-01)",
+    end_date="自定义: 结束日期 (2026-01-31，含当天)，留空则到现在"
+)
 @app_commands.choices(period=[
     app_commands.Choice(name="📅 Weekly (本周)", value="weekly"),
     app_commands.Choice(name="🌙 Monthly (本月)", value="monthly"),
-    app_commands.Choice(name="❄️ Quarter (本季度)", value="quarter") 
+    app_commands.Choice(name="❄️ Quarter (本季度)", value="quarter"),
+    app_commands.Choice(name="🗓️ Custom (自定义日期)", value="custom")
 ])
-async def report(interaction: discord.Interaction, period: app_commands.Choice[str]):
+async def report(interaction: discord.Interaction, period: app_commands.Choice[str],
+                 start_date: str = None, end_date: str = None):
     await interaction.response.defer()
+    custom_start, custom_end = start_date, end_date
     
     try:
-        now = datetime.datetime.now()
+        now = datetime.now()
         start_date = None
         end_date = None
         title = ""
         
         # --- 1. 确定时间范围 ---
         if period.value == "weekly":
-            start_date = now - datetime.timedelta(days=7)
+            start_date = now - timedelta(days=7)
             title = "Weekly Report (近7天)"
             
         elif period.value == "monthly":
-            start_date = now - datetime.timedelta(days=30)
+            start_date = now - timedelta(days=30)
             title = "Monthly Report (近30天)"
             
         elif period.value == "quarter":
             # 读取 Quarter 配置
-            config = get_quarter_config()
+            config = await repo.run(get_quarter_config)
             if not config or not config["start"]:
                 await interaction.followup.send("⚠️ 管理员尚未设置本 Quarter 时间。请让管理员使用 `/set_quarter`。")
                 return
@@ -1448,13 +1762,24 @@ async def report(interaction: discord.Interaction, period: app_commands.Choice[s
             start_date = config["start"]
             end_date = config["end"]
             title = "Quarter Report (本季度)"
+        
+        elif period.value == "custom":
+            try:
+                start_date = datetime.strptime(custom_start or "", "%Y-%m-%d")
+                end_date = datetime.strptime(custom_end, "%Y-%m-%d") + timedelta(days=1) if custom_end else None
+            except ValueError:
+                await interaction.followup.send("❌ 日期格式错误！请使用 `YYYY-MM-DD` 格式 (例如 2026-01-01)。")
+                return
+            title = "Custom Report (自定义)"
 
         # --- 2. 获取数据 (这里是你修改过的地方，现在是对的) ---
-        acc_stats = get_accumulated_stats(start_date, end_date)
+        acc_stats = await repo.run(get_accumulated_stats, start_date, end_date)
         
         # --- 3. 获取当前 MMR (用于展示在面板上) ---
         # ⚠️ 确保你之前定义过 get_players_status 函数
-        current_status = get_players_status(list(acc_stats.keys()))
+        # sqlite 后端整个 /report 都从本地镜像读，不请求 Google
+        boards_source = mirror_leaderboards if QUERY_BACKEND == "sqlite" else leaderboards
+        current_status = await repo.run(get_players_status, list(acc_stats.keys()), boards_source)
         
         # --- 4. 生成漂亮的 Embed (这是你漏掉的部分) ---
         embed = discord.Embed(title=f"📊 {title}", color=0x00BFFF)
@@ -1491,9 +1816,14 @@ async def report(interaction: discord.Interaction, period: app_commands.Choice[s
         else:
             time_str += " - 至今"
             
-        embed.set_footer(text=f"统计区间: {time_str}")
+        footer = f"统计区间: {time_str}"
+        bad_dates = await repo.run(unparsed_game_dates)
+        if bad_dates:
+            rows = ", ".join(str(row) for row, _ in bad_dates[:5]) + (" ..." if len(bad_dates) > 5 else "")
+            footer += f"\n⚠️ Games/pt 有 {len(bad_dates)} 局时间无法解析，未计入 (行 {rows})"
+        embed.set_footer(text=footer)
         
-        await interaction.followup.send(embed=embed)
+        await interaction.followup.send(embed=mark_if_stale(embed))
 
     except Exception as e:
         # 如果出错了，打印出来并告诉用户
@@ -1510,8 +1840,8 @@ async def set_quarter(interaction: discord.Interaction, start_date: str, end_dat
     
     # 1. 日期格式检查
     try:
-        datetime.datetime.strptime(start_date, "%Y-%m-%d")
-        datetime.datetime.strptime(end_date, "%Y-%m-%d")
+        datetime.strptime(start_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
     except ValueError:
         await interaction.followup.send("❌ 日期格式错误！请使用 `YYYY-MM-DD` 格式 (例如 2026-01-01)。")
         return
@@ -1519,12 +1849,41 @@ async def set_quarter(interaction: discord.Interaction, start_date: str, end_dat
     # 2. 写入 Config 表
     try:
         # 更新配置
-        update_config("quarter_start", start_date)
-        update_config("quarter_end", end_date)
+        await repo.run(update_config, "quarter_start", start_date, lane=LANE_WRITE)
+        await repo.run(update_config, "quarter_end", end_date, lane=LANE_WRITE)
         
         await interaction.followup.send(f"✅ **Winter Quarter** 时间已更新！\n📅 `{start_date}` ⮕ `{end_date}`")
     except Exception as e:
         await interaction.followup.send(f"❌ 设置失败: {e}")
+@client.tree.command(name="sheet_stats", description="[管理员] 查看 Google Sheets 请求队列和等待时间")
+@app_commands.default_permissions(administrator=True)
+async def sheet_stats(interaction: discord.Interaction):
+    metrics = repo.metrics()
+    lines = [
+        f"🪣 令牌: {metrics['tokens']:.1f} / {metrics['capacity']:.0f}",
+        f"⏳ 线程池中的调用: {metrics['pending_calls']}",
+    ]
+    for name, lane in metrics["lanes"].items():
+        lines.append(
+            f"**{name}**: 排队 {lane['queued']} | 请求 {lane['requests']} | "
+            f"平均等待 {lane['avg_wait']:.2f}s | 最长 {lane['max_wait']:.2f}s | "
+            f"重试 {lane['retries']} | 失败 {lane['failures']}"
+        )
+    with game_table.lock:  # 只看已经解析过的部分，不在这里触发同步
+        bad_dates = [(pos + 1, raw) for pos, raw in game_table.pt.bad_dates]
+    if bad_dates:
+        lines.append(f"📅 时间无法解析的对局: {len(bad_dates)} 局 (" + ", ".join(f"行 {row}: `{raw}`" for row, raw in bad_dates[:5]) + ")")
+    prefetch = profile_prefetcher.stats
+    lines.append(
+        f"🔮 预热: 请求 {prefetch['requested']} | 开始 {prefetch['started']} | "
+        f"取消 {prefetch['cancelled']} | 跳过 {prefetch['skipped']} | 失败 {prefetch['failed']}"
+    )
+    queue = writer.metrics()
+    lines.append(f"📮 写入队列: {queue['queued']} 条 | 等待回复 {queue['waiting']}")
+    if queue["last_error"]:
+        lines.append(f"⚠️ 上次写入失败: {queue['last_error']}")
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
 # main.py 中新增的注册功能
 
 @client.tree.command(name="register", description="注册新玩家 (Register a new player)")
@@ -1540,50 +1899,152 @@ async def register(interaction: discord.Interaction, new_name: str):
         await interaction.followup.send(f"❌ Registration Failed.name **{new_name}** is already taken")
         return
 
+    status_msg = await interaction.followup.send(f"📮 正在注册 **{new_name}**...", wait=True)
     try:
-        result_msg = await asyncio.to_thread(perform_google_sheet_registration, new_name)
-        if "成功" in result_msg:            
-            # 只有当本地列表里还没有这个名字时才添加 (双重保险)
-            if new_name not in PLAYER_NAME_CACHE:
-                PLAYER_NAME_CACHE.append(new_name)
-                print(f"✅ 本地缓存已手动追加: {new_name}")
-            
-            await interaction.followup.send(f"✅ {result_msg}")
-        else:
-            await interaction.followup.send(f"❌ {result_msg}")
+        _, committed = await submit_write(status_msg, "register", {"player_name": new_name})
     except Exception as e:
-        await interaction.followup.send(f"❌ 系统错误: {e}")
+        print(f"写入 Google Sheet 失败: {e}")
+        await status_msg.edit(content=f"❌ 数据库写入失败: {e}")
+        return
+
+    # 只有当本地列表里还没有这个名字时才添加 (双重保险)
+    if new_name not in PLAYER_NAME_CACHE:
+        PLAYER_NAME_CACHE.append(new_name)
+        print(f"✅ 本地缓存已手动追加: {new_name}")
+    schedule_name_refresh()  # 自动补全索引里也加上
+    
+    if committed:
+        await status_msg.edit(content=f"✅ 注册成功！欢迎 **{new_name}** 加入。初始分数: 1500")
+    else:
+        await status_msg.edit(
+            content=f"📮 Google Sheets 暂时无法写入，**{new_name}** 的注册已存入本地队列，恢复连接后自动完成，并更新这条消息。"
+        )
 
-# --- 辅助函数：负责具体的 Google Sheets 写入操作 ---
-# 这个函数是同步的，被上面用 to_thread 调用，防止阻塞 Bot
-def perform_google_sheet_registration(player_name):
+# --- 7.5 写入队列 (write-behind) ---
+# /record_game /register 只把写入存进本地队列就继续，后台每 GROUP_COMMIT_WINDOW 秒合并成一次请求写进表格
+# 指令最多等 WRITE_ACK_TIMEOUT 秒；等不到 (例如 Google 连不上) 就先回复"已排队"，写入后再更新那条消息
+WRITE_ACK_TIMEOUT = float(os.getenv("WRITE_ACK_TIMEOUT", "20"))
+
+async def commit_outbox(entries):
+    results = await repo.run(commit_writes, entries, lane=LANE_WRITE)
+    if any(entry.kind == "game" for entry in entries):
+        mark_game_recorded()
+    return results
+
+def describe_write(entry):
+    if entry.kind == "game":
+        return f"本局 (时间: {entry.payload['time_str']})"
+    return f"**{entry.payload['player_name']}** 的注册"
+
+async def notify_committed(entry, result, error):
+    """没有指令在等的写入 (等待超时 / 重启前排队的)，写完后更新当初的回复消息"""
+    if not entry.notify:
+        return
+    channel = client.get_channel(entry.notify["channel_id"]) or await client.fetch_channel(entry.notify["channel_id"])
+    message = await channel.fetch_message(entry.notify["message_id"])
+    if error is not None:
+        await message.edit(content=f"❌ {describe_write(entry)} 写入表格失败: {error}")
+    elif entry.kind == "game":
+        # 公式算完之前预热，快照里会是空的 MMR / 排名
+        asyncio.create_task(settle_and_refresh(result))
+        await message.edit(content=f"✅ {describe_write(entry)} 已写入表格。")
+    else:
+        await message.edit(content=f"✅ 注册成功！欢迎 **{entry.payload['player_name']}** 加入。初始分数: 1500")
+
+writer = GroupCommitter(outbox, commit_outbox, on_commit=notify_committed)
+
+async def submit_write(message, kind, payload):
+    """
+    存入写入队列并等它写进表格 (最多 WRITE_ACK_TIMEOUT 秒)。
+    返回 (写入结果, 是否已写入)；没写入时这条留在队列里，写入后由 notify_committed 更新 message
+    """
+    entry_id, committed = writer.submit(kind, payload, notify={"channel_id": message.channel.id, "message_id": message.id})
     try:
-        sh = gc.open_by_key(SHEET_ID)
-        ws = sh.worksheet("Ratings")
-        
-        # 获取第一列的所有值，用来计算哪里是空行
-        # col_values(1) 返回的是一个列表，len(col_values) + 1 就是下一个空行的行号
-        # 注意：如果中间有空行，这种方法可能会插在中间。
-        # 最稳健的方法是 append_row
-        
-        # 准备要写入的一行数据： [名字, 初始分]
-        # 假设名字在 A 列 (第1列)，分数在 B 列 (第2列)
-        new_row = [player_name, 1500]
-        
-        # append_row 会自动寻找表格最底部的空行写入，非常方便且安全
-        ws.append_row(new_row)
-        
-        return f"注册成功！欢迎 **{player_name}** 加入。初始分数: 1500"
+        return await asyncio.wait_for(asyncio.shield(committed), WRITE_ACK_TIMEOUT), True
+    except asyncio.TimeoutError:
+        writer.release(entry_id)
+        return None, False
+
+# --- 8. 后台预热缓存 ---
+# 刚录入过对局 (PREWARM_RECENT_GAME 秒内) / 活跃时段 / 空闲 三档刷新间隔 (秒)
+PREWARM_FAST_INTERVAL = float(os.getenv("PREWARM_FAST_INTERVAL", "30"))
+PREWARM_ACTIVE_INTERVAL = float(os.getenv("PREWARM_ACTIVE_INTERVAL", "50"))  # 比 SHEET_CACHE_TTL 短，指令基本命中缓存
+PREWARM_IDLE_INTERVAL = float(os.getenv("PREWARM_IDLE_INTERVAL", "600"))
+PREWARM_RECENT_GAME = 3600
+# 活跃时段 (UTC-8 的小时，左闭右开)，例如 "12-24"
+PREWARM_ACTIVE_HOURS = tuple(int(h) for h in os.getenv("PREWARM_ACTIVE_HOURS", "12-24").split("-"))
+
+# 指令会读到的所有快照，每次预热合并成一次批量请求
+PREWARM_SHEETS = (
+    GAME_SHEETS
+    + sorted({key for key, _, _ in BOARDS.values()})
+    + ["Personal Data", "Personal Data 2026 Winter", "Ratings", "Config"]
+)
+LAST_GAME_RECORDED = {"at": float("-inf")}  # time.monotonic()
+
+def mark_game_recorded():
+    """录入对局后切换到最快的预热间隔"""
+    LAST_GAME_RECORDED["at"] = time.monotonic()
+    if prewarm_loop.is_running() and prewarm_loop.seconds != PREWARM_FAST_INTERVAL:
+        prewarm_loop.change_interval(seconds=PREWARM_FAST_INTERVAL)
+
+def prewarm_interval():
+    if time.monotonic() - LAST_GAME_RECORDED["at"] < PREWARM_RECENT_GAME:
+        return PREWARM_FAST_INTERVAL
+    local_hour = (datetime.now(timezone.utc) - timedelta(hours=8)).hour
+    start, end = PREWARM_ACTIVE_HOURS
+    if start <= local_hour < end:
+        return PREWARM_ACTIVE_INTERVAL
+    return PREWARM_IDLE_INTERVAL
+
+def prewarm_caches():
+    """表格改过就刷新所有快照 (对局表只同步末尾)，解析新增对局，同步本地镜像，更新名字缓存"""
+    snaps = sheet_cache.get_snapshots(PREWARM_SHEETS)
+    sync_game_table(snaps)
+    if sheet_cache.degraded_since is not None:
+        return  # 离线时拿到的是旧快照，不用再写回镜像
+    written = mirror.sync(snaps)
+    if written:
+        print(f"💾 本地镜像已同步: {', '.join(written)}")
+    update_player_cache()
+
+async def refresh_after_write():
+    """写入表格后马上预热一次 (SQLite 镜像不用等下一轮)"""
+    try:
+        await repo.run(prewarm_caches, lane=LANE_BACKGROUND)
     except Exception as e:
-        print(f"写入 Google Sheet 失败: {e}")
-        return f"数据库写入失败: {e}"
+        print(f"⚠️ 写入后的预热失败: {e}")
+
+@tasks.loop(seconds=PREWARM_ACTIVE_INTERVAL)
+async def prewarm_loop():
+    try:
+        await repo.run(prewarm_caches, lane=LANE_BACKGROUND)
+    except Exception as e:
+        print(f"⚠️ 后台预热失败: {e}")
+    interval = prewarm_interval()
+    if prewarm_loop.seconds != interval:
+        print(f"🔁 预热间隔调整为 {interval:.0f}s")
+        prewarm_loop.change_interval(seconds=interval)
 
 # --- 9. 启动 ---
+async def load_startup_data():
+    """启动时的读取 (名字缓存、本地 MMR 引擎对照)；冷启动可能超时 / 被限流，失败只打印，不影响其他后台任务"""
+    print("正在加载玩家名单缓存...")
+    for step in (update_player_cache, verify_rating_engine):
+        try:
+            await repo.run(step, lane=LANE_BACKGROUND)
+        except Exception as e:
+            print(f"⚠️ 启动时 {step.__name__} 失败: {e}")
+
 @client.event
 async def on_ready():
     print(f'🤖 登录成功：{client.user}')
-    print("正在加载玩家名单缓存...")
-    update_player_cache()
+    # 先启动写入队列和预热循环：后面的读取再慢、再失败，重启前排队的写入也会接着写
+    writer.start()
+    # on_ready 断线重连后会再次触发，循环只启动一次
+    if not prewarm_loop.is_running():
+        prewarm_loop.start()
+    asyncio.create_task(load_startup_data())
 
 # 最后一行才是 run
 client.run(BOT_TOKEN)
\ No newline at end of file
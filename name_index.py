@@ -0,0 +1,104 @@
+import bisect
+
+from game_store import canonical_name
+
+# 自动补全最多返回的候选数 (Discord 上限 25)
+MAX_CHOICES = 25
+
+
+def edit_distance(a, b, limit):
+    """a 和 b 的编辑距离 (相邻交换算一次)；超过 limit 时提前返回 limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev2, prev = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        cur = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        if min(cur) > limit:
+            return limit + 1
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def _grams(key):
+    """单个字符 + 相邻两个字符，用来找包含 / 相近的名字"""
+    return set(key) | {key[i:i + 2] for i in range(len(key) - 1)}
+
+
+class NameIndex:
+    """
+    玩家名字的自动补全索引 (建好之后只读，更新时整个替换)：
+    - 排好序的小写名字，前缀匹配二分查找
+    - n-gram (1、2 个字符) -> 名字的倒排表，包含匹配和拼写容错只检查有共同 n-gram 的名字
+    排序: 前缀匹配 > 包含 > 拼写相近，同一档里最近对局多的玩家排前面
+    """
+
+    def __init__(self, names, activity=None):
+        self.names = []
+        self.keys = []
+        seen = set()
+        for name in names:
+            key = canonical_name(name)
+            if key and key not in seen:
+                seen.add(key)
+                self.names.append(name.strip())
+                self.keys.append(key)
+        activity = activity or {}
+        self.activity = [activity.get(key, 0) for key in self.keys]
+        self.sorted_keys = sorted((key, i) for i, key in enumerate(self.keys))
+        self.grams = {}
+        for i, key in enumerate(self.keys):
+            for gram in _grams(key):
+                self.grams.setdefault(gram, set()).add(i)
+
+    def __len__(self):
+        return len(self.names)
+
+    def _prefix(self, query):
+        lo = bisect.bisect_left(self.sorted_keys, (query,))
+        hi = bisect.bisect_left(self.sorted_keys, (query + "\U0010ffff",))
+        return [i for _, i in self.sorted_keys[lo:hi]]
+
+    def _containing(self, query):
+        """名字里包含 query 的候选：先用 n-gram 倒排表求交集，再逐个确认"""
+        postings = [self.grams.get(gram, set()) for gram in _grams(query)]
+        if not postings:
+            return set()
+        candidates = set.intersection(*sorted(postings, key=len))
+        return {i for i in candidates if query in self.keys[i]}
+
+    def _similar(self, query, limit):
+        """拼写相近：和整个名字或名字同长度的开头比较编辑距离"""
+        candidates = set()
+        for gram in _grams(query):
+            if len(gram) == 2:
+                candidates |= self.grams.get(gram, set())
+        found = {}
+        for i in candidates:
+            key = self.keys[i]
+            dist = min(edit_distance(query, key, limit), edit_distance(query, key[:len(query)], limit))
+            if dist <= limit:
+                found[i] = dist
+        return found
+
+    def search(self, query, limit=MAX_CHOICES):
+        """返回排好序的名字 (最多 limit 个)；query 为空时按最近活跃度给出"""
+        query = canonical_name(query)
+        if not query:
+            order = sorted(range(len(self.names)), key=lambda i: (-self.activity[i], self.keys[i]))
+            return [self.names[i] for i in order[:limit]]
+
+        ranked = {}  # 名字下标 -> (档位, 编辑距离)
+        for i in self._prefix(query):
+            ranked[i] = (0, -1 if self.keys[i] == query else 0)  # 完全一致的排最前
+        for i in self._containing(query):
+            ranked.setdefault(i, (1, 0))
+        if len(ranked) < limit and len(query) >= 3:
+            for i, dist in self._similar(query, max(1, len(query) // 4)).items():
+                ranked.setdefault(i, (2, dist))
+        order = sorted(ranked, key=lambda i: (ranked[i][0], ranked[i][1], -self.activity[i], self.keys[i]))
+        return [self.names[i] for i in order[:limit]]
@@ -0,0 +1,76 @@
+import os
+import json
+import threading
+
+from game_store import canonical_name
+
+# 别名文件: {"别名": "Ratings 里的注册名", ...}，例如 {"小明": "Xiaoming", "xm": "Xiaoming"}
+PLAYER_ALIASES_FILE = os.getenv("PLAYER_ALIASES_FILE", "player_aliases.json")
+
+
+def load_aliases(path=PLAYER_ALIASES_FILE):
+    """读取别名文件；没有文件就是没有别名"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            aliases = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️ 读取别名文件 {path} 失败: {e}")
+        return {}
+    print(f"✅ 已加载 {len(aliases)} 个玩家别名")
+    return aliases
+
+
+class PlayerRegistry:
+    """
+    玩家名字 -> 整数 ID，所有对局表、查询共用一份。
+    - 同一个人的各种写法 (大小写、前后空格) 和别名都指向同一个 ID
+    - Ratings 里注册过的名字先分配；对局表里出现但没注册的名字也分配 ID (数据不丢)
+    - ID 一经分配不再改变，解析过的对局行里存的 ID 一直有效
+    查询只认完整的名字 / 别名 (不再按子串匹配，"Al" 不会匹配到 "Alice")
+    """
+
+    def __init__(self, aliases=None):
+        self.ids = {}  # canonical 名字 (注册名) -> ID
+        self.keys = []  # ID -> canonical 名字
+        self.names = []  # ID -> 显示用的写法 (Ratings 里的写法优先)
+        self.registered = set()  # 在 Ratings 里注册过的 ID
+        self.aliases = {canonical_name(alias): canonical_name(name) for alias, name in (aliases or {}).items()}
+        self._lock = threading.RLock()
+        self._ratings_rows = None
+
+    def canonical(self, name):
+        """名字 / 别名 -> 注册名的 canonical 写法"""
+        key = canonical_name(name)
+        return self.aliases.get(key, key)
+
+    def intern(self, name, display=None):
+        """名字 -> ID，第一次见到时分配"""
+        key = self.canonical(name)
+        with self._lock:
+            pid = self.ids.get(key)
+            if pid is None:
+                pid = len(self.keys)
+                self.ids[key] = pid
+                self.keys.append(key)
+                self.names.append(display or str(name).strip() or key)
+            return pid
+
+    def resolve(self, name):
+        """名字 / 别名 -> ID，不认识返回 None"""
+        return self.ids.get(self.canonical(name))
+
+    def load_ratings(self, rows):
+        """从 Ratings (A 列名字，第 1 行是表头) 登记注册过的玩家；同一份快照不重复处理"""
+        if rows is self._ratings_rows:
+            return
+        with self._lock:
+            for row in rows[1:]:
+                if not row or not row[0].strip():
+                    continue
+                pid = self.intern(row[0], row[0].strip())
+                if pid not in self.registered:
+                    self.registered.add(pid)
+                    self.names[pid] = row[0].strip()
+            self._ratings_rows = rows
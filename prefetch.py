@@ -0,0 +1,79 @@
+import os
+import time
+import asyncio
+
+# --- 1. 配置 ---
+# 自动补全停顿多久 (秒) 才开始预热；期间继续打字就换成新的目标
+PREFETCH_DELAY = float(os.getenv("PREFETCH_DELAY", "0.5"))
+# 同一个玩家多久 (秒) 内只预热一次
+PREFETCH_COOLDOWN = float(os.getenv("PREFETCH_COOLDOWN", "30"))
+
+
+# --- 2. 推测预热 ---
+class SpeculativePrefetcher:
+    """
+    根据自动补全猜到下一条指令要查谁，提前在后台调用 warm(key) (async) 把数据预热好。
+    为了不让打字把配额刷爆：
+    - 最多一个预热在跑、一个在等待 (停顿 delay 秒才开始)；等待中的被新的目标取消替换
+    - 同一个 key cooldown 秒内只预热一次
+    - can_start() 返回 False (例如配额紧张、有指令在排队) 时放弃这次预热
+    """
+
+    def __init__(self, warm, can_start=None, delay=PREFETCH_DELAY, cooldown=PREFETCH_COOLDOWN):
+        self.warm = warm
+        self.can_start = can_start
+        self.delay = delay
+        self.cooldown = cooldown
+        self._pending = None  # (key, Task)：还在等待，可以取消
+        self._running = None  # (key, Task)：已经开始
+        self._warmed = {}  # key -> 上次开始预热的 time.monotonic() (只留冷却中的)
+        self.stats = {"requested": 0, "started": 0, "cancelled": 0, "skipped": 0, "failed": 0}
+
+    def _cooling(self, key):
+        return time.monotonic() - self._warmed.get(key, float("-inf")) < self.cooldown
+
+    def _mark_warmed(self, key):
+        """记下 key 开始预热的时间，顺便删掉已经过了冷却期的 (字典大小不超过冷却期内预热过的 key 数)"""
+        now = time.monotonic()
+        for old in [k for k, at in self._warmed.items() if now - at >= self.cooldown]:
+            del self._warmed[old]
+        self._warmed[key] = now
+
+    def request(self, key):
+        """自动补全里调用：安排预热 key (不等待)"""
+        self.stats["requested"] += 1
+        if self._cooling(key) or (self._running and self._running[0] == key and not self._running[1].done()):
+            return
+        if self._pending and not self._pending[1].done():
+            if self._pending[0] == key:
+                return
+            self._pending[1].cancel()
+            self.stats["cancelled"] += 1
+        self._pending = (key, asyncio.create_task(self._delayed(key)))
+
+    def cancel(self):
+        """取消还没开始的预热 (已经开始的让它跑完)；指令已经提交时调用，不用再猜"""
+        if self._pending and not self._pending[1].done():
+            self._pending[1].cancel()
+            self.stats["cancelled"] += 1
+        self._pending = None
+
+    async def _delayed(self, key):
+        await asyncio.sleep(self.delay)
+        # 上一个预热还在跑就等它结束 (同时只跑一个)
+        if self._running and not self._running[1].done():
+            await asyncio.shield(self._running[1])
+        if self._cooling(key) or (self.can_start is not None and not self.can_start()):
+            self.stats["skipped"] += 1
+            return
+        task = asyncio.current_task()
+        if self._pending and self._pending[1] is task:
+            self._pending = None
+        self._running = (key, task)
+        self._mark_warmed(key)
+        self.stats["started"] += 1
+        try:
+            await self.warm(key)
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"⚠️ 预热 {key} 失败: {e}")
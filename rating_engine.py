@@ -0,0 +1,226 @@
+import os
+import csv
+import sys
+import json
+
+# 计算参数文件 (JSON，键和 RatingParams 的参数同名)，必须和表格公式里的数值一致，例如
+# {"mmr_uma": [30, 10, -10, -30], "mmr_avg_divisor": 40, "return_points": 30000, "pt_uma": [50, 10, -10, -30]}
+RATING_PARAMS_FILE = os.getenv("RATING_PARAMS_FILE", "rating_params.json")
+
+
+# --- 1. 参数 (默认值只是占位；实际的值从 RATING_PARAMS_FILE 读，改参数可以离线回放看效果) ---
+class RatingParams:
+    def __init__(
+        self,
+        initial_mmr=1500.0,
+        mmr_uma=(30.0, 10.0, -10.0, -30.0),  # MMR 顺位基础分
+        mmr_avg_divisor=40.0,  # (同桌平均 MMR - 自己 MMR) / 40 的修正
+        mmr_games_coef=0.002,  # 场数修正: 1 - 场数 * 0.002
+        mmr_min_coef=0.2,  # 场数修正的下限
+        return_points=30000,  # PT: (分数 - 返点) / 1000
+        pt_uma=(50.0, 10.0, -10.0, -30.0),  # PT 顺位马 (含头名 oka)
+    ):
+        self.initial_mmr = initial_mmr
+        self.mmr_uma = mmr_uma
+        self.mmr_avg_divisor = mmr_avg_divisor
+        self.mmr_games_coef = mmr_games_coef
+        self.mmr_min_coef = mmr_min_coef
+        self.return_points = return_points
+        self.pt_uma = pt_uma
+
+    @classmethod
+    def from_dict(cls, values):
+        """JSON 里的参数 -> RatingParams (列表转成元组)；有不认识的键抛 TypeError"""
+        return cls(**{k: tuple(v) if isinstance(v, list) else v for k, v in values.items()})
+
+
+def load_rating_params(path=RATING_PARAMS_FILE):
+    """读取参数文件；没有文件或文件有问题返回 None (不能确定和表格一致，不用本地引擎预览)"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            params = RatingParams.from_dict(json.load(f))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, TypeError) as e:
+        print(f"⚠️ 读取 MMR 参数文件 {path} 失败: {e}")
+        return None
+    print(f"✅ 已加载 MMR 参数 ({path})")
+    return params
+
+
+def _to_float(value, default=None):
+    try:
+        return float(str(value).strip())
+    except (ValueError, TypeError):
+        return default
+
+
+def split_uma(scores, uma):
+    """按分数给每个座位分配顺位马，同分的几个人平分对应名次的马"""
+    order = sorted(range(4), key=lambda i: -scores[i])
+    result = [0.0] * 4
+    pos = 0
+    while pos < 4:
+        end = pos
+        while end + 1 < 4 and scores[order[end + 1]] == scores[order[pos]]:
+            end += 1
+        share = sum(uma[pos:end + 1]) / (end - pos + 1)
+        for k in range(pos, end + 1):
+            result[order[k]] = share
+        pos = end + 1
+    return result
+
+
+# --- 2. 计算引擎 ---
+class RatingEngine:
+    """
+    按时间顺序回放 Games Riichi 的每一局，得到和表格 I-L (变动) / M-P (绝对值) 相同的结果。
+    玩家用 名字.lower().strip() 区分。
+    """
+
+    def __init__(self, params=None, initial_ratings=None):
+        self.params = params or RatingParams()
+        self.initial_ratings = initial_ratings or {}  # Ratings 表里的初始分
+        self.reset()
+
+    def reset(self):
+        self.ratings = {}
+        self.games = {}
+        self.processed_rows = 0  # 已回放的数据行数 (不含表头)
+
+    def _rating(self, key):
+        if key not in self.ratings:
+            self.ratings[key] = self.initial_ratings.get(key, self.params.initial_mmr)
+        return self.ratings[key]
+
+    def compute_game(self, names, scores):
+        """
+        计算一局的结果但不修改状态
+        返回 {"mmr_delta": [4], "mmr_after": [4], "pt": [4]}
+        """
+        p = self.params
+        keys = [n.lower().strip() for n in names]
+        before = [self._rating(k) for k in keys]
+        table_avg = sum(before) / 4
+
+        mmr_base = split_uma(scores, p.mmr_uma)
+        pt_uma = split_uma(scores, p.pt_uma)
+
+        deltas, after, pts = [], [], []
+        for i, key in enumerate(keys):
+            coef = max(p.mmr_min_coef, 1 - self.games.get(key, 0) * p.mmr_games_coef)
+            delta = (mmr_base[i] + (table_avg - before[i]) / p.mmr_avg_divisor) * coef
+            deltas.append(delta)
+            after.append(before[i] + delta)
+            pts.append((scores[i] - p.return_points) / 1000 + pt_uma[i])
+        return {"mmr_delta": deltas, "mmr_after": after, "pt": pts}
+
+    def apply_game(self, names, scores):
+        result = self.compute_game(names, scores)
+        for i, name in enumerate(names):
+            key = name.lower().strip()
+            self.ratings[key] = result["mmr_after"][i]
+            self.games[key] = self.games.get(key, 0) + 1
+        return result
+
+    def replay(self, riichi_rows):
+        """
+        回放 Games Riichi 的数据行 (get_all_values() 的结果去掉表头)。
+        从上次回放到的位置继续，返回新回放的每一局结果 (无效行为 None)
+        """
+        results = []
+        for row in riichi_rows[self.processed_rows:]:
+            self.processed_rows += 1
+            parsed = parse_game_row(row)
+            if parsed is None:
+                results.append(None)
+                continue
+            results.append(self.apply_game(*parsed))
+        return results
+
+
+def parse_game_row(row):
+    """Games Riichi 一行 -> (4个名字, 4个分数)；空行或分数不完整返回 None"""
+    if len(row) < 8 or not row[0].strip():
+        return None
+    scores = [_to_float(v) for v in row[4:8]]
+    if any(s is None for s in scores):
+        return None
+    return row[0:4], scores
+
+
+def load_initial_ratings(ratings_rows):
+    """Ratings 表 (A 名字, B 初始分) -> {名字: 初始分}"""
+    initial = {}
+    for row in ratings_rows[1:]:
+        if len(row) >= 2 and row[0].strip():
+            value = _to_float(row[1])
+            if value is not None:
+                initial[row[0].lower().strip()] = value
+    return initial
+
+
+# --- 3. 和表格对比验证 ---
+def verify_against_sheet(riichi_rows, pt_rows=None, params=None, initial_ratings=None, tol=0.1, max_examples=5):
+    """
+    用引擎回放整张 Games Riichi，逐格对比 I-L / M-P 列 (以及 Games/pt 的 D/G/J/M 列)。
+    返回 {"checked", "mismatches", "max_error", "examples"}
+    """
+    engine = RatingEngine(params, initial_ratings)
+    report = {"checked": 0, "mismatches": 0, "max_error": 0.0, "examples": []}
+    results = engine.replay(riichi_rows[1:])
+
+    for idx, result in enumerate(results, start=1):
+        if result is None:
+            continue
+        row = riichi_rows[idx]
+        pt_row = pt_rows[idx] if pt_rows and idx < len(pt_rows) else None
+        for i in range(4):
+            pairs = [
+                ("delta", row[8 + i] if len(row) > 8 + i else "", result["mmr_delta"][i]),
+                ("mmr", row[12 + i] if len(row) > 12 + i else "", result["mmr_after"][i]),
+            ]
+            if pt_row is not None:
+                pairs.append(("pt", pt_row[3 + i * 3] if len(pt_row) > 3 + i * 3 else "", result["pt"][i]))
+            for label, sheet_val, local_val in pairs:
+                expected = _to_float(sheet_val)
+                if expected is None:
+                    continue
+                report["checked"] += 1
+                err = abs(expected - local_val)
+                report["max_error"] = max(report["max_error"], err)
+                if err > tol:
+                    report["mismatches"] += 1
+                    if len(report["examples"]) < max_examples:
+                        report["examples"].append(
+                            f"row {idx + 1} {row[i]} {label}: sheet={sheet_val} local={local_val:.2f}"
+                        )
+    return report
+
+
+# --- 4. 离线回放: python rating_engine.py "Games Riichi.csv" ["Games pt.csv"] (参数见 RATING_PARAMS_FILE) ---
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python rating_engine.py <Games Riichi 导出的 CSV> [Games/pt 导出的 CSV]")
+        sys.exit(1)
+
+    with open(sys.argv[1], encoding="utf-8-sig") as f:
+        riichi = list(csv.reader(f))
+    pt = None
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], encoding="utf-8-sig") as f:
+            pt = list(csv.reader(f))
+
+    params = load_rating_params()
+    if params is None:
+        print(f"⚠️ 没有 {RATING_PARAMS_FILE}，使用默认参数")
+    report = verify_against_sheet(riichi, pt, params)
+    print(f"对比 {report['checked']} 格，不一致 {report['mismatches']} 格，最大误差 {report['max_error']:.3f}")
+    for line in report["examples"]:
+        print(f"  ❌ {line}")
+
+    engine = RatingEngine(params)
+    engine.replay(riichi[1:])
+    top = sorted(engine.ratings.items(), key=lambda x: x[1], reverse=True)[:15]
+    for rank, (name, mmr) in enumerate(top, 1):
+        print(f"#{rank} {name}: {mmr:.1f} ({engine.games[name]} 场)")
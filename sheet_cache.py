@@ -0,0 +1,502 @@
+import os
+import time
+import threading
+from concurrent.futures import Future
+from gspread.utils import a1_to_rowcol, absolute_range_name, rowcol_to_a1
+
+# --- 1. 配置 ---
+# 快照有效期 (秒)，可通过环境变量 SHEET_CACHE_TTL 调整
+SHEET_CACHE_TTL = float(os.getenv("SHEET_CACHE_TTL", "60"))
+# 增量同步时重新读取的末尾行数 (新行的公式可能还没算完，需要再读一次)
+TAIL_OVERLAP_ROWS = int(os.getenv("SHEET_TAIL_OVERLAP", "5"))
+# 增量同步看不到中间行的修改，超过这个时间 (秒) 强制完整重读一次
+FULL_RELOAD_INTERVAL = float(os.getenv("SHEET_FULL_RELOAD_INTERVAL", "1800"))
+# 按修改时间判断过期时：两次查询修改时间的最短间隔 (秒)
+REVISION_CHECK_INTERVAL = float(os.getenv("SHEET_REVISION_CHECK_INTERVAL", "5"))
+# 修改时间没变也要重读的上限 (秒)；公式重新计算不会改变修改时间
+REVISION_MAX_AGE = float(os.getenv("SHEET_REVISION_MAX_AGE", "600"))
+# 离线模式下每隔多久 (秒) 再尝试连接一次 Google
+OFFLINE_RETRY_INTERVAL = float(os.getenv("SHEET_OFFLINE_RETRY_INTERVAL", "30"))
+
+# 只会在末尾追加的工作表 -> 用来判断"旧行有没有被改过"的输入列数
+# Games Riichi: A-D 名字 + E-H 分数；Games/pt: A 时间
+APPEND_ONLY_SHEETS = {
+    "Games Riichi": 8,
+    "Games/pt": 1,
+}
+
+# 每张表只下载用到的列 (不在这里的表读整张)。
+# 查询时也可以用 "表名!D:E" 只读某几列，各自有独立的快照
+SHEET_COLUMNS = {
+    "Games Riichi": "A:P",  # 名字、分数、MMR 变动、MMR 绝对值
+    "Games/pt": "A:M",  # 时间 + 4 组 (名字, -, PT)
+    "Ranking": "A:H",  # MMR / PT / 场数 三个榜
+    "Ranking Quarter": "A:H",
+    "Personal Data": "A:O",
+    "Personal Data 2026 Winter": "A:C",
+    "Ratings": "A:B",
+    "Config": "A:B",
+}
+
+
+def split_key(key):
+    """快照名 -> (工作表名, 列范围)；'Ranking!D:E' -> ('Ranking', 'D:E')，不带列范围的用 SHEET_COLUMNS"""
+    name, _, cols = key.partition("!")
+    return name, cols or SHEET_COLUMNS.get(name)
+
+
+def _col_letter(col):
+    """列号 -> 列字母 (16 -> 'P')"""
+    return rowcol_to_a1(1, col)[:-1]
+
+
+def _col_number(letter):
+    """列字母 -> 列号 ('P' -> 16)"""
+    return a1_to_rowcol(f"{letter}1")[1]
+
+
+def _pad(rows, width):
+    """和 get_all_values() 一样，把每行补齐到相同列数"""
+    return [row + [""] * (width - len(row)) if len(row) < width else row for row in rows]
+
+
+class StaleSnapshotError(ConnectionError):
+    """需要最新数据 (例如写入前查重)，但只拿到了旧快照 / 本地镜像"""
+
+
+# --- 2. 单个工作表的快照 ---
+class WorksheetSnapshot:
+    def __init__(self, name, rows, generation=0):
+        self.name = name
+        self.rows = rows  # get_all_values() 的结果 (只读，不要原地修改)
+        self.generation = generation  # 每次完整重读 +1，增量追加不变
+        self.revision = None  # 下载时表格的修改时间
+        self.fetched_at = time.monotonic()
+        self.downloaded_at = self.fetched_at  # 真正下载的时间 (expire() 只改 fetched_at)
+        self.loaded_at = self.fetched_at  # 上一次完整重读的时间
+
+    def age(self):
+        return time.monotonic() - self.fetched_at
+
+    @property
+    def width(self):
+        return max((len(r) for r in self.rows), default=0)
+
+
+# --- 3. 共享的内存快照层 ---
+class SheetCache:
+    """
+    每个工作表一份内存快照，过期 (TTL) 后才重新下载，只下载 SHEET_COLUMNS 里的列。
+    只追加的工作表 (APPEND_ONLY_SHEETS) 过期后只下载新增的末尾行；
+    但修改时间变了、而我们自己没写过 (别人在表格里改的，可能改了前面的行) 时完整重读。
+    写操作之后调用 expire() / invalidate() 或 append_rows() / set_config_value() 保持快照正确。
+    读取失败时返回旧快照 (离线模式)，is_offline() 期间不再请求 Google。
+
+    传入 revision_source (返回表格修改时间的函数，例如 Spreadsheet.get_lastUpdateTime) 时，
+    不再按 TTL 过期：先查一次修改时间 (每 REVISION_CHECK_INTERVAL 秒最多一次)，
+    和快照下载时的修改时间相同就直接用，不同才重新下载。查询失败时退回 TTL。
+    """
+
+    def __init__(self, spreadsheet, ttl=SHEET_CACHE_TTL, revision_source=None, fallback=None):
+        self.spreadsheet = spreadsheet
+        self.ttl = ttl
+        self.revision_source = revision_source
+        self.fallback = fallback  # 名字 -> 本地保存的快照 (或 None)，离线且内存里没有快照时用
+        self.degraded_since = None  # 进入离线模式的时间 (time.monotonic)
+        self._retry_at = 0.0
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._inflight = {}  # 名字 / 读取范围 -> 正在下载的 Future
+        self._revision = None
+        self._revision_checked = float("-inf")
+        self._written_at = float("-inf")  # 上一次我们自己写表格 (expire / append_rows / set_config_value) 的时间
+
+    def current_revision(self):
+        """表格当前的修改时间 (缓存 REVISION_CHECK_INTERVAL 秒)；没有 revision_source 或查询失败返回 None"""
+        if self.revision_source is None or self.is_offline():
+            return None
+        if time.monotonic() - self._revision_checked < REVISION_CHECK_INTERVAL:
+            return self._revision
+        try:
+            revision = self._single_flight(("revision",), self.revision_source)
+        except Exception as e:
+            print(f"⚠️ 查询表格修改时间失败，按 TTL 判断过期: {e}")
+            revision = None
+        self._revision = revision
+        self._revision_checked = time.monotonic()
+        return revision
+
+    def _is_fresh(self, snap, ttl, revision):
+        if snap is None:
+            return False
+        if revision is None:
+            return snap.age() <= ttl
+        return snap.revision == revision and snap.age() <= REVISION_MAX_AGE
+
+    def get_values(self, name, max_age=None):
+        """返回工作表的数据 (list of list)，过期则重新同步；name 可以是 '表名!D:E' 只读几列"""
+        return self.get_snapshot(name, max_age).rows
+
+    def peek_snapshots(self, names):
+        """
+        不下载任何表：返回内存里按当前修改时间 (或 TTL) 仍然有效的快照 {名字: 快照}，
+        过期或还没有的不在结果里。修改时间本身最多每 REVISION_CHECK_INTERVAL 秒查一次
+        """
+        revision = self.current_revision()
+        with self._lock:
+            found = {name: self._snapshots.get(name) for name in names}
+        return {name: snap for name, snap in found.items() if self._is_fresh(snap, self.ttl, revision)}
+
+    def has_snapshot(self, name):
+        """是否已经有这份快照 (不管是否过期)"""
+        return name in self._snapshots
+
+    def get_snapshot(self, name, max_age=None):
+        """同 get_values，但返回 WorksheetSnapshot (可以看 generation 判断是否完整重读过)"""
+        return self.get_snapshots([name], max_age)[name]
+
+    def get_snapshots(self, names, max_age=None):
+        """
+        一次拿到多张表的快照；过期的表合并成一个 values_batch_get 请求 (一次 HTTP)。
+        别的线程正在下载的表不重复下载，等它下载完直接共用结果 (single-flight)。
+        返回 {名字: WorksheetSnapshot}；多张表时读取失败的表不在结果里 (只有一张表时直接抛出异常)
+        """
+        ttl = self.ttl if max_age is None else max_age
+        names = list(dict.fromkeys(names))
+        # 指定了 max_age 就按时间判断；否则先查修改时间 (新下载的快照也记上这个修改时间)
+        revision = self.current_revision() if max_age is None else None
+        result = {}
+        stale = []  # 由本线程下载
+        joined = []  # 等别的线程下载
+        with self._lock:
+            for name in names:
+                snap = self._snapshots.get(name)
+                if self._is_fresh(snap, ttl, revision):
+                    result[name] = snap
+                elif name in self._inflight:
+                    joined.append((name, self._inflight[name]))
+                else:
+                    self._inflight[name] = Future()
+                    stale.append((name, snap))
+
+        if stale:
+            fetched, error = {}, None
+            # 先记下载前的修改时间：下载期间有人修改，下次检查时一定会发现不同
+            fetch_revision = revision if revision is not None else self._revision
+            try:
+                offline = self.is_offline()
+                if offline:
+                    error = ConnectionError("Google Sheets 暂时无法连接")
+                else:
+                    try:
+                        fetched = self._fetch_stale(stale, fetch_revision)
+                    except Exception as e:
+                        error = e
+                    for snap in fetched.values():
+                        snap.revision = fetch_revision
+                self._serve_stale(stale, fetched, error, attempted=not offline)
+                result.update(fetched)
+                if len(names) == 1 and names[0] not in result:
+                    raise error or RuntimeError(f"读取 {names[0]} 失败")
+            finally:
+                # 把结果交给等待同一张表的其他线程
+                with self._lock:
+                    flights = [(name, self._inflight.pop(name)) for name, _ in stale]
+                for name, flight in flights:
+                    if name in fetched:
+                        flight.set_result(fetched[name])
+                    else:
+                        flight.set_exception(error or RuntimeError(f"读取 {name} 失败"))
+
+        for name, flight in joined:
+            try:
+                result[name] = flight.result()
+            except Exception:
+                if len(names) == 1:
+                    raise
+        return result
+
+    # --- 离线 / 降级模式 ---
+    def is_offline(self):
+        """最近一次读取全部失败，且还在 OFFLINE_RETRY_INTERVAL 冷却期内 (不再请求 Google)"""
+        return self.degraded_since is not None and time.monotonic() < self._retry_at
+
+    def _serve_stale(self, stale, fetched, error, attempted=True):
+        """
+        没读到的表退回旧快照 (内存里没有就从 fallback，即本地镜像还原)，直接写进 fetched。
+        这次要读的表全部失败 -> 进入降级模式；全部成功 -> 恢复。
+        attempted=False 表示冷却期内没有真的请求，不推迟下次重试 (否则一直有读取就永远不会重试)
+        """
+        missing = [(name, snap) for name, snap in stale if name not in fetched]
+        if not missing:
+            if self.degraded_since is not None:
+                print(f"✅ Google Sheets 已恢复 (离线 {time.monotonic() - self.degraded_since:.0f}s)")
+                self.degraded_since = None
+            return
+        if attempted and len(missing) == len(stale):
+            if self.degraded_since is None:
+                self.degraded_since = time.monotonic()
+                print(f"⚠️ Google Sheets 读取失败，进入离线模式 (使用本地快照): {error}")
+            self._retry_at = time.monotonic() + OFFLINE_RETRY_INTERVAL
+        for name, snap in missing:
+            if snap is None and self.fallback is not None:
+                snap = self.fallback(name)
+                if snap is not None:
+                    with self._lock:
+                        self._snapshots.setdefault(name, snap)
+            if snap is not None:
+                fetched[name] = snap
+
+    def _single_flight(self, key, fetch):
+        """同一个 key 同时只有一个线程执行 fetch()，其他线程等它的结果"""
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = Future()
+        if not leader:
+            return flight.result()
+        try:
+            value = fetch()
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _fetch_stale(self, stale, revision=None):
+        """下载过期的表 [(名字, 旧快照)]，返回 {名字: 新快照}；revision 是表格当前的修改时间"""
+        result = {}
+        # 每张过期的表需要读的范围：只追加的表读末尾，其他表读整张
+        plans = [(name, snap, self._tail_plan(name, snap, revision)) for name, snap in stale]
+        ranges = [plan[0] if plan else self._range(name) for name, snap, plan in plans]
+        try:
+            resp = self.spreadsheet.values_batch_get(ranges)
+        except Exception as e:
+            if len(stale) == 1:
+                raise
+            # 某个范围无效 (比如工作表不存在) 会让整个批量请求失败，退回逐个读取
+            print(f"⚠️ 批量读取失败，改为逐个读取: {e}")
+            for name, snap in stale:
+                try:
+                    result[name] = self._sync_one(name, snap, revision)
+                except Exception as one_error:
+                    print(f"❌ 读取 {name} 失败: {one_error}")
+            return result
+
+        value_ranges = resp.get("valueRanges", [])
+        for (name, snap, plan), vr in zip(plans, value_ranges):
+            fetched = vr.get("values", [])
+            if not plan:
+                result[name] = self._apply_full(name, snap, fetched)
+                continue
+            # 增量同步发现旧数据被改过，单独完整重读这一张
+            result[name] = self._apply_tail(name, snap, plan, fetched) or self._load(name, snap)
+        return result
+
+    def read_window(self, keys, last_n):
+        """
+        不经过快照，只读几张行号对齐的表最后 last_n 行 (冷启动时只需要最近数据的查询用)。
+        总行数先用第一张表的 A 列数出来 (只有一列，很小)，再把几个窗口合并成一次批量请求。
+        返回 {key: rows}，rows[0] 是空的表头占位，和 get_values() 一样按列位置取值
+        """
+        keys = tuple(keys)
+        return self._single_flight(("window", keys, last_n), lambda: self._read_window(keys, last_n))
+
+    def _read_window(self, keys, last_n):
+        name = split_key(keys[0])[0]
+        total = len(self._fetch_range(absolute_range_name(name, "A:A")))
+        start = max(2, total - last_n + 1)
+        if total < start:
+            return {key: [[]] for key in keys}
+        ranges = [self._range(key, start, total) for key in keys]
+        value_ranges = self.spreadsheet.values_batch_get(ranges).get("valueRanges", [])
+        return {key: [[]] + self._shape(key, vr.get("values", [])) for key, vr in zip(keys, value_ranges)}
+
+    def _range(self, key, start=None, end=None, width=0):
+        """快照名 -> A1 范围；start/end 是 1-based 行号 (end 为空表示读到末尾)"""
+        name, cols = split_key(key)
+        if cols:
+            first, last = cols.split(":")
+        elif width:
+            first, last = "A", _col_letter(width)
+        elif start is not None:
+            return absolute_range_name(name, f"{start}:{end}")  # 整行
+        if start is None:
+            return absolute_range_name(name, cols) if cols else absolute_range_name(name)
+        return absolute_range_name(name, f"{first}{start}:{last}{end or ''}")
+
+    def _shape(self, key, rows, width=0):
+        """
+        把读回来的行整理成 get_all_values() 的样子：
+        列范围不从 A 开始时左边补空列 (列下标和整张表一致)，每行补齐到范围的最后一列
+        """
+        cols = split_key(key)[1]
+        if cols:
+            first, last = cols.split(":")
+            offset = _col_number(first) - 1
+            if offset:
+                rows = [[""] * offset + r for r in rows]
+            width = max(width, _col_number(last))
+        return _pad(rows, max(width, max((len(r) for r in rows), default=0)))
+
+    def _fetch_range(self, rng):
+        """读取一个绝对 A1 范围，不需要先获取 worksheet 元数据"""
+        return self.spreadsheet.values_get(rng).get("values", [])
+
+    def _sync_one(self, key, snap, revision=None):
+        plan = self._tail_plan(key, snap, revision)
+        if plan:
+            tail_snap = self._apply_tail(key, snap, plan, self._fetch_range(plan[0]))
+            if tail_snap is not None:
+                return tail_snap
+        return self._load(key, snap)
+
+    def _load(self, key, old=None):
+        return self._apply_full(key, old, self._fetch_range(self._range(key)))
+
+    def _apply_full(self, key, old, rows):
+        generation = old.generation + 1 if old is not None else 0
+        snap = WorksheetSnapshot(key, self._shape(key, rows), generation)
+        with self._lock:
+            self._snapshots[key] = snap
+        return snap
+
+    def _edited_elsewhere(self, snap, revision):
+        """
+        表格的修改时间和快照下载时不同，而快照是我们上一次写入之后才下载的 -> 改动来自别人。
+        快照在我们写入之前下载的，改动可能就是自己写的那几行，照常增量同步
+        """
+        return (
+            revision is not None
+            and snap.revision is not None
+            and snap.revision != revision
+            and snap.downloaded_at > self._written_at
+        )
+
+    def _tail_plan(self, key, snap, revision=None):
+        """
+        增量同步的计划：从倒数 TAIL_OVERLAP_ROWS 行开始读到末尾。
+        返回 (A1 范围, 起始行号, 列数)；不能增量同步时返回 None (需要完整重读)
+        """
+        if (
+            key not in APPEND_ONLY_SHEETS  # 只对默认列范围的快照做增量
+            or snap is None
+            or len(snap.rows) <= 1
+            or time.monotonic() - snap.loaded_at >= FULL_RELOAD_INTERVAL
+            or self._edited_elsewhere(snap, revision)  # 管理员可能改了前面的行，末尾看不出来
+        ):
+            return None
+        known = len(snap.rows)  # 包含表头
+        start = max(2, known - TAIL_OVERLAP_ROWS + 1)  # 1-based 行号
+        width = max(snap.width, APPEND_ONLY_SHEETS[key])
+        return self._range(key, start, width=width), start, width
+
+    def _apply_tail(self, key, snap, plan, fetched):
+        """
+        重叠部分的输入列和本地一致 -> 只拼接新行；
+        不一致 (旧行被改/删) -> 返回 None，由调用方完整重读
+        """
+        _, start, width = plan
+        overlap_old = snap.rows[start - 1:]
+        if len(fetched) < len(overlap_old):
+            print(f"⚠️ {key} 行数变少了，完整重读")
+            return None
+
+        fetched = self._shape(key, fetched, width)
+        key_cols = APPEND_ONLY_SHEETS[key]
+        for old_row, new_row in zip(overlap_old, fetched):
+            if _pad([old_row[:key_cols]], key_cols) != _pad([new_row[:key_cols]], key_cols):
+                print(f"⚠️ {key} 第 {start} 行之后的旧数据被修改，完整重读")
+                return None
+
+        width = max(width, max((len(r) for r in fetched), default=0))
+        rows = _pad(snap.rows[:start - 1], width) + _pad(fetched, width)
+        new_snap = WorksheetSnapshot(key, rows, snap.generation)
+        new_snap.loaded_at = snap.loaded_at
+        with self._lock:
+            self._snapshots[key] = new_snap
+        return new_snap
+
+    # --- 写入后的处理 ---
+    def _keys_for(self, names):
+        """这些工作表的所有快照 (包括 '表名!D:E' 这种只读部分列的)"""
+        return [key for key in self._snapshots if key in names or split_key(key)[0] in names]
+
+    def _mark_written(self):
+        """我们刚写过表格：接下来修改时间的变化是自己造成的，下次读取时重新查修改时间"""
+        self._written_at = time.monotonic()
+        self._revision_checked = float("-inf")
+
+    def expire(self, *names, written=True):
+        """
+        标记快照过期 (写入后调用)；只追加的表下次只同步末尾，其他表下次完整重读。
+        只是想重新读一次 (不是因为我们写过表格) 时传 written=False
+        """
+        with self._lock:
+            if written:
+                self._mark_written()
+            for key in self._keys_for(names):
+                self._snapshots[key].fetched_at = float("-inf")
+
+    def read_through(self, names):
+        """
+        先标记过期再读取，保证拿到的都是这之后从表格下载的快照 (写入前查重用)。
+        离线 / 读取失败退回了旧快照时抛 StaleSnapshotError，不能把旧数据里没有当成表格里没有
+        """
+        started = time.monotonic()
+        self.expire(*names, written=False)
+        snaps = self.get_snapshots(names)
+        for name in names:
+            snap = snaps.get(name)
+            if snap is None or snap.fetched_at < started:
+                raise StaleSnapshotError(f"没能从表格读到最新的 {name}")
+        return snaps
+
+    def invalidate(self, *names):
+        """丢弃快照，下次读取时重新下载"""
+        with self._lock:
+            for key in self._keys_for(names):
+                self._snapshots.pop(key, None)
+
+    def append_rows(self, name, new_rows):
+        """写入 append_row 之后，直接把新行补到快照末尾 (没有快照就什么都不做)"""
+        with self._lock:
+            self._mark_written()
+            snap = self._snapshots.get(name)
+            if snap is None:
+                return
+            # 复制一份新列表，正在读旧列表的线程不受影响
+            patched = WorksheetSnapshot(name, snap.rows + [[str(v) for v in r] for r in new_rows], snap.generation)
+            patched.fetched_at = snap.fetched_at
+            patched.downloaded_at = snap.downloaded_at
+            patched.loaded_at = snap.loaded_at
+            patched.revision = snap.revision
+            self._snapshots[name] = patched
+
+    def set_config_value(self, key, value, name="Config"):
+        """更新 Config 表某个 key 之后，同步修改快照里的那一行"""
+        with self._lock:
+            self._mark_written()
+            snap = self._snapshots.get(name)
+            if snap is None:
+                return
+            rows = [list(r) for r in snap.rows]
+            for row in rows:
+                if row and row[0] == key:
+                    if len(row) < 2:
+                        row.append("")
+                    row[1] = str(value)
+                    break
+            else:
+                rows.append([key, str(value)])
+            patched = WorksheetSnapshot(name, rows, snap.generation)
+            patched.fetched_at = snap.fetched_at
+            patched.downloaded_at = snap.downloaded_at
+            patched.loaded_at = snap.loaded_at
+            patched.revision = snap.revision
+            self._snapshots[name] = patched
@@ -0,0 +1,172 @@
+import os
+import time
+import threading
+
+import gspread
+from gspread.exceptions import APIError, WorksheetNotFound
+from oauth2client.service_account import ServiceAccountCredentials
+from requests.adapters import HTTPAdapter
+
+from sheet_scheduler import RequestScheduler, ScheduledProxy
+
+# --- 1. 配置 ---
+# 连接池大小 (和 SHEET_IO_WORKERS 一样多的线程可以同时复用连接)
+SHEET_HTTP_POOL = int(os.getenv("SHEET_HTTP_POOL", os.getenv("SHEET_IO_WORKERS", "4")))
+# 连接失败后多久 (秒) 再重试；期间直接抛 SheetOfflineError，不再等超时
+SHEET_RECONNECT_INTERVAL = float(os.getenv("SHEET_RECONNECT_INTERVAL", "30"))
+
+
+class SheetOfflineError(ConnectionError):
+    """连不上 Google Sheets (授权或打开表格失败)"""
+
+
+def _is_gone(error):
+    """请求失败是不是因为工作表不存在了 (被删除 / 改名)"""
+    if isinstance(error, WorksheetNotFound):
+        return True
+    if isinstance(error, APIError):
+        code = getattr(error, "code", None) or getattr(getattr(error, "response", None), "status_code", None)
+        text = str(error)
+        return code == 404 or (code == 400 and "Unable to parse range" in text)
+    return False
+
+
+def _cell(value):
+    """和 append_row 的 RAW 模式一样：数字写成数字，其他写成原样的文字"""
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": "" if value is None else str(value)}}
+
+
+# --- 2. 长期复用的表格连接 ---
+class _LazySpreadsheet:
+    """访问任何属性时才连接表格 (给 ScheduledProxy 包装用)"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client.connect(), name)
+
+
+class SheetClient:
+    """
+    第一次使用时授权一次、打开一次表格，并用一次 fetch_sheet_metadata 拿到所有工作表的句柄。
+    之后的读写都复用同一个 AuthorizedSession (带连接池；token 过期时 google-auth 会自动刷新)，
+    不再每次 gc.open_by_key() + sh.worksheet() 各多一次元数据请求。
+    只有请求报告工作表不存在时才重新获取一次工作表列表。
+    所有请求都经过 scheduler 限速；直接读值用 self.api (Spreadsheet 的限速代理)。
+    连不上时不退出，SHEET_RECONNECT_INTERVAL 秒后再试。
+    """
+
+    def __init__(self, keyfile, scope, sheet_id, pool_size=SHEET_HTTP_POOL, scheduler=None):
+        self.scheduler = scheduler or RequestScheduler()
+        self.keyfile = keyfile
+        self.scope = scope
+        self.sheet_id = sheet_id
+        self.pool_size = pool_size
+        self.gc = None
+        self.spreadsheet = None
+        self.api = ScheduledProxy(_LazySpreadsheet(self), self.scheduler)
+        self.last_error = None
+        self._worksheets = {}
+        self._lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+        self._retry_at = 0.0
+
+    def connect(self):
+        """返回已打开的 Spreadsheet，还没连接就先连接；冷却期内直接抛 SheetOfflineError"""
+        if self.spreadsheet is not None:
+            return self.spreadsheet
+        with self._connect_lock:
+            if self.spreadsheet is None:
+                if time.monotonic() < self._retry_at:
+                    raise SheetOfflineError(f"Google Sheets 暂时无法连接: {self.last_error}")
+                try:
+                    creds = ServiceAccountCredentials.from_json_keyfile_name(self.keyfile, self.scope)
+                    gc = gspread.authorize(creds)
+                    self._mount_pool(gc, self.pool_size)
+                    spreadsheet = self.scheduler.execute(gc.open_by_key, self.sheet_id)
+                    worksheets = {ws.title: ws for ws in self.scheduler.execute(spreadsheet.worksheets)}
+                except Exception as e:
+                    self.last_error = e
+                    self._retry_at = time.monotonic() + SHEET_RECONNECT_INTERVAL
+                    raise SheetOfflineError(f"Google Sheets 无法连接: {e}") from e
+                self.gc = gc
+                with self._lock:
+                    self._worksheets = worksheets
+                self.spreadsheet = spreadsheet
+                print(f"✅ Google Sheet 连接成功，已解析 {len(worksheets)} 个工作表")
+        return self.spreadsheet
+
+    @staticmethod
+    def _mount_pool(gc, pool_size):
+        # gspread 6 的 session 在 http_client 上，旧版本直接在 client 上
+        session = getattr(getattr(gc, "http_client", gc), "session", None)
+        if session is not None:
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+
+    def resolve_all(self):
+        """一次请求获取所有工作表 (名字 -> Worksheet)"""
+        worksheets = {ws.title: ws for ws in self.api.worksheets()}
+        with self._lock:
+            self._worksheets = worksheets
+        print(f"✅ 已解析 {len(worksheets)} 个工作表")
+        return worksheets
+
+    def worksheet(self, name):
+        """取缓存的工作表句柄；没有就重新解析一次，还没有抛 WorksheetNotFound"""
+        ws = self._worksheets.get(name)
+        if ws is None:
+            ws = self.resolve_all().get(name)
+            if ws is None:
+                raise WorksheetNotFound(name)
+        return ws
+
+    def add_worksheet(self, name, rows, cols):
+        ws = self.api.add_worksheet(name, rows=rows, cols=cols)
+        with self._lock:
+            self._worksheets[name] = ws
+        return ws
+
+    def batch_append(self, rows_by_name):
+        """
+        一次 batchUpdate 请求同时往几个工作表末尾追加行 (appendCells)，例如
+        batch_append({"Games/pt": [[time]], "Games Riichi": [names + scores]})。
+        同一个 batchUpdate 里的请求要么全部生效要么全部不生效，不会出现只写了一张表的情况
+        """
+        def build():
+            return {"requests": [
+                {"appendCells": {
+                    "sheetId": self.worksheet(name).id,
+                    "rows": [{"values": [_cell(v) for v in row]} for row in rows],
+                    "fields": "userEnteredValue",
+                }}
+                for name, rows in rows_by_name.items()
+            ]}
+
+        try:
+            return self.api.batch_update(build())
+        except Exception as e:
+            if not _is_gone(e):
+                raise
+            print(f"⚠️ 工作表句柄失效，重新解析: {e}")
+            self.resolve_all()
+            return self.api.batch_update(build())
+
+    def call(self, name, method, *args, **kwargs):
+        """
+        在工作表上调用 gspread 方法，例如 call("Ratings", "append_row", [name, 1500])。
+        工作表被删除 / 改名导致失败时，重新解析一次再试
+        """
+        try:
+            return self.scheduler.execute(getattr(self.worksheet(name), method), *args, **kwargs)
+        except Exception as e:
+            if not _is_gone(e):
+                raise
+            print(f"⚠️ 工作表 {name} 的句柄失效，重新解析: {e}")
+            self.resolve_all()
+            return self.scheduler.execute(getattr(self.worksheet(name), method), *args, **kwargs)
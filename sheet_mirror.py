@@ -0,0 +1,344 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import numpy as np
+from gspread.utils import a1_to_rowcol
+
+from game_store import SCORE_MISSING, canonical_name, compute_placements, parse_game_time, to_epoch
+from sheet_cache import APPEND_ONLY_SHEETS, TAIL_OVERLAP_ROWS, WorksheetSnapshot, split_key
+
+# --- 1. 配置 ---
+# 本地镜像数据库的位置
+SHEET_MIRROR_PATH = os.getenv("SHEET_MIRROR_PATH", "sheet_mirror.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sheet_rows (
+    sheet TEXT NOT NULL,       -- 快照名 ('Games Riichi' / 'Ranking!A:B' ...)
+    row_num INTEGER NOT NULL,  -- 0 = 表头，和 get_values() 的下标一致
+    row_key TEXT,              -- 第一列的 canonical_name，用来按玩家 / key 查找
+    cells TEXT NOT NULL,       -- JSON 数组
+    PRIMARY KEY (sheet, row_num)
+);
+CREATE INDEX IF NOT EXISTS idx_sheet_rows_key ON sheet_rows (sheet, row_key);
+
+CREATE TABLE IF NOT EXISTS sheet_meta (
+    sheet TEXT PRIMARY KEY,
+    generation INTEGER,
+    row_count INTEGER,
+    revision TEXT,
+    synced_at REAL
+);
+
+-- Games Riichi 每个座位一行
+CREATE TABLE IF NOT EXISTS riichi_seats (
+    row_num INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    score INTEGER,       -- 为空 / 无法解析为 NULL
+    mmr_delta REAL,
+    mmr REAL,
+    placement INTEGER,   -- 同分同顺位，分数为空为 0
+    PRIMARY KEY (row_num, seat)
+);
+CREATE INDEX IF NOT EXISTS idx_riichi_seats_player ON riichi_seats (player, row_num);
+
+-- Games/pt 每个座位一行
+CREATE TABLE IF NOT EXISTS pt_seats (
+    row_num INTEGER NOT NULL,
+    seat INTEGER NOT NULL,
+    player TEXT NOT NULL,
+    pt REAL,             -- 空白按 0，非数字为 NULL
+    PRIMARY KEY (row_num, seat)
+);
+CREATE INDEX IF NOT EXISTS idx_pt_seats_player ON pt_seats (player, row_num);
+
+-- Games/pt A 列的时间 (epoch 秒，无法解析为 NULL)
+CREATE TABLE IF NOT EXISTS game_times (
+    row_num INTEGER PRIMARY KEY,
+    played_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_game_times_played_at ON game_times (played_at);
+"""
+
+
+def _number(value):
+    try:
+        return float(str(value).strip())
+    except (ValueError, TypeError):
+        return None
+
+
+def _key_col(key):
+    """快照里 '名字 / key' 所在的列 (列范围不从 A 开始时左边补了空列)"""
+    cols = split_key(key)[1]
+    return a1_to_rowcol(cols.split(":")[0] + "1")[1] - 1 if cols else 0
+
+
+def _placeholders(values):
+    return ",".join("?" * len(values))
+
+
+# --- 2. 本地镜像 ---
+class SheetMirror:
+    """
+    把表格快照同步到本地 SQLite：原始行 (sheet_rows) + 对局表拆成按座位的行 (带玩家 / 时间索引)。
+    只追加的表和 SheetCache 一样只重写末尾几行，其他表整张替换。
+    查询方法都只读本地数据库，Google 不可用时也能回答。
+    """
+
+    def __init__(self, path=SHEET_MIRROR_PATH, canonical=canonical_name):
+        self.path = path
+        self.canonical = canonical  # 座位表里玩家名字的统一写法 (PlayerRegistry.canonical 会把别名换成注册名)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self._synced = {}  # 快照名 -> 最后同步的 WorksheetSnapshot (同一个对象不重复写)
+
+    # --- 同步 ---
+    def sync(self, snapshots):
+        """把 {快照名: WorksheetSnapshot} 写入数据库，返回实际写入的快照名"""
+        written = []
+        with self._lock, self._conn:
+            for key, snap in snapshots.items():
+                if self._synced.get(key) is snap:
+                    continue
+                start = self._sync_start(key, snap)
+                self._write_rows(key, snap.rows, start)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sheet_meta VALUES (?, ?, ?, ?, ?)",
+                    (key, snap.generation, len(snap.rows), snap.revision, time.time()),
+                )
+                self._synced[key] = snap
+                written.append(key)
+        return written
+
+    def _sync_start(self, key, snap):
+        """
+        从哪一行开始重写：只追加的表和本进程上次写入的快照 generation 相同时只重写末尾，否则整张
+        (generation 每次启动从 0 开始，不能和数据库里记的比较)
+        """
+        previous = self._synced.get(key)
+        if key not in APPEND_ONLY_SHEETS or previous is None or previous.generation != snap.generation:
+            return 0
+        return max(0, min(len(previous.rows), len(snap.rows)) - TAIL_OVERLAP_ROWS)
+
+    def _write_rows(self, key, rows, start):
+        key_col = _key_col(key)
+        self._conn.execute("DELETE FROM sheet_rows WHERE sheet = ? AND row_num >= ?", (key, start))
+        self._conn.executemany(
+            "INSERT INTO sheet_rows VALUES (?, ?, ?, ?)",
+            (
+                (key, pos, canonical_name(row[key_col]) if key_col < len(row) else "", json.dumps(row, ensure_ascii=False))
+                for pos, row in enumerate(rows[start:], start)
+            ),
+        )
+        if key == "Games Riichi":
+            self._write_riichi(rows, start)
+        elif key == "Games/pt":
+            self._write_pt(rows, start)
+
+    def _write_riichi(self, rows, start):
+        first = max(start, 1)
+        self._conn.execute("DELETE FROM riichi_seats WHERE row_num >= ?", (first,))
+        body = rows[first:]
+        if not body:
+            return
+        scores = np.full((len(body), 4), SCORE_MISSING, dtype=np.int32)
+        for i, row in enumerate(body):
+            for seat in range(4):
+                value = _number(row[4 + seat]) if len(row) > 4 + seat and row[4 + seat] else None
+                if value is not None:
+                    scores[i, seat] = int(value)
+        places = compute_placements(scores)
+        seats = []
+        for i, row in enumerate(body):
+            for seat in range(4):
+                player = self.canonical(row[seat]) if len(row) > seat else ""
+                if not player:
+                    continue
+                score = int(scores[i, seat]) if scores[i, seat] != SCORE_MISSING else None
+                delta = _number(row[8 + seat]) if len(row) > 8 + seat else None
+                mmr = _number(row[12 + seat]) if len(row) > 12 + seat else None
+                seats.append((first + i, seat, player, score, delta, mmr, int(places[i, seat])))
+        self._conn.executemany("INSERT INTO riichi_seats VALUES (?, ?, ?, ?, ?, ?, ?)", seats)
+
+    def _write_pt(self, rows, start):
+        first = max(start, 1)
+        self._conn.execute("DELETE FROM pt_seats WHERE row_num >= ?", (first,))
+        self._conn.execute("DELETE FROM game_times WHERE row_num >= ?", (first,))
+        seats, times = [], []
+        for pos, row in enumerate(rows[first:], first):
+            for seat in range(4):
+                name_col, pt_col = 1 + seat * 3, 3 + seat * 3
+                player = self.canonical(row[name_col]) if len(row) > name_col else ""
+                if not player:
+                    continue
+                pt = (_number(row[pt_col]) if row[pt_col] else 0.0) if len(row) > pt_col else None
+                seats.append((pos, seat, player, pt))
+            dt = parse_game_time(row[0]) if row else None
+            times.append((pos, to_epoch(dt) if dt else None))
+        self._conn.executemany("INSERT INTO pt_seats VALUES (?, ?, ?, ?)", seats)
+        self._conn.executemany("INSERT INTO game_times VALUES (?, ?)", times)
+
+    # --- 读取原始行 ---
+    def load_snapshot(self, key):
+        """
+        从数据库还原整张快照 (没有镜像过返回 None)；还原出来的快照视为已过期。
+        generation 记为 -1：之后从表格完整重读的快照 (generation 0) 一定被当成更新的
+        """
+        with self._lock:
+            meta = self._conn.execute("SELECT revision FROM sheet_meta WHERE sheet = ?", (key,)).fetchone()
+            if meta is None:
+                return None
+            cells = self._conn.execute(
+                "SELECT cells FROM sheet_rows WHERE sheet = ? ORDER BY row_num", (key,)
+            ).fetchall()
+        snap = WorksheetSnapshot(key, [json.loads(c) for (c,) in cells], -1)
+        snap.revision = meta[0]
+        snap.fetched_at = float("-inf")
+        return snap
+
+    def rows(self, key, row_nums):
+        """{行号: 行} (只取需要的几行)"""
+        if not row_nums:
+            return {}
+        row_nums = list(row_nums)
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT row_num, cells FROM sheet_rows WHERE sheet = ? AND row_num IN ({_placeholders(row_nums)})",
+                [key] + row_nums,
+            ).fetchall()
+        return {pos: json.loads(cells) for pos, cells in found}
+
+    def synced_at(self, key):
+        """这份快照最后一次写进镜像的时间 (没有镜像过返回 None)"""
+        with self._lock:
+            meta = self._conn.execute("SELECT synced_at FROM sheet_meta WHERE sheet = ?", (key,)).fetchone()
+        return meta[0] if meta else None
+
+    def row_count(self, key):
+        with self._lock:
+            meta = self._conn.execute("SELECT row_count FROM sheet_meta WHERE sheet = ?", (key,)).fetchone()
+        return meta[0] if meta else 0
+
+    def find_row(self, key, name, skip=1):
+        """按第一列 (玩家名 / key) 找一行，跳过前 skip 行 (表头)"""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT cells FROM sheet_rows WHERE sheet = ? AND row_key = ? AND row_num >= ? ORDER BY row_num LIMIT 1",
+                (key, canonical_name(name), skip),
+            ).fetchone()
+        return json.loads(found[0]) if found else None
+
+    # --- 对局查询 (走玩家 / 时间索引) ---
+    def players(self):
+        with self._lock:
+            return [p for (p,) in self._conn.execute("SELECT DISTINCT player FROM riichi_seats")]
+
+    def player_rows(self, players, min_row=1, table="riichi_seats"):
+        """这些玩家参与过的行号 (升序、去重)"""
+        players = list(players)
+        if not players:
+            return []
+        with self._lock:
+            found = self._conn.execute(
+                f"SELECT DISTINCT row_num FROM {table} WHERE player IN ({_placeholders(players)}) AND row_num >= ? ORDER BY row_num",
+                players + [min_row],
+            ).fetchall()
+        return [pos for (pos,) in found]
+
+    def shared_rows(self, player_a, player_b):
+        """两名玩家同桌的行号 (升序)"""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT DISTINCT a.row_num FROM riichi_seats a JOIN riichi_seats b ON a.row_num = b.row_num "
+                "WHERE a.player = ? AND b.player = ? ORDER BY a.row_num",
+                (player_a, player_b),
+            ).fetchall()
+        return [pos for (pos,) in found]
+
+    def riichi_seats(self, row_nums):
+        """
+        这些行的座位数据，和 GameTable 的数组形状一致：
+        返回 (players, scores, placements, mmr_delta)，players 为 (N, 4) 的名字 (空座位为 None)
+        """
+        row_nums = list(row_nums)
+        index = {pos: i for i, pos in enumerate(row_nums)}
+        players = np.full((len(row_nums), 4), None, dtype=object)
+        scores = np.full((len(row_nums), 4), SCORE_MISSING, dtype=np.int32)
+        places = np.zeros((len(row_nums), 4), dtype=np.int8)
+        deltas = np.full((len(row_nums), 4), np.nan, dtype=np.float32)
+        if row_nums:
+            with self._lock:
+                found = self._conn.execute(
+                    f"SELECT row_num, seat, player, score, placement, mmr_delta FROM riichi_seats "
+                    f"WHERE row_num IN ({_placeholders(row_nums)})",
+                    row_nums,
+                ).fetchall()
+            for pos, seat, player, score, place, delta in found:
+                i = index[pos]
+                players[i, seat] = player
+                scores[i, seat] = SCORE_MISSING if score is None else score
+                places[i, seat] = place
+                deltas[i, seat] = np.nan if delta is None else delta
+        return players, scores, places, deltas
+
+    def _first_seats(self, sql, player, limit):
+        """按 row_num 倒序，每行只取该玩家的第一个座位，最多 limit 行"""
+        result, seen = [], set()
+        with self._lock:
+            for found in self._conn.execute(sql, (player,)):
+                if found[0] in seen:
+                    continue
+                seen.add(found[0])
+                result.append(found)
+                if len(result) >= limit:
+                    break
+        return result
+
+    def recent_pt(self, player, limit):
+        """该玩家最近 limit 局 (新到旧) 的 PT，PT 不是数字的局跳过"""
+        found = self._first_seats(
+            "SELECT row_num, pt FROM pt_seats WHERE player = ? AND pt IS NOT NULL ORDER BY row_num DESC, seat",
+            player, limit,
+        )
+        return [pt for _, pt in found]
+
+    def recent_riichi(self, player, limit):
+        """该玩家最近 limit 局 (新到旧) 的 [(行号, 座位, MMR 变动, MMR 绝对值, 顺位)]，不是数字的为 None"""
+        return self._first_seats(
+            "SELECT row_num, seat, mmr_delta, mmr, placement FROM riichi_seats WHERE player = ? "
+            "ORDER BY row_num DESC, seat",
+            player, limit,
+        )
+
+    def period_totals(self, start_epoch, end_epoch):
+        """时间在 [start, end) 之间的对局，每名玩家的 {'games', 'pt'} (PT 不是数字按 0 算)"""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT p.player, COUNT(*), TOTAL(p.pt) FROM game_times t "
+                "JOIN pt_seats p ON p.row_num = t.row_num "
+                "WHERE t.played_at >= ? AND t.played_at < ? GROUP BY p.player",
+                (start_epoch, end_epoch),
+            ).fetchall()
+        return {player: {"games": games, "pt": pt} for player, games, pt in found}
+
+    def unparsed_dates(self):
+        """Games/pt 里有对局 (或 A 列有字) 但时间无法解析的行 [(行号, 原始文字), ...]，和 PtBlock.bad_dates 一致"""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT t.row_num, r.cells, EXISTS (SELECT 1 FROM pt_seats p WHERE p.row_num = t.row_num) "
+                "FROM game_times t LEFT JOIN sheet_rows r ON r.sheet = 'Games/pt' AND r.row_num = t.row_num "
+                "WHERE t.played_at IS NULL ORDER BY t.row_num"
+            ).fetchall()
+        result = []
+        for pos, cells, filled in found:
+            row = json.loads(cells) if cells else []
+            raw = row[0] if row else ""
+            if filled or raw.strip():
+                result.append((pos + 1, raw))
+        return result
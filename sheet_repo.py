@@ -0,0 +1,66 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from sheet_scheduler import LANE_BACKGROUND, LANE_INTERACTIVE, RequestScheduler
+
+# --- 1. 配置 ---
+# 同时进行的 Google Sheets 请求上限 (线程数)
+SHEET_IO_WORKERS = int(os.getenv("SHEET_IO_WORKERS", "4"))
+# 单次调用的超时时间 (秒)，包括排队等待线程的时间
+SHEET_IO_TIMEOUT = float(os.getenv("SHEET_IO_TIMEOUT", "30"))
+
+
+class SheetTimeoutError(TimeoutError):
+    """Google Sheets 调用超时"""
+
+
+# --- 2. 异步数据访问层 ---
+class SheetRepository:
+    """
+    把同步的 gspread 调用放到固定大小的线程池里执行，事件循环不会被卡住。
+    用法: result = await repo.run(get_versus_data, "A", "B")
+    后台刷新 (lane=LANE_BACKGROUND) 用单独的一个线程，不占用指令的线程。
+    """
+
+    def __init__(self, max_workers=SHEET_IO_WORKERS, timeout=SHEET_IO_TIMEOUT, scheduler=None):
+        self.timeout = timeout
+        self.scheduler = scheduler or RequestScheduler()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sheets")
+        self._background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheets-bg")
+        self.pending = 0  # 已提交还没跑完的调用数
+
+    async def run(self, func, *args, timeout=None, lane=LANE_INTERACTIVE, **kwargs):
+        """
+        在线程池中执行 func(*args, **kwargs)，里面发出的请求走 lane 通道。
+        超时抛出 SheetTimeoutError (线程里的请求会继续跑完，但结果被丢弃)。
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self._call_in_lane, lane, func, *args, **kwargs)
+        executor = self._background if lane == LANE_BACKGROUND else self._executor
+        limit = self.timeout if timeout is None else timeout
+        self.pending += 1
+        future = loop.run_in_executor(executor, call)
+        future.add_done_callback(self._done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), limit)
+        except asyncio.TimeoutError:
+            raise SheetTimeoutError(f"Google Sheets 请求超时 ({limit:.0f}s)")
+
+    def _call_in_lane(self, lane, func, *args, **kwargs):
+        with self.scheduler.lane(lane):
+            return func(*args, **kwargs)
+
+    def _done(self, future):
+        self.pending -= 1
+
+    def metrics(self):
+        """调度器的统计 + 线程池里排队 / 正在跑的调用数"""
+        result = self.scheduler.metrics()
+        result["pending_calls"] = self.pending
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._background.shutdown(wait=False, cancel_futures=True)
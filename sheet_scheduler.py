@@ -0,0 +1,174 @@
+import os
+import time
+import heapq
+import random
+import itertools
+import threading
+import functools
+from contextlib import contextmanager
+
+# --- 1. 配置 ---
+# Google Sheets 读请求配额 (每分钟)，默认按单个服务账号 60 次/分钟
+SHEET_QUOTA_PER_MIN = float(os.getenv("SHEET_QUOTA_PER_MIN", "60"))
+# 令牌桶容量 (允许的瞬间突发请求数)
+SHEET_QUOTA_BURST = float(os.getenv("SHEET_QUOTA_BURST", "10"))
+# 429 / 5xx 最多重试次数，以及指数退避的起始 / 最大等待 (秒)
+SHEET_MAX_RETRIES = int(os.getenv("SHEET_MAX_RETRIES", "4"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 32.0
+
+# 优先级通道 (数字越小越先拿到令牌)
+LANE_WRITE = 0  # record_game / register 等写入
+LANE_INTERACTIVE = 1  # 用户指令触发的读取
+LANE_BACKGROUND = 2  # 后台刷新缓存
+LANE_NAMES = {LANE_WRITE: "write", LANE_INTERACTIVE: "interactive", LANE_BACKGROUND: "background"}
+
+
+class SheetQuotaError(RuntimeError):
+    """重试多次后仍然被限流 / 服务端出错"""
+
+
+def status_code(error):
+    """gspread APIError -> HTTP 状态码 (其他异常返回 None)"""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+# --- 2. 调度器 ---
+class RequestScheduler:
+    """
+    所有 Google Sheets HTTP 请求都经过 execute()：
+    - 令牌桶按配额限速，桶空了就排队等，不会再撞上 429
+    - 排队时按通道优先 (写入 > 指令读取 > 后台刷新)，同一通道先来先得
+    - 429 / 5xx 指数退避重试；写入只重试 429 (5xx 时可能已经写进去了)
+    当前线程的通道用 with scheduler.lane(LANE_WRITE): 设置，默认 LANE_INTERACTIVE
+    """
+
+    def __init__(self, per_minute=SHEET_QUOTA_PER_MIN, burst=SHEET_QUOTA_BURST, max_retries=SHEET_MAX_RETRIES):
+        self.rate = per_minute / 60.0
+        self.capacity = burst
+        self.max_retries = max_retries
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = []  # (通道, 序号) 的最小堆，堆顶的请求下一个拿令牌
+        self._seq = itertools.count()
+        self._local = threading.local()
+        self._stats = {
+            lane: {"requests": 0, "wait_total": 0.0, "wait_max": 0.0, "retries": 0, "failures": 0}
+            for lane in LANE_NAMES
+        }
+
+    @contextmanager
+    def lane(self, lane):
+        """在这个 with 块里 (当前线程) 发出的请求走指定通道"""
+        previous = getattr(self._local, "lane", LANE_INTERACTIVE)
+        self._local.lane = lane
+        try:
+            yield
+        finally:
+            self._local.lane = previous
+
+    def current_lane(self):
+        return getattr(self._local, "lane", LANE_INTERACTIVE)
+
+    # --- 令牌桶 ---
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _acquire(self, lane):
+        """排队直到轮到自己且桶里有令牌，返回等待的秒数"""
+        ticket = (lane, next(self._seq))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    self._refill()
+                    if self._waiting[0] == ticket and self._tokens >= 1:
+                        self._tokens -= 1
+                        break
+                    # 还差多少令牌就等多久；不是堆顶则等前面的人拿完后被唤醒
+                    self._cond.wait(max((1 - self._tokens) / self.rate, 0.05))
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+        return time.monotonic() - start
+
+    def _throttled(self):
+        """收到 429：清空令牌桶，其他排队的请求也一起放慢"""
+        with self._cond:
+            self._refill()
+            self._tokens = min(self._tokens, 0.0)
+
+    # --- 执行请求 ---
+    def execute(self, func, *args, **kwargs):
+        """按当前线程的通道排队、限速后执行 func (一次 HTTP 请求)，429 / 5xx 自动退避重试"""
+        lane = self.current_lane()
+        stats = self._stats[lane]
+        delay = BACKOFF_BASE
+        for attempt in range(self.max_retries + 1):
+            waited = self._acquire(lane)
+            with self._cond:
+                stats["requests"] += 1
+                stats["wait_total"] += waited
+                stats["wait_max"] = max(stats["wait_max"], waited)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                code = status_code(e)
+                retryable = code == 429 or (code is not None and code >= 500 and lane != LANE_WRITE)
+                if not retryable:
+                    raise
+                if attempt == self.max_retries:
+                    with self._cond:
+                        stats["failures"] += 1
+                    raise SheetQuotaError(f"Google Sheets 繁忙 (HTTP {code})，重试 {attempt} 次后放弃") from e
+                with self._cond:
+                    stats["retries"] += 1
+                if code == 429:
+                    self._throttled()
+                wait = min(delay, BACKOFF_MAX) * random.uniform(0.5, 1.5)
+                print(f"⚠️ Google Sheets 返回 {code}，{wait:.1f}s 后重试 ({attempt + 1}/{self.max_retries})")
+                time.sleep(wait)
+                delay *= 2
+
+    def metrics(self):
+        """各通道的排队数和等待时间 (秒)"""
+        with self._cond:
+            self._refill()
+            depth = {lane: 0 for lane in LANE_NAMES}
+            for lane, _ in self._waiting:
+                depth[lane] += 1
+            lanes = {}
+            for lane, name in LANE_NAMES.items():
+                s = self._stats[lane]
+                lanes[name] = {
+                    "queued": depth[lane],
+                    "requests": s["requests"],
+                    "avg_wait": s["wait_total"] / s["requests"] if s["requests"] else 0.0,
+                    "max_wait": s["wait_max"],
+                    "retries": s["retries"],
+                    "failures": s["failures"],
+                }
+            return {"tokens": self._tokens, "capacity": self.capacity, "lanes": lanes}
+
+
+class ScheduledProxy:
+    """包装 Spreadsheet / Worksheet：调用它的方法 (一次 HTTP 请求) 都交给调度器排队执行"""
+
+    def __init__(self, target, scheduler):
+        self._target = target
+        self._scheduler = scheduler
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        return functools.partial(self._scheduler.execute, attr)
@@ -0,0 +1,148 @@
+import gc
+import weakref
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+pytest.importorskip("gspread.utils")
+
+from game_store import DAY, SCORE_MISSING, GameTable, compute_placements, to_epoch
+from player_registry import PlayerRegistry
+from sheet_cache import WorksheetSnapshot
+
+RIICHI_HEADER = ["P1", "P2", "P3", "P4", "S1", "S2", "S3", "S4", "D1", "D2", "D3", "D4", "M1", "M2", "M3", "M4"]
+PT_HEADER = ["Time"] + [""] * 12
+
+
+def riichi_row(names, scores, mmr=("", "", "", "")):
+    return list(names) + [str(s) for s in scores] + ["", "", "", ""] + list(mmr)
+
+
+def pt_row(time_str, names, pts=(10, -10, 5, -5)):
+    row = [time_str]
+    for name, pt in zip(names, pts):
+        row += [name, "", str(pt)]
+    return row
+
+
+def epoch(text):
+    return to_epoch(datetime.strptime(text, "%Y-%m-%d %H:%M:%S"))
+
+
+# --- 顺位 ---
+def test_placements_share_rank_on_ties():
+    scores = np.array([
+        [40000, 30000, 30000, 0],
+        [25000, 25000, 25000, 25000],
+        [SCORE_MISSING, 30000, 20000, 10000],
+    ], dtype=np.int32)
+    assert compute_placements(scores).tolist() == [
+        [1, 2, 2, 4],
+        [1, 1, 1, 1],
+        [0, 1, 2, 3],
+    ]
+
+
+# --- 增量同步 ---
+def test_sync_reparses_tail_rows():
+    table = GameTable(PlayerRegistry())
+    rows = [RIICHI_HEADER] + [riichi_row("abcd", (40000, 30000, 20000, 10000), ("1", "2", "3", "4"))] * 8
+    rows.append(riichi_row("abce", (10000, 20000, 30000, 40000)))  # 公式还没算完
+    table.sync(WorksheetSnapshot("Games Riichi", rows))
+    e = table.resolve("e").pop()
+    assert np.isnan(table.riichi.mmr[9]).all()
+
+    # 同一个 generation：最后一行的公式算完、名字改了，又追加了一行
+    rows = rows[:9] + [
+        riichi_row("abcf", (10000, 20000, 30000, 40000), ("5", "6", "7", "8")),
+        riichi_row("abcd", (30000, 30000, 20000, 20000)),
+    ]
+    table.sync(WorksheetSnapshot("Games Riichi", rows))
+    f = table.resolve("f").pop()
+    a = table.resolve("a").pop()
+    assert table.riichi.mmr[9].tolist() == [5, 6, 7, 8]
+    assert table.riichi.by_player[e] == []
+    assert table.riichi.by_player[f] == [9]
+    assert table.riichi.by_player[a] == list(range(1, 11))
+    assert table.riichi.placements[10].tolist() == [1, 1, 3, 3]
+    assert table.riichi.filled_rows == list(range(1, 11))
+
+
+def test_sync_rebuilds_on_new_generation():
+    table = GameTable(PlayerRegistry())
+    rows = [RIICHI_HEADER] + [riichi_row("abcd", (40000, 30000, 20000, 10000))] * 12
+    table.sync(WorksheetSnapshot("Games Riichi", rows, generation=0))
+
+    # 完整重读后前面的行变了 (增量只会重新解析末尾几行)
+    rows = [RIICHI_HEADER, riichi_row("wxyz", (40000, 30000, 20000, 10000))] + rows[2:]
+    table.sync(WorksheetSnapshot("Games Riichi", rows, generation=1))
+    a = table.resolve("a").pop()
+    w = table.resolve("w").pop()
+    assert table.riichi.by_player[a] == list(range(2, 13))
+    assert table.riichi.by_player[w] == [1]
+
+
+# --- 按天汇总 ---
+@pytest.fixture
+def pt_table():
+    table = GameTable(PlayerRegistry())
+    rows = [
+        PT_HEADER,
+        pt_row("2026-01-04 23:59:59", "abcd"),
+        pt_row("2026-01-05 00:00:00", "abcd"),
+        pt_row("2026-01-05 23:59:59", "abcd", (20, -20, 0, 0)),
+        pt_row("2026-01-06 00:00:00", "abcd"),
+        pt_row("2026-01-07 12:00:00", "abce", (30, -10, -10, -10)),
+    ]
+    table.sync(pt_snapshot=WorksheetSnapshot("Games/pt", rows))
+    return table
+
+
+def totals_by_name(table, start, end):
+    keys = table.player_keys
+    return {keys[pid]: (games, pt) for pid, (games, pt) in table.pt.period_totals(start, end).items()}
+
+
+def test_period_totals_whole_day_is_half_open(pt_table):
+    day = epoch("2026-01-05 00:00:00")
+    assert day % DAY == 0
+    assert totals_by_name(pt_table, day, day + DAY)["a"] == (2, 30.0)
+    assert totals_by_name(pt_table, day - 1, day + DAY + 1)["a"] == (4, 50.0)
+    assert totals_by_name(pt_table, day + 1, day + DAY - 1) == {}
+
+
+def test_period_totals_partial_days_match_rows(pt_table):
+    start = epoch("2026-01-04 12:00:00")
+    end = epoch("2026-01-07 12:00:00")
+    totals = totals_by_name(pt_table, start, end)
+    assert totals["a"] == (4, 50.0)
+    assert "e" not in totals
+    totals = totals_by_name(pt_table, start, end + 1)
+    assert totals["a"] == (5, 80.0)
+    assert totals["e"] == (1, -10.0)
+
+
+def test_period_totals_follow_tail_rewrite(pt_table):
+    rows = list(pt_table.pt.rows)
+    rows[-1] = pt_row("2026-01-05 12:00:00", "abce", (30, -10, -10, -10))  # 最后一行的时间被改了
+    pt_table.sync(pt_snapshot=WorksheetSnapshot("Games/pt", rows))
+    day = epoch("2026-01-05 00:00:00")
+    assert totals_by_name(pt_table, day, day + DAY)["a"] == (3, 60.0)
+    assert totals_by_name(pt_table, day + DAY, day + 3 * DAY)["a"] == (1, 10.0)
+
+
+def test_blocks_share_snapshot_rows_and_release_old_ones():
+    table = GameTable(PlayerRegistry())
+    rows = [RIICHI_HEADER] + [riichi_row("abcd", (40000, 30000, 20000, 10000))] * 3
+    old = WorksheetSnapshot("Games Riichi", rows)
+    table.sync(old)
+    assert table.riichi.rows is old.rows  # 显示用的原始行不另存一份
+
+    released = weakref.ref(old)
+    new = WorksheetSnapshot("Games Riichi", rows + [riichi_row("abce", (10000, 20000, 30000, 40000))])
+    table.sync(new)
+    del old
+    gc.collect()
+    assert released() is None
+    assert table.riichi.rows is new.rows
@@ -0,0 +1,36 @@
+import asyncio
+
+import prefetch
+from prefetch import SpeculativePrefetcher
+
+
+def test_warmed_keys_are_pruned_after_cooldown(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(prefetch.time, "monotonic", lambda: now[0])
+    prefetcher = SpeculativePrefetcher(None, cooldown=30)
+    for i in range(100):
+        prefetcher._mark_warmed(i)
+        now[0] += 1
+    assert len(prefetcher._warmed) == 30
+    assert prefetcher._cooling(99) and not prefetcher._cooling(0)
+
+
+def test_cancel_drops_pending_warm():
+    warmed = []
+
+    async def warm(key):
+        warmed.append(key)
+
+    async def main():
+        prefetcher = SpeculativePrefetcher(warm, delay=0.01, cooldown=30)
+        prefetcher.request("alice")
+        prefetcher.cancel()
+        await asyncio.sleep(0.05)
+        prefetcher.request("bob")
+        await asyncio.sleep(0.05)
+        return prefetcher
+
+    prefetcher = asyncio.run(main())
+    assert warmed == ["bob"]
+    assert prefetcher.stats["cancelled"] == 1
+    assert list(prefetcher._warmed) == ["bob"]
@@ -0,0 +1,60 @@
+import json
+
+from rating_engine import RatingEngine, RatingParams, load_rating_params, verify_against_sheet
+
+PARAMS = {
+    "initial_mmr": 1500,
+    "mmr_uma": [30, 10, -10, -30],
+    "mmr_avg_divisor": 40,
+    "mmr_games_coef": 0.1,
+    "mmr_min_coef": 0.5,
+    "return_points": 30000,
+    "pt_uma": [50, 10, -10, -30],
+}
+
+# 按上面的参数手算的两局：第二局 A、B 同分平分 2、3 位的马，E 是第一次打
+RIICHI_ROWS = [
+    ["P1", "P2", "P3", "P4", "S1", "S2", "S3", "S4", "D1", "D2", "D3", "D4", "M1", "M2", "M3", "M4"],
+    ["A", "B", "C", "D", "40000", "30000", "20000", "10000",
+     "30", "10", "-10", "-30", "1530", "1510", "1490", "1470"],
+    ["A", "B", "C", "E", "25000", "25000", "30000", "20000",
+     "-0.50625", "-0.05625", "27.39375", "-29.8125", "1529.49375", "1509.94375", "1517.39375", "1470.1875"],
+]
+PT_ROWS = [
+    ["Time"] + [""] * 12,
+    ["2026-01-05 19:00:00", "A", "", "60", "B", "", "10", "C", "", "-20", "D", "", "-50"],
+    ["2026-01-05 20:00:00", "A", "", "-5", "B", "", "-5", "C", "", "50", "E", "", "-40"],
+]
+
+
+def test_params_file_reproduces_sheet(tmp_path):
+    path = tmp_path / "rating_params.json"
+    path.write_text(json.dumps(PARAMS), encoding="utf-8")
+    params = load_rating_params(str(path))
+    assert params.mmr_uma == (30, 10, -10, -30)
+
+    report = verify_against_sheet(RIICHI_ROWS, PT_ROWS, params)
+    assert report["checked"] == 24
+    assert report["mismatches"] == 0
+
+
+def test_wrong_params_are_reported():
+    params = RatingParams.from_dict(dict(PARAMS, mmr_games_coef=0.002))
+    report = verify_against_sheet(RIICHI_ROWS, PT_ROWS, params)
+    assert report["mismatches"] > 0
+
+
+def test_missing_or_invalid_params_file(tmp_path):
+    assert load_rating_params(str(tmp_path / "missing.json")) is None
+    path = tmp_path / "bad.json"
+    path.write_text(json.dumps({"mmr_uma": [30, 10, -10, -30], "unknown": 1}), encoding="utf-8")
+    assert load_rating_params(str(path)) is None
+
+
+def test_replay_is_incremental():
+    engine = RatingEngine(RatingParams.from_dict(PARAMS))
+    engine.replay(RIICHI_ROWS[1:2])
+    results = engine.replay(RIICHI_ROWS[1:])
+    assert len(results) == 1
+    assert engine.ratings["e"] == 1470.1875
+    assert engine.games == {"a": 2, "b": 2, "c": 2, "d": 1, "e": 1}
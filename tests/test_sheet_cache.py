@@ -0,0 +1,155 @@
+import re
+
+import pytest
+
+pytest.importorskip("gspread.utils")
+
+from sheet_cache import SheetCache, StaleSnapshotError, WorksheetSnapshot
+from sheet_mirror import SheetMirror
+from sheet_scheduler import RequestScheduler, ScheduledProxy
+
+
+class OfflineSpreadsheet:
+    """和连不上时的 _LazySpreadsheet 一样：访问任何属性都抛异常 (冷却期内的 SheetOfflineError)"""
+
+    def __init__(self):
+        self.attempts = 0
+
+    def __getattr__(self, name):
+        self.attempts += 1
+        raise ConnectionError("Google Sheets 暂时无法连接")
+
+
+class FakeSpreadsheet:
+    """按 A1 范围返回内存里的表格数据；online=False 时请求都抛 ConnectionError"""
+
+    RANGE = re.compile(r"'(.+?)'(?:!([A-Z]*)(\d*):([A-Z]*)(\d*))?$")
+
+    def __init__(self, sheets):
+        self.sheets = sheets
+        self.online = True
+        self.revision = "r1"
+        self.requests = []
+
+    def _values(self, rng):
+        name, first, start, last, end = self.RANGE.match(rng).groups()
+        rows = self.sheets[name][int(start or 1) - 1:int(end) if end else None]
+        col = lambda letter, default: ord(letter) - 64 if letter else default
+        return [row[col(first, 1) - 1:col(last, 1000)] for row in rows]
+
+    def values_batch_get(self, ranges, params=None):
+        if not self.online:
+            raise ConnectionError("offline")
+        self.requests.append(list(ranges))
+        return {"valueRanges": [{"values": self._values(rng)} for rng in ranges]}
+
+    def values_get(self, rng, params=None):
+        return self.values_batch_get([rng])["valueRanges"][0]
+
+    def get_lastUpdateTime(self):
+        if not self.online:
+            raise ConnectionError("offline")
+        return self.revision
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    mirror = SheetMirror(str(tmp_path / "mirror.db"))
+    mirror.sync({"Ratings": WorksheetSnapshot("Ratings", [["Name", "MMR"], ["Alice", "1520"]])})
+    return mirror
+
+
+def test_offline_startup_serves_mirror(mirror):
+    target = OfflineSpreadsheet()
+    api = ScheduledProxy(target, RequestScheduler())
+    # 直接传 api.get_lastUpdateTime 在构造时就会连接表格
+    with pytest.raises(ConnectionError):
+        api.get_lastUpdateTime
+    cache = SheetCache(api, revision_source=lambda: api.get_lastUpdateTime(), fallback=mirror.load_snapshot)
+    assert target.attempts == 1
+
+    assert cache.get_values("Ratings") == [["Name", "MMR"], ["Alice", "1520"]]
+    assert cache.is_offline()
+
+
+def test_offline_reads_do_not_postpone_retry(mirror, monkeypatch):
+    target = OfflineSpreadsheet()
+    cache = SheetCache(ScheduledProxy(target, RequestScheduler()), fallback=mirror.load_snapshot)
+    cache.get_values("Ratings")
+    retry_at = cache._retry_at
+    attempts = target.attempts
+
+    # 冷却期内的读取直接用本地快照，不请求也不推迟重试时间
+    for _ in range(3):
+        cache.expire("Ratings")
+        cache.get_values("Ratings")
+    assert cache._retry_at == retry_at
+    assert target.attempts == attempts
+
+    # 冷却期过了，下一次读取真的去请求
+    monkeypatch.setattr(cache, "_retry_at", 0.0)
+    cache.expire("Ratings")
+    cache.get_values("Ratings")
+    assert target.attempts == attempts + 1
+
+
+def test_read_through_refuses_stale_snapshot():
+    sheet = FakeSpreadsheet({"Ratings": [["Name", "MMR"], ["Alice", "1520"]]})
+    cache = SheetCache(sheet)
+    assert cache.read_through(["Ratings"])["Ratings"].rows[1] == ["Alice", "1520"]
+
+    # 查重时表格读不到：不能拿旧快照当结果
+    sheet.online = False
+    sheet.sheets["Ratings"].append(["Bob", "1500"])
+    with pytest.raises(StaleSnapshotError):
+        cache.read_through(["Ratings"])
+    assert cache.get_values("Ratings") == [["Name", "MMR"], ["Alice", "1520"]]
+
+
+def game_rows(n):
+    header = ["P1", "P2", "P3", "P4", "S1", "S2", "S3", "S4"]
+    return [header] + [["a", "b", "c", "d", "40000", "30000", "20000", "10000"] for _ in range(n)]
+
+
+def test_own_write_only_syncs_tail():
+    sheet = FakeSpreadsheet({"Games Riichi": game_rows(20)})
+    cache = SheetCache(sheet, revision_source=sheet.get_lastUpdateTime)
+    cache.get_snapshot("Games Riichi")
+
+    sheet.sheets["Games Riichi"].append(["e", "f", "g", "h", "25000", "25000", "25000", "25000"])
+    sheet.revision = "r2"
+    cache.expire("Games Riichi")
+    snap = cache.get_snapshot("Games Riichi")
+    assert len(snap.rows) == 22
+    assert snap.generation == 0
+    assert sheet.requests[-1] == ["'Games Riichi'!A17:P"]
+
+
+def test_foreign_edit_forces_full_reload():
+    sheet = FakeSpreadsheet({"Games Riichi": game_rows(20)})
+    cache = SheetCache(sheet, revision_source=sheet.get_lastUpdateTime)
+    cache.get_snapshot("Games Riichi")
+
+    # 管理员改了前面的行 (不在末尾重叠的几行里)
+    sheet.sheets["Games Riichi"][2][4] = "41000"
+    sheet.revision = "r2"
+    cache._revision_checked = float("-inf")
+    snap = cache.get_snapshot("Games Riichi")
+    assert snap.rows[2][4] == "41000"
+    assert snap.generation == 1
+
+
+def test_peek_snapshots_never_downloads():
+    sheet = FakeSpreadsheet({"Ratings": [["Name", "MMR"], ["Alice", "1520"]]})
+    cache = SheetCache(sheet, revision_source=sheet.get_lastUpdateTime)
+    assert cache.peek_snapshots(["Ratings"]) == {}
+    assert sheet.requests == []
+
+    snap = cache.get_snapshot("Ratings")
+    assert cache.peek_snapshots(["Ratings"]) == {"Ratings": snap}
+
+    # 表格改过：快照不再有效，但 peek 不会去下载
+    sheet.revision = "r2"
+    cache._revision_checked = float("-inf")
+    assert cache.peek_snapshots(["Ratings"]) == {}
+    assert len(sheet.requests) == 1
@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("gspread")
+pytest.importorskip("oauth2client")
+pytest.importorskip("requests")
+
+from sheet_client import SheetClient, _cell
+
+
+class FakeWorksheet:
+    def __init__(self, sheet_id):
+        self.id = sheet_id
+
+
+class FakeApi:
+    def __init__(self):
+        self.bodies = []
+
+    def batch_update(self, body):
+        self.bodies.append(body)
+        return {"replies": []}
+
+
+def test_cell_keeps_numbers_as_numbers():
+    assert _cell(25000) == {"userEnteredValue": {"numberValue": 25000}}
+    assert _cell(-1.5) == {"userEnteredValue": {"numberValue": -1.5}}
+    assert _cell(True) == {"userEnteredValue": {"boolValue": True}}
+    # 文字原样写入，即使看起来像数字 (不会被表格再解析)
+    assert _cell("25000") == {"userEnteredValue": {"stringValue": "25000"}}
+    assert _cell("2026-01-05 19:00:00") == {"userEnteredValue": {"stringValue": "2026-01-05 19:00:00"}}
+    assert _cell(None) == {"userEnteredValue": {"stringValue": ""}}
+
+
+def test_batch_append_is_one_request_per_call():
+    client = SheetClient("missing.json", [], "sheet-id")
+    client._worksheets = {"Games/pt": FakeWorksheet(1), "Games Riichi": FakeWorksheet(2)}
+    client.api = FakeApi()
+    client.batch_append({
+        "Games/pt": [["2026-01-05 19:00:00"]],
+        "Games Riichi": [["A", "B", "C", "D", 25000, 35000, 30000, 10000]],
+    })
+    assert len(client.api.bodies) == 1
+    requests = client.api.bodies[0]["requests"]
+    assert [r["appendCells"]["sheetId"] for r in requests] == [1, 2]
+    values = requests[1]["appendCells"]["rows"][0]["values"]
+    assert values[0] == {"userEnteredValue": {"stringValue": "A"}}
+    assert values[4] == {"userEnteredValue": {"numberValue": 25000}}
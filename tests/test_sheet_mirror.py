@@ -0,0 +1,73 @@
+import pytest
+
+pytest.importorskip("gspread.utils")
+
+from leaderboard import MirrorLeaderboardCache
+from sheet_cache import WorksheetSnapshot
+from sheet_mirror import SheetMirror
+
+
+def pt_row(time_str, *players):
+    row = [time_str]
+    for name in players:
+        row += [name, "", "10"]
+    return row + [""] * (13 - len(row))
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    return SheetMirror(str(tmp_path / "mirror.db"))
+
+
+def test_unparsed_dates_match_rows_with_players(mirror):
+    rows = [
+        ["Time"] + [""] * 12,
+        pt_row("2026-01-05 19:00:00", "a", "b", "c", "d"),
+        pt_row("1/5 晚上", "a", "b", "c", "d"),
+        pt_row("", "a", "b", "c", "d"),
+        pt_row("", ),
+        pt_row("???"),
+    ]
+    mirror.sync({"Games/pt": WorksheetSnapshot("Games/pt", rows)})
+    assert mirror.unparsed_dates() == [(3, "1/5 晚上"), (4, ""), (6, "???")]
+
+
+def test_mirror_leaderboard_rebuilds_after_sync(mirror):
+    key = "Ranking!A:B"
+    mirror.sync({key: WorksheetSnapshot(key, [["Name", "MMR"], ["Alice", "1520"], ["Bob", "1610"]])})
+    boards = MirrorLeaderboardCache(mirror)
+    board = boards.get("total_mmr")
+    assert board.lookup("alice") == (2, 1520.0)
+    assert boards.get("total_mmr") is board
+
+    mirror.sync({key: WorksheetSnapshot(key, [["Name", "MMR"], ["Alice", "1700"], ["Bob", "1610"]])})
+    assert boards.get("total_mmr").lookup("Alice") == (1, 1700.0)
+
+
+def riichi_row(players, scores, deltas, mmrs):
+    return list(players) + list(scores) + list(deltas) + list(mmrs)
+
+
+def test_recent_history_newest_first(mirror):
+    riichi = [
+        ["A"] * 16,
+        riichi_row("abcd", ["40000", "30000", "20000", "10000"], ["15", "5", "-5", "-15"], ["1515", "1505", "1495", "1485"]),
+        riichi_row("bcda", ["40000", "30000", "30000", "0"], ["15", "0", "0", "-"], ["1520", "1495", "1485", ""]),
+        riichi_row("efgh", ["25000"] * 4, ["0"] * 4, ["1500"] * 4),
+    ]
+    pt = [
+        ["Time"] + [""] * 12,
+        pt_row("2026-01-05 19:00:00", "a", "b", "c", "d"),
+        ["2026-01-06 19:00:00", "b", "", "50", "c", "", "x", "d", "", "-10", "a", "", ""],
+        pt_row("2026-01-07 19:00:00", "e", "f", "g", "h"),
+    ]
+    mirror.sync({
+        "Games Riichi": WorksheetSnapshot("Games Riichi", riichi),
+        "Games/pt": WorksheetSnapshot("Games/pt", pt),
+    })
+    # 第 2 行 a 的 MMR 变动不是数字；空白 PT 按 0
+    assert mirror.recent_riichi("a", 10) == [(2, 3, None, None, 4), (1, 0, 15.0, 1515.0, 1)]
+    assert mirror.recent_pt("a", 10) == [0.0, 10.0]
+    # c 的 PT 不是数字那局跳过
+    assert mirror.recent_pt("c", 10) == [10.0]
+    assert mirror.recent_riichi("c", 1) == [(2, 1, 0.0, 1495.0, 2)]
@@ -0,0 +1,138 @@
+import threading
+import time
+
+import pytest
+
+import sheet_scheduler
+from sheet_scheduler import (
+    LANE_BACKGROUND, LANE_INTERACTIVE, LANE_WRITE, RequestScheduler, SheetQuotaError,
+)
+
+
+class FakeClock:
+    """代替 sheet_scheduler 里的 time 模块：monotonic() 只在 advance() / sleep() 时前进"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class HttpError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(sheet_scheduler, "time", clock)
+    return clock
+
+
+def failing(codes, calls):
+    """前几次按 codes 依次抛出 HTTP 错误，之后返回 'ok'"""
+    def func():
+        calls.append(len(calls))
+        if len(calls) <= len(codes):
+            raise HttpError(codes[len(calls) - 1])
+        return "ok"
+    return func
+
+
+# --- 令牌桶 ---
+def test_token_bucket_spends_and_refills(clock):
+    scheduler = RequestScheduler(per_minute=60, burst=3)
+    for _ in range(3):
+        assert scheduler.execute(lambda: "ok") == "ok"
+    assert scheduler.metrics()["tokens"] == 0
+
+    clock.advance(1.5)
+    assert scheduler.metrics()["tokens"] == pytest.approx(1.5)
+    clock.advance(100)
+    assert scheduler.metrics()["tokens"] == 3  # 不超过桶的容量
+
+
+# --- 通道优先级 ---
+def test_waiting_requests_are_served_by_lane_priority(clock):
+    scheduler = RequestScheduler(per_minute=60, burst=1)
+    scheduler.execute(lambda: None)  # 用掉唯一的令牌
+    order = []
+
+    def request(lane, name):
+        with scheduler.lane(lane):
+            scheduler.execute(order.append, name)
+
+    threads = []
+    for lane, name in ((LANE_BACKGROUND, "background"), (LANE_INTERACTIVE, "interactive"), (LANE_WRITE, "write")):
+        thread = threading.Thread(target=request, args=(lane, name))
+        thread.start()
+        threads.append(thread)
+    deadline = time.monotonic() + 5
+    while sum(lane["queued"] for lane in scheduler.metrics()["lanes"].values()) < 3:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+    # 每次只放一个令牌，看谁先拿到
+    for served in range(1, 4):
+        with scheduler._cond:
+            clock.advance(1)
+            scheduler._cond.notify_all()
+        while len(order) < served:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+    for thread in threads:
+        thread.join(5)
+    assert order == ["write", "interactive", "background"]
+
+
+# --- 重试 ---
+def test_reads_retry_on_429_and_5xx(clock):
+    scheduler = RequestScheduler(per_minute=600, burst=10)
+    calls = []
+    assert scheduler.execute(failing([429, 503], calls)) == "ok"
+    assert len(calls) == 3
+    assert len(clock.sleeps) == 2
+    assert scheduler.metrics()["lanes"]["interactive"]["retries"] == 2
+
+
+def test_writes_retry_only_on_429(clock):
+    scheduler = RequestScheduler(per_minute=600, burst=10)
+    calls = []
+    with scheduler.lane(LANE_WRITE):
+        assert scheduler.execute(failing([429], calls)) == "ok"
+        assert len(calls) == 2
+
+        # 5xx 时可能已经写进去了，不能自动重发
+        calls = []
+        with pytest.raises(HttpError):
+            scheduler.execute(failing([503], calls))
+        assert len(calls) == 1
+
+
+def test_other_errors_are_not_retried(clock):
+    scheduler = RequestScheduler(per_minute=600, burst=10)
+    calls = []
+    with pytest.raises(HttpError):
+        scheduler.execute(failing([400], calls))
+    assert len(calls) == 1
+    assert clock.sleeps == []
+
+
+def test_gives_up_after_max_retries(clock):
+    scheduler = RequestScheduler(per_minute=600, burst=10, max_retries=2)
+    calls = []
+    with pytest.raises(SheetQuotaError):
+        scheduler.execute(failing([429] * 5, calls))
+    assert len(calls) == 3
+    assert scheduler.metrics()["lanes"]["interactive"]["failures"] == 1
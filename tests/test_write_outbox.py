@@ -0,0 +1,165 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("gspread.utils")
+
+from write_outbox import GroupCommitter, OutboxEntry, WriteOutbox, game_key, match_game_rows, plan_appends
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return WriteOutbox(str(tmp_path / "outbox.db"))
+
+
+def run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 5))
+
+
+class Recorder:
+    """commit(entries)：记下每批提交的 (id, attempts)，payload 里 bad=True 的条目让整批失败"""
+
+    def __init__(self, transient_failures=0):
+        self.batches = []
+        self.transient_failures = transient_failures
+
+    async def __call__(self, entries):
+        self.batches.append([(e.id, e.attempts) for e in entries])
+        if self.transient_failures:
+            self.transient_failures -= 1
+            raise ConnectionError("offline")
+        if any(e.payload.get("bad") for e in entries):
+            raise ValueError("bad request")
+        return {e.id: e.payload["n"] for e in entries}
+
+
+def committer(outbox, commit, **kwargs):
+    return GroupCommitter(outbox, commit, window=0, retry_interval=0, **kwargs)
+
+
+def test_commits_in_order_as_one_batch(outbox):
+    async def main():
+        commit = Recorder()
+        writer = committer(outbox, commit)
+        submitted = [writer.submit("game", {"n": n}) for n in range(3)]
+        writer.start()
+        results = [await future for _, future in submitted]
+        return commit.batches, [entry_id for entry_id, _ in submitted], results
+
+    batches, ids, results = run(main())
+    assert batches == [[(i, 0) for i in ids]]
+    assert results == [0, 1, 2]
+    assert len(outbox) == 0
+
+
+def test_transient_failure_keeps_order_and_counts_attempts(outbox):
+    async def main():
+        commit = Recorder(transient_failures=1)
+        writer = committer(outbox, commit)
+        submitted = [writer.submit("game", {"n": n}) for n in range(2)]
+        writer.start()
+        results = [await future for _, future in submitted]
+        return commit.batches, [entry_id for entry_id, _ in submitted], results
+
+    batches, ids, results = run(main())
+    assert batches == [[(i, 0) for i in ids], [(i, 1) for i in ids]]
+    assert results == [0, 1]
+
+
+def test_bad_entry_is_isolated(outbox):
+    async def main():
+        commit = Recorder()
+        writer = committer(outbox, commit)
+        submitted = [writer.submit("game", {"n": n, "bad": n == 1}) for n in range(3)]
+        writer.start()
+        outcomes = []
+        for _, future in submitted:
+            try:
+                outcomes.append(await future)
+            except ValueError as e:
+                outcomes.append(str(e))
+        # 找到坏的那条之后恢复成批提交
+        later = writer.submit("game", {"n": 3})
+        later2 = writer.submit("game", {"n": 4})
+        outcomes += [await later[1], await later2[1]]
+        return commit.batches, outcomes
+
+    batches, outcomes = run(main())
+    assert outcomes == [0, "bad request", 2, 3, 4]
+    assert [len(batch) for batch in batches] == [3, 1, 1, 1, 2]
+    assert [entry_id for batch in batches[1:4] for entry_id, _ in batch] == [1, 2, 3]
+    assert len(outbox) == 0
+
+
+def test_released_entry_is_reported_through_on_commit(outbox):
+    async def main():
+        reported = []
+
+        async def on_commit(entry, result, error):
+            reported.append((entry.id, result, error))
+
+        writer = committer(outbox, Recorder(), on_commit=on_commit)
+        entry_id, future = writer.submit("game", {"n": 7})
+        writer.release(entry_id)
+        _, other = writer.submit("game", {"n": 8})
+        writer.start()
+        await other
+        return entry_id, future.cancelled(), reported
+
+    entry_id, cancelled, reported = run(main())
+    assert cancelled
+    assert reported == [(entry_id, 7, None)]
+
+
+# --- 重试前查重 ---
+PLAYERS = ["A", "B", "C", "D"]
+
+
+def sheet_rows(games):
+    """[(时间, 名字, 分数文字)] -> (Games Riichi 行, Games/pt 行)，分数按表格显示的文字"""
+    riichi = [["P1", "P2", "P3", "P4", "S1", "S2", "S3", "S4"]]
+    pt = [["Time"]]
+    for time_str, names, scores in games:
+        riichi.append(list(names) + list(scores))
+        pt.append([time_str])
+    return riichi, pt
+
+
+def test_game_key_compares_scores_numerically():
+    written = game_key("2026-01-05 19:00:00", PLAYERS, [25000, 35000, 30000, 10000])
+    assert written == game_key(" 2026-01-05 19:00:00", PLAYERS, ["25,000", "35000.0", " 30000 ", "10000"])
+    assert written != game_key("2026-01-05 19:00:00", PLAYERS, [25000, 35000, 10000, 30000])
+
+
+def test_match_game_rows_finds_formatted_scores():
+    riichi, pt = sheet_rows([
+        ("2026-01-05 18:00:00", PLAYERS, ["40,000", "30,000", "20,000", "10,000"]),
+        ("2026-01-05 19:00:00", PLAYERS, ["25,000", "35,000", "30,000", "10,000"]),
+    ])
+    games = [
+        ("2026-01-05 19:00:00", PLAYERS, [25000, 35000, 30000, 10000]),
+        ("2026-01-05 20:00:00", PLAYERS, [25000, 35000, 30000, 10000]),
+    ]
+    assert match_game_rows(riichi, pt, games) == [3, None]
+
+
+def test_replay_skips_rows_already_written():
+    game = {"time_str": "2026-01-05 19:00:00", "players_ordered": PLAYERS, "scores_ordered": [25000, 35000, 30000, 10000]}
+    entries = [
+        OutboxEntry(1, "game", game, None, 1),  # 上次其实已经写进去了
+        OutboxEntry(2, "game", dict(game, time_str="2026-01-05 20:00:00"), None, 1),
+        OutboxEntry(3, "register", {"player_name": "Alice"}, None, 1),  # 已经注册过
+        OutboxEntry(4, "register", {"player_name": "Bob"}, None, 0),
+    ]
+    riichi, pt = sheet_rows([("2026-01-05 19:00:00", PLAYERS, ["25,000", "35,000", "30,000", "10,000"])])
+    rows = match_game_rows(riichi, pt, [(e.payload["time_str"], PLAYERS, e.payload["scores_ordered"]) for e in entries[:2]])
+    done_rows = {e.id: row for e, row in zip(entries[:2], rows) if row is not None}
+
+    appends, games, results = plan_appends(entries, done_rows, {"alice"})
+    assert results == {1: 2}
+    assert [e.id for e in games] == [2]
+    assert appends == {
+        "Games/pt": [["2026-01-05 20:00:00"]],
+        "Games Riichi": [PLAYERS + [25000, 35000, 30000, 10000]],
+        "Ratings": [["Bob", 1500]],
+    }
@@ -0,0 +1,280 @@
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import threading
+from collections import namedtuple
+
+from sheet_mirror import SHEET_MIRROR_PATH
+from sheet_scheduler import SheetQuotaError, status_code
+
+# --- 1. 配置 ---
+# 收到第一条写入后再等多久 (秒)，把这段时间里的写入合并成一次请求
+GROUP_COMMIT_WINDOW = float(os.getenv("GROUP_COMMIT_WINDOW", "1.5"))
+# 一次请求最多合并多少条
+GROUP_COMMIT_MAX = int(os.getenv("GROUP_COMMIT_MAX", "50"))
+# 写入失败 (连不上 / 限流) 后多久再试
+WRITE_RETRY_INTERVAL = float(os.getenv("WRITE_RETRY_INTERVAL", "30"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,  -- 写入顺序
+    kind TEXT NOT NULL,                    -- 'game' / 'register'
+    payload TEXT NOT NULL,                 -- JSON，写入需要的参数
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,   -- 已经发出过几次 (>0 说明可能已经写进去了，再写前要先查重)
+    last_error TEXT,
+    notify TEXT                            -- JSON，写入后要更新的 Discord 消息 {channel_id, message_id}
+);
+"""
+
+# attempts 是取出时的值 (这次发送之前)
+OutboxEntry = namedtuple("OutboxEntry", "id kind payload notify attempts")
+
+
+def is_transient_error(error):
+    """连不上 / 超时 / 限流 / 服务端出错 -> 稍后重试有意义 (留在队列里)；其他错误直接报告"""
+    if isinstance(error, (OSError, SheetQuotaError)):  # 包括 ConnectionError、TimeoutError、requests 的网络错误
+        return True
+    code = status_code(error)
+    return code is not None and (code == 429 or code >= 500)
+
+
+# --- 2. 本地写入队列 ---
+class WriteOutbox:
+    """
+    所有 /record_game /register 的写入先存进本地 SQLite (重启也不会丢)，
+    再由 GroupCommitter 按顺序成批写进表格，写成功才删除。
+    """
+
+    def __init__(self, path=SHEET_MIRROR_PATH):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if "notify" not in columns:  # 旧版本建的表
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN notify TEXT")
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def enqueue(self, kind, payload, notify=None):
+        """存入一条待写入的操作，返回它的 id"""
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO outbox (kind, payload, created_at, notify) VALUES (?, ?, ?, ?)",
+                (
+                    kind,
+                    json.dumps(payload, ensure_ascii=False),
+                    time.time(),
+                    json.dumps(notify) if notify else None,
+                ),
+            )
+            return cur.lastrowid
+
+    def position(self, entry_id):
+        """这条排在队列第几 (从 1 开始)"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE id <= ?", (entry_id,)).fetchone()[0]
+
+    def pending(self, limit=None):
+        """[OutboxEntry, ...] 按写入顺序"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, payload, notify, attempts FROM outbox ORDER BY id LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [
+            OutboxEntry(entry_id, kind, json.loads(payload), json.loads(notify) if notify else None, attempts)
+            for entry_id, kind, payload, notify, attempts in rows
+        ]
+
+    def begin(self, ids):
+        """发送之前先记一次尝试：万一发出去之后进程挂了，重启后知道要先查重"""
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE outbox SET attempts = attempts + 1 WHERE id = ?", [(i,) for i in ids])
+
+    def fail(self, ids, error):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE outbox SET last_error = ? WHERE id = ?", [(str(error), i) for i in ids])
+
+    def remove(self, ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+
+# --- 3. 成批提交 ---
+class GroupCommitter:
+    """
+    write-behind：submit() 只把写入存进 WriteOutbox 就返回，指令可以马上回复用户。
+    后台任务收到新写入后等 window 秒，把队列前面最多 max_batch 条交给 commit(entries) 一次写完
+    (commit 是 async 函数，返回 {id: 结果})，成功后删除并通知等待的 Future。
+    - 按 id 顺序提交，失败就停在原地，下一轮从同一条开始，顺序不会乱
+    - 连不上 / 限流：retry_interval 秒后重试
+    - 其他错误 (例如请求格式错)：逐条提交找出坏的那条，丢掉并报告，后面的继续
+    没有人在等的条目 (等待超时 / 重启前留下的) 提交后调用 on_commit(entry, 结果, 错误) 通知
+    """
+
+    def __init__(self, outbox, commit, on_commit=None,
+                 window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX, retry_interval=WRITE_RETRY_INTERVAL):
+        self.outbox = outbox
+        self.commit = commit
+        self.on_commit = on_commit
+        self.window = window
+        self.max_batch = max_batch
+        self.retry_interval = retry_interval
+        self.last_error = None
+        self._waiters = {}  # id -> asyncio.Future
+        self._wake = None
+        self._task = None
+        self._isolate = 0  # 还要逐条提交几轮
+
+    def start(self):
+        """在事件循环里启动后台任务 (已经在跑就什么都不做)"""
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            if len(self.outbox):
+                self._wake.set()  # 重启前留下的写入
+
+    def submit(self, kind, payload, notify=None):
+        """存入队列，返回 (id, Future)；Future 在写进表格后得到 commit 的结果"""
+        entry_id = self.outbox.enqueue(kind, payload, notify)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[entry_id] = future
+        if self._wake is not None:
+            self._wake.set()
+        return entry_id, future
+
+    def release(self, entry_id):
+        """不再等这条了 (例如等待超时)：写入后改由 on_commit 通知"""
+        future = self._waiters.pop(entry_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    async def _run(self):
+        while True:
+            if not len(self.outbox):
+                await self._wake.wait()
+            self._wake.clear()
+            await asyncio.sleep(self.window)
+
+            entries = self.outbox.pending(1 if self._isolate else self.max_batch)
+            if not entries:
+                continue
+            self._isolate = max(0, self._isolate - 1)
+            ids = [entry.id for entry in entries]
+            self.outbox.begin(ids)
+            try:
+                results = await self.commit(entries)
+            except Exception as e:
+                self.last_error = e
+                self.outbox.fail(ids, e)
+                if is_transient_error(e):
+                    print(f"⚠️ 批量写入 {len(entries)} 条失败，{self.retry_interval:.0f}s 后重试: {e}")
+                    await asyncio.sleep(self.retry_interval)
+                elif len(entries) > 1:
+                    print(f"⚠️ 批量写入 {len(entries)} 条失败，改为逐条写入: {e}")
+                    self._isolate = len(entries)
+                else:
+                    print(f"❌ 第 {entries[0].id} 条 ({entries[0].kind}) 无法写入，已丢弃: {e}")
+                    self.outbox.remove(ids)
+                    self._isolate = 0  # 找到了，恢复成批提交
+                    await self._resolve(entries[0], None, e)
+                continue
+
+            self.last_error = None
+            self.outbox.remove(ids)
+            print(f"📮 已批量写入 {len(entries)} 条 (队列剩余 {len(self.outbox)} 条)")
+            for entry in entries:
+                await self._resolve(entry, results.get(entry.id), None)
+
+    async def _resolve(self, entry, result, error):
+        future = self._waiters.pop(entry.id, None)
+        if future is not None and not future.done():
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+            return
+        if self.on_commit is not None:
+            try:
+                await self.on_commit(entry, result, error)
+            except Exception as e:
+                print(f"⚠️ 写入结果通知失败: {e}")
+
+    def metrics(self):
+        return {
+            "queued": len(self.outbox),
+            "waiting": len(self._waiters),
+            "last_error": str(self.last_error) if self.last_error else None,
+        }
+
+
+# --- 4. 重试前查重 ---
+def score_key(value):
+    """分数按数值比较：写入的是数字，读回来的文字可能带千分位 / 小数点 ('25,000'、'25000.0')"""
+    text = str(value).strip().replace(",", "")
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def game_key(time_str, players_ordered, scores_ordered):
+    """
+    一局的幂等键：时间 + 4 个名字 (和表格里存的文字一致) + 4 个分数 (数值)。
+    写入超时后重试前，先在表格末尾找同样的键，找到就说明上次其实已经写进去了
+    """
+    return (
+        (str(time_str).strip(),)
+        + tuple(str(v).strip() for v in players_ordered)
+        + tuple(score_key(v) for v in scores_ordered)
+    )
+
+
+def entry_game(entry):
+    """对局条目 -> (time_str, players_ordered, scores_ordered)"""
+    p = entry.payload
+    return p["time_str"], p["players_ordered"], p["scores_ordered"]
+
+
+def match_game_rows(riichi_rows, pt_rows, games, lookback=50):
+    """
+    在两张对局表 (get_values() 的结果，按行号对齐) 末尾找这几局，
+    返回对应的 Games Riichi 行号列表 (1-based，找不到的是 None)
+    """
+    wanted = {game_key(*game) for game in games}
+    found = {}
+    for pos in range(min(len(riichi_rows), len(pt_rows)) - 1, max(0, len(riichi_rows) - 1 - lookback - len(games)), -1):
+        row_key = game_key(pt_rows[pos][0], riichi_rows[pos][:4], riichi_rows[pos][4:8])
+        if row_key in wanted:
+            found.setdefault(row_key, pos + 1)  # rows[0] 是第 1 行 (表头)
+    return [found.get(game_key(*game)) for game in games]
+
+
+def plan_appends(entries, done_rows, known):
+    """
+    一组条目要追加的行：done_rows 是 {id: 行号} (重试的对局已经在表格里)，
+    known 是 Ratings 里已有的名字 (小写)。返回 (appends, 要写的对局条目, 已经有结果的 {id: 行号})
+    """
+    appends = {"Ratings": [], "Games/pt": [], "Games Riichi": []}
+    games, results = [], {}
+    for entry in entries:
+        p = entry.payload
+        if entry.id in done_rows:
+            print(f"📮 {p['time_str']} 的对局已经在表格里，跳过")
+            results[entry.id] = done_rows[entry.id]
+        elif entry.kind == "game":
+            appends["Games/pt"].append([p["time_str"]])
+            appends["Games Riichi"].append(p["players_ordered"] + p["scores_ordered"])
+            games.append(entry)
+        elif entry.attempts and p["player_name"].lower() in known:
+            print(f"📮 {p['player_name']} 已经在 Ratings 里，跳过")
+        else:
+            # 名字在 A 列，初始分数在 B 列
+            appends["Ratings"].append([p["player_name"], 1500])
+    return {name: rows for name, rows in appends.items() if rows}, games, results